@@ -0,0 +1,4 @@
+# Benchmarks for BotDriver modules. Each module in this package can be run as a
+# script from the src/ directory, e.g.:
+#
+#   python -m driver.benchmarks.barscan
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+"""Benchmark the barscan door detector against the original per-pixel scan.
+
+Both detectors are run over the same synthetic edge images at a few common
+resolutions, and the frames per second for each are printed in a table."""
+
+import sys
+import time
+import cv
+import numpy
+from driver.modules.pipelines import ScanningDoorDetectPipe
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+
+class LegacyScanningDoorDetectPipe(ScanningDoorDetectPipe):
+    """The original pure Python barscan, kept here for comparison."""
+
+    def process(self, image, bar_size=None):
+        if bar_size is None:
+            bar_size = self.bar_size
+        row_sums = []
+        col_sums = []
+        for row in range(image.height):
+            neighbors = [self.sum_cvmat(image[row + i])
+                         for i in range(-bar_size, bar_size)
+                         if row + i >= 0 and row + i < image.height]
+            row_sums.append(sum(neighbors))
+        for col in range(image.width):
+            neighbors = [self.sum_cvmat(image[:, col + i])
+                         for i in range(-bar_size, bar_size)
+                         if col + i >= 0 and col + i < image.width]
+            col_sums.append(sum(neighbors))
+
+        max_col_1 = max(enumerate(col_sums), key=lambda elem: elem[1])[0]
+        col_sums[max_col_1] = 0
+        max_col_2 = max(enumerate(col_sums), key=lambda elem: elem[1])[0]
+        max_row_1 = max(enumerate(row_sums), key=lambda elem: elem[1])[0]
+        row_sums[max_row_1] = 0
+        max_row_2 = max(enumerate(row_sums), key=lambda elem: elem[1])[0]
+
+        top_left = (min(max_col_1, max_col_2), max(max_row_1, max_row_2))
+        bottom_right = (max(max_col_1, max_col_2), min(max_row_1, max_row_2))
+        image = self.grayscale_to_color(image)
+        cv.Rectangle(image, top_left, bottom_right, cv.Scalar(0, 0, 255))
+        return image
+
+def make_edge_image(width, height, seed=0):
+    """Build a synthetic edge image: speckle noise with a door outline in it."""
+    random = numpy.random.RandomState(seed)
+    pixels = numpy.where(random.random_sample((height, width)) > 0.97,
+                         255, 0).astype(numpy.uint8)
+    left, right = width // 3, 2 * width // 3
+    top, bottom = height // 6, height - 1
+    pixels[top:bottom, left] = 255
+    pixels[top:bottom, right] = 255
+    pixels[top, left:right] = 255
+    image = cv.CreateImage((width, height), cv.IPL_DEPTH_8U, 1)
+    cv.SetData(image, pixels.tostring(), width)
+    return image
+
+def frames_per_second(pipe, image, min_frames=3, min_seconds=1.0):
+    """Run a pipe repeatedly over one image and measure its frame rate."""
+    frames = 0
+    start = time.time()
+    elapsed = 0.0
+    while frames < min_frames or elapsed < min_seconds:
+        pipe.process(image)
+        frames += 1
+        elapsed = time.time() - start
+    return frames / elapsed
+
+def main():
+    bar_size = 1
+    if len(sys.argv) > 1:
+        bar_size = int(sys.argv[1])
+
+    legacy = LegacyScanningDoorDetectPipe(None, bar_size)
+    barscan = ScanningDoorDetectPipe(None, bar_size)
+
+    print "Barscan door detector, bar size %d" % (bar_size,)
+    print "%-12s %12s %12s %10s" % ("Resolution", "Before FPS", "After FPS",
+                                   "Speedup")
+    for width, height in RESOLUTIONS:
+        image = make_edge_image(width, height)
+        before = frames_per_second(legacy, image)
+        after = frames_per_second(barscan, image)
+        print "%-12s %12.2f %12.2f %9.1fx" % ("%dx%d" % (width, height),
+                                             before, after, after / before)
+
+if __name__ == "__main__":
+    main()
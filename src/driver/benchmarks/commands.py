@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+"""Benchmark the command decoder.
+
+A long stream of mixed commands is run through the decoder twice: once split
+into tiny fragments, as it might arrive over a congested link, and once in
+large coalesced reads. Text and binary command streams are measured
+separately, alongside the old split-on-semicolons parser for reference."""
+
+import random
+import time
+from driver.util.commands import CommandDecoder, encode_binary, encode_text
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+COMMANDS = [("IMAGE",), ("MOVE", "FORWARD"), ("MOVE", "BACKWARD"),
+            ("ROTATE", "CLOCKWISE"), ("ROTATE", "COUNTERCLOCKWISE"),
+            ("EDGE",), ("RAW",), ("DOOR",), ("STREAM", "15.0"),
+            ("STOP_STREAM",)]
+
+def make_stream(encode, count, seed=0):
+    random.seed(seed)
+    return "".join(encode(*random.choice(COMMANDS)) for i in range(count))
+
+def fragment(data, low, high, seed=0):
+    """Cut data into chunks with random lengths between low and high."""
+    random.seed(seed)
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = random.randint(low, high)
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+def decode_all(chunks):
+    decoder = CommandDecoder()
+    count = 0
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    return count
+
+def split_all(chunks):
+    """The old parser, which only works when reads line up with commands."""
+    count = 0
+    for chunk in chunks:
+        for packet in chunk.split(";"):
+            packet.split()
+            count += 1
+    return count
+
+def commands_per_second(parse, chunks, expected):
+    start = time.time()
+    count = parse(chunks)
+    elapsed = time.time() - start
+    if expected is not None and count != expected:
+        print "WARNING: parsed %d commands, expected %d." % (count, expected)
+    return count / elapsed
+
+def main(count=200000):
+    print "%-10s %-12s %-10s %15s" % ("Format", "Input", "Parser", "Commands/sec")
+    for format_name, encode in (("text", encode_text),
+                                ("binary", encode_binary)):
+        data = make_stream(encode, count)
+        for input_name, chunks in (("fragmented", fragment(data, 1, 7)),
+                                   ("coalesced", fragment(data, 4096, 4096))):
+            rate = commands_per_second(decode_all, chunks, count)
+            print "%-10s %-12s %-10s %15.0f" % (format_name, input_name,
+                                                "decoder", rate)
+            if format_name == "text" and input_name == "coalesced":
+                # Commands cut in half at chunk boundaries get counted twice
+                # here, so don't check the count.
+                rate = commands_per_second(split_all, chunks, None)
+                print "%-10s %-12s %-10s %15.0f" % (format_name, input_name,
+                                                    "split", rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+"""Benchmark tile delta encoding against sending whole JPEGs.
+
+A synthetic, mostly static scene (a textured background with a small object
+moving across it and a little sensor noise) is encoded both ways. The delta
+packets are sent over a local socket to a DeltaDecoder running on another
+thread, which acknowledges each frame the way a client would, so the encoder
+sees the same acknowledgement lag it would on a real link. Prints the bytes
+sent each way and how faithfully the decoder reconstructed the frames."""
+
+import math
+import socket
+import sys
+import threading
+import numpy
+from driver.modules.deltacodec import DeltaEncoder, DeltaDecoder, encode_jpeg
+from driver.util.commands import CommandDecoder
+from driver.util import framing
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def make_scene(width, height, frames, seed=0):
+    """Generate frames of a mostly static scene."""
+    random = numpy.random.RandomState(seed)
+    # Blocky texture, so there's something for JPEG to chew on.
+    texture = random.randint(0, 256, (height // 8 + 1, width // 8 + 1, 3))
+    background = numpy.repeat(numpy.repeat(texture, 8, axis=0), 8, axis=1)
+    background = background[:height, :width].astype(numpy.int16)
+    size = max(8, width // 16)
+    for i in range(frames):
+        frame = background + random.randint(-1, 2, background.shape)
+        x = (i * 3) % (width - size)
+        y = height // 2
+        frame[y:y + size, x:x + size] = (0, 0, 255)
+        yield numpy.clip(frame, 0, 255).astype(numpy.uint8)
+
+def psnr(a, b):
+    error = numpy.mean((a.astype(numpy.float64) - b) ** 2)
+    if error == 0:
+        return float("inf")
+    return 10 * math.log10(255.0 ** 2 / error)
+
+def run_client(conn, results, originals):
+    """Decode frames off the socket and acknowledge each one."""
+    decoder = DeltaDecoder()
+    try:
+        while True:
+            seq, timestamp, packet = framing.recv_frame(conn)
+            if not packet:
+                break
+            seq, frame = decoder.decode(packet)
+            results.append(psnr(frame, originals[seq]))
+            conn.sendall("ACK %d;" % (seq,))
+    except framing.FramingError:
+        pass
+
+def main(width=640, height=480, frames=300, quality=80):
+    scene = list(make_scene(width, height, frames))
+    originals = dict(enumerate(scene, 1))
+
+    server, client = socket.socketpair()
+    results = []
+    thread = threading.Thread(target=run_client,
+                              args=(client, results, originals))
+    thread.start()
+
+    encoder = DeltaEncoder(quality=quality)
+    acks = CommandDecoder()
+    full_bytes = 0
+    delta_bytes = 0
+    server.setblocking(0)
+    for seq, frame in originals.items():
+        # Pick up whatever acknowledgements have arrived, without waiting.
+        try:
+            for name, args in acks.feed(server.recv(4096)):
+                encoder.acknowledge(int(args[0]))
+        except socket.error:
+            pass
+        full_bytes += len(encode_jpeg(frame, quality))
+        packet = encoder.encode(seq, frame)
+        delta_bytes += len(packet)
+        server.setblocking(1)
+        server.sendall(framing.pack_frame(seq, 0, packet))
+        server.setblocking(0)
+
+    server.setblocking(1)
+    server.sendall(framing.pack_frame(0, 0, ""))
+    thread.join()
+
+    stats = encoder.stats()
+    print "%dx%d, %d frames, JPEG quality %d" % (width, height, frames,
+                                                 quality)
+    print "Whole JPEGs:  %10d bytes" % (full_bytes,)
+    print "Delta:        %10d bytes (%d keyframes, %d tiles)" % (
+        delta_bytes, stats["keyframes"], stats["tiles_sent"])
+    print "Reduction:    %10.1fx" % (float(full_bytes) / delta_bytes,)
+    print "Decoded PSNR: %10.1f dB minimum, %.1f dB mean" % (
+        min(results), sum(results) / len(results))
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
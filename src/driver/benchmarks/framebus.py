@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+"""Benchmark delivering frames to local processes through a frame bus.
+
+One process publishes synthetic frames to a FrameBus as fast as it can (or
+at --fps), while 1, 4 and then 8 reader processes each take the newest frame
+whenever there's a new one. Readers look at their frames in place, checking
+a sample of pixels and then that the frame is still intact, the way a
+detector would. Prints the writer's frame rate and the rate frames were
+delivered to each reader."""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import cv
+import numpy
+from driver.modules.framebus import FrameBus, FrameBusReader
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+READER_COUNTS = [1, 4, 8]
+
+def run_reader(path, stop, results):
+    reader = FrameBusReader(path)
+    delivered = 0
+    torn = 0
+    seq = 0
+    start = time.time()
+    while not stop.is_set():
+        frame = reader.next_frame(seq, timeout=0.1)
+        if frame is None:
+            continue
+        seq = frame.seq
+        # Stands in for whatever the reader does with the frame.
+        frame.pixels[::16, ::16].sum()
+        if frame.valid():
+            delivered += 1
+        else:
+            torn += 1
+    results.put((delivered, torn, time.time() - start))
+    reader.close()
+
+def run(path, readers, seconds, fps, width, height, slots):
+    frames = [numpy.random.RandomState(i).randint(
+        0, 256, (height, width, 3)).astype(numpy.uint8) for i in range(4)]
+    bus = FrameBus(path, slots)
+    # Create the bus before the readers start looking for it.
+    bus.write(1, time.time(), frames[0], cv.IPL_DEPTH_8U)
+
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_reader,
+                                         args=(path, stop, results))
+                 for i in range(readers)]
+    for process in processes:
+        process.start()
+
+    seq = 1
+    start = time.time()
+    while time.time() - start < seconds:
+        seq += 1
+        bus.write(seq, time.time(), frames[seq % len(frames)],
+                  cv.IPL_DEPTH_8U)
+        if fps:
+            delay = start + (seq - 1) / float(fps) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.time() - start
+    stop.set()
+    counts = [results.get() for process in processes]
+    for process in processes:
+        process.join()
+    bus.close()
+    return (seq - 1) / elapsed, counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="how long to publish for at each reader count")
+    parser.add_argument("--fps", type=float, default=None,
+                        help="publish at this rate instead of flat out")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--slots", type=int, default=4)
+    args = parser.parse_args()
+
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    path = os.path.join(directory or tempfile.gettempdir(),
+                        "framebus-bench-%d" % (os.getpid(),))
+
+    print "%dx%d frames, %d slots" % (args.width, args.height, args.slots)
+    print "%-8s %12s %18s %18s %8s" % ("Readers", "Written FPS",
+                                       "Delivered FPS", "(min per reader)",
+                                       "Torn")
+    for readers in READER_COUNTS:
+        written, counts = run(path, readers, args.seconds, args.fps,
+                              args.width, args.height, args.slots)
+        rates = [delivered / elapsed for delivered, torn, elapsed in counts]
+        torn = sum(count[1] for count in counts)
+        print "%-8d %12.1f %18.1f %18.1f %8d" % (
+            readers, written, sum(rates) / len(rates), min(rates), torn)
+
+if __name__ == "__main__":
+    main()
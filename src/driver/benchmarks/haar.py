@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+"""Benchmark the tracking Haar door detector against the full frame one.
+
+Both detectors are run over the same frames: a directory of images or a
+video given with --source, or else synthetic frames of a door drifting across
+a wall. The full frame detector is the baseline. A frame counts as detected
+by the tracker if one of its doors overlaps one of the baseline's by at least
+half (intersection over union), and the detection rate is the share of the
+frames in which the baseline found a door that the tracker also got.
+
+The cascade was trained on real doors, so for meaningful detection rates use
+real footage; synthetic frames are only good for timing."""
+
+import argparse
+import shutil
+import tempfile
+import time
+import cv
+from driver.benchmarks.pipelines import make_frames
+from driver.modules.pipelines import (HaarDoorDetectPipe,
+                                      TrackingHaarDoorDetectPipe)
+from driver.modules.sources import FileSource
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def overlap(a, b):
+    """Get the intersection over union of two (x, y, w, h) rectangles."""
+    left = max(a[0], b[0])
+    top = max(a[1], b[1])
+    right = min(a[0] + a[2], b[0] + b[2])
+    bottom = min(a[1] + a[3], b[1] + b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    intersection = (right - left) * (bottom - top)
+    return float(intersection) / (a[2] * a[3] + b[2] * b[3] - intersection)
+
+def run(detector, frames):
+    """Run a detector over every frame, returning its doors and the time."""
+    results = []
+    start = time.time()
+    for frame in frames:
+        results.append(detector.detect(frame))
+    return results, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source",
+                        help="directory of images or video file to use "
+                        "instead of synthetic frames")
+    parser.add_argument("--frames", type=int, default=200,
+                        help="number of frames to run")
+    parser.add_argument("--scale", type=float, default=0.5,
+                        help="how much full scans are shrunk by")
+    parser.add_argument("--interval", type=int, default=10,
+                        help="most frames between full scans")
+    args = parser.parse_args()
+
+    workdir = None
+    path = args.source
+    if not path:
+        workdir = path = tempfile.mkdtemp(prefix="haar-bench-")
+        make_frames(path, 640, 480, count=40)
+    try:
+        source = FileSource(path)
+        # The source reuses one buffer for every frame it reads.
+        frames = [cv.CloneImage(source.read()) for i in range(args.frames)]
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    baseline = HaarDoorDetectPipe(None)
+    tracker = TrackingHaarDoorDetectPipe(None, scan_scale=args.scale,
+                                         scan_interval=args.interval)
+    expected, baseline_time = run(baseline, frames)
+    found, tracker_time = run(tracker, frames)
+
+    with_doors = [i for i, doors in enumerate(expected) if doors]
+    agreed = [i for i in with_doors
+              if any(overlap(a, b) >= 0.5
+                     for a in expected[i] for b in found[i])]
+    extra = [i for i, doors in enumerate(found) if doors and not expected[i]]
+
+    print "%d frames of %dx%d" % (len(frames), frames[0].width,
+                                  frames[0].height)
+    print "%-10s %10s %18s" % ("Detector", "FPS", "Frames with doors")
+    print "%-10s %10.1f %18d" % ("Baseline", len(frames) / baseline_time,
+                                 len(with_doors))
+    print "%-10s %10.1f %18d" % ("Tracking", len(frames) / tracker_time,
+                                 len([doors for doors in found if doors]))
+    print "Speedup: %.1fx" % (baseline_time / tracker_time,)
+    if with_doors:
+        print "Detection rate: %.1f%% of the baseline's detections" % (
+            100.0 * len(agreed) / len(with_doors),)
+    else:
+        print "Detection rate: n/a, the baseline found no doors."
+    print "Frames with doors the baseline didn't find: %d" % (len(extra),)
+    print "Tracker:", tracker.stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#! /usr/bin/env python
+"""Load test the whole driver on localhost, with no robot attached.
+
+The driver runs in a process of its own, as it would on the robot, but with
+a FakeArduino on the other end of its serial port and a FileSource for a
+camera. FakePilots then connect and drive it, at a series of increasing
+loads. Each load step starts a fresh driver and is written
+clients:images:commands, e.g. 4:15:20 for four clients each asking for 15
+images and sending 20 motion commands a second. With more than one client
+the driver runs as a multi-viewer.
+
+For each step the report gives:
+
+  throughput       images and megabytes a second delivered to all clients,
+                   and motion commands a second that reached the Arduino
+  image round trip from an IMAGE request to the whole image arriving
+  serial latency   from a MOVE or ROTATE going out to its byte reaching the
+                   Arduino
+
+The motion module may merge a burst of commands that the port can't keep up
+with into the last of them, so each byte received is matched with the newest
+command for it that was sent before it arrived, and the share of commands
+that got through is reported alongside.
+
+Usage, from the src/ directory:
+
+  python -m driver.benchmarks.loadtest [--steps 1:5:5 2:15:10 ...]
+      [--duration 10] [--output report.json]"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from driver.benchmarks.pipelines import make_frames
+from driver.modules.motion import ArduinoMotionModule
+from driver.util.fakearduino import FakeArduino
+from driver.util.fakepilot import FakePilot
+from driver.util.timing import RollingHistogram
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+DEFAULT_STEPS = ["1:5:5", "1:15:10", "2:15:10", "4:15:20", "8:30:40"]
+
+# The byte the Arduino should get for each motion command.
+SERIAL_BYTES = {"MOVE FORWARD": ArduinoMotionModule.FORWARD,
+                "MOVE BACKWARD": ArduinoMotionModule.BACKWARD,
+                "ROTATE CLOCKWISE": ArduinoMotionModule.ROTATE_CW,
+                "ROTATE COUNTERCLOCKWISE": ArduinoMotionModule.ROTATE_CCW}
+
+# Run in the driver process.
+DRIVER_SCRIPT = """
+import driver.botdriver as botdriver
+settings = botdriver.settings
+settings.CAMERA_FILE = %(frames)r
+settings.CAMERA_FILE_LATENCY = %(latency)r
+settings.ARDUINO_PORT = %(port)r
+settings.BIND_ADDRESS = "127.0.0.1"
+settings.MULTI_VIEWER = %(multi)r
+for name, value in %(overrides)r.items():
+    setattr(settings, name, value)
+bd = botdriver.BotDriver()
+bd.wait_for_connections()
+while 1:
+    bd.read_and_execute()
+"""
+
+def start_driver(frames, latency, port, multi, overrides=None):
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(here), here, env.get("PYTHONPATH", "")])
+    script = DRIVER_SCRIPT % {"frames": frames, "latency": latency,
+                              "port": port, "multi": multi,
+                              "overrides": overrides or {}}
+    # The driver prints a line for every motion command; that's not what
+    # we're here to measure.
+    devnull = open(os.devnull, "w")
+    return subprocess.Popen([sys.executable, "-c", script], env=env,
+                            stdout=devnull)
+
+def serial_latencies(sent, arrivals):
+    """Match bytes the Arduino received with the commands that caused them.
+
+    sent is a list of (time, command) pairs from every client and arrivals a
+    list of (time, byte) pairs. Returns the latency of each matched byte."""
+    pending = {}
+    for when, command in sorted(sent):
+        byte = SERIAL_BYTES.get(command)
+        if byte:
+            pending.setdefault(byte, []).append(when)
+    latencies = []
+    for arrived, byte in arrivals:
+        times = pending.get(byte)
+        if not times:
+            continue
+        # The newest command for this byte sent before it arrived; any older
+        # ones were merged into it.
+        newest = None
+        for i, when in enumerate(times):
+            if when > arrived:
+                break
+            newest = i
+        if newest is None:
+            continue
+        latencies.append(arrived - times[newest])
+        del times[:newest + 1]
+    return latencies
+
+def distribution(samples):
+    """Get the p50, p95, p99 and max of samples in milliseconds."""
+    if not samples:
+        return None
+    histogram = RollingHistogram(len(samples))
+    for sample in samples:
+        histogram.record(sample)
+    p50, p95, p99, worst = histogram.percentiles()
+    return {"p50_ms": p50 * 1000, "p95_ms": p95 * 1000,
+            "p99_ms": p99 * 1000, "max_ms": worst * 1000}
+
+def run_step(step, frames, args, overrides=None, first_commands=()):
+    """Run one load step against a fresh driver and summarize it.
+
+    overrides are settings to change in the driver, and first_commands are
+    sent by the first client before the step starts, e.g. to pick a mode."""
+    clients, image_rate, command_rate = [float(part)
+                                         for part in step.split(":")]
+    clients = int(clients)
+    arduino = FakeArduino()
+    arduino.start()
+    driver = start_driver(frames, args.camera_latency, arduino.path,
+                          clients > 1, overrides)
+    pilots = [FakePilot(source_address="127.0.0.%d" % (10 + i,),
+                        link_rate=args.link_rate)
+              for i in range(clients)]
+    errors = []
+
+    def drive(pilot):
+        try:
+            pilot.run(args.duration, image_rate, command_rate,
+                      args.mode_interval)
+        except Exception, e:
+            errors.append(str(e))
+
+    try:
+        for pilot in pilots:
+            pilot.connect(args.timeout)
+        for command in first_commands:
+            pilots[0].send(command)
+        # Let the driver finish opening the camera and the port, so the
+        # first requests don't count that against it.
+        time.sleep(args.settle)
+        start = time.time()
+        threads = [threading.Thread(target=drive, args=(pilot,))
+                   for pilot in pilots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        # Give the last commands time to reach the port.
+        time.sleep(0.2)
+    finally:
+        for pilot in pilots:
+            pilot.close()
+        driver.kill()
+        driver.wait()
+        arduino.stop()
+
+    sent = [entry for pilot in pilots for entry in pilot.sent]
+    motion_sent = [entry for entry in sent if entry[1] in SERIAL_BYTES]
+    arrivals = [(when, byte) for when, byte in arduino.arrivals()
+                if when >= start]
+    latencies = serial_latencies(motion_sent, arrivals)
+    round_trips = [rtt for pilot in pilots for rtt in pilot.round_trips]
+    images = sum(pilot.images for pilot in pilots)
+    image_bytes = sum(pilot.image_bytes for pilot in pilots)
+    return {"step": step,
+            "clients": clients,
+            "image_rate": image_rate,
+            "command_rate": command_rate,
+            "seconds": elapsed,
+            "images_per_second": images / elapsed,
+            "megabytes_per_second": image_bytes / elapsed / 1e6,
+            "commands_per_second": len(latencies) / elapsed,
+            "commands_sent": len(motion_sent),
+            "commands_delivered": len(latencies),
+            "image_requests_skipped": sum(pilot.skipped for pilot in pilots),
+            "image_requests_lost": sum(pilot.lost for pilot in pilots),
+            "image_round_trip": distribution(round_trips),
+            "serial_latency": distribution(latencies),
+            "errors": errors}
+
+def format_ms(stats, key):
+    if not stats:
+        return "-"
+    return "%.1f" % (stats[key],)
+
+def print_report(results):
+    print "%-10s %8s %8s %9s %9s %9s %9s %9s %10s" % (
+        "Step", "Img/s", "MB/s", "Cmd/s", "RTT p50", "RTT p95", "Ser p50",
+        "Ser p95", "Delivered")
+    for result in results:
+        delivered = "-"
+        if result["commands_sent"]:
+            delivered = "%.0f%%" % (100.0 * result["commands_delivered"] /
+                                    result["commands_sent"],)
+        print "%-10s %8.1f %8.2f %9.1f %9s %9s %9s %9s %10s" % (
+            result["step"], result["images_per_second"],
+            result["megabytes_per_second"], result["commands_per_second"],
+            format_ms(result["image_round_trip"], "p50_ms"),
+            format_ms(result["image_round_trip"], "p95_ms"),
+            format_ms(result["serial_latency"], "p50_ms"),
+            format_ms(result["serial_latency"], "p95_ms"), delivered)
+        for error in result["errors"]:
+            print "  error:", error
+    print "Latencies in milliseconds."
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--steps", nargs="+", default=DEFAULT_STEPS,
+                        help="load steps as clients:images:commands")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to run each step")
+    parser.add_argument("--mode-interval", type=float, default=5.0,
+                        help="seconds between mode switches, 0 for none")
+    parser.add_argument("--source",
+                        help="directory of images or video file to use as "
+                        "the camera instead of synthetic frames")
+    parser.add_argument("--camera-latency", type=float, default=0.0,
+                        help="seconds each camera read takes")
+    parser.add_argument("--link-rate", type=float,
+                        help="bytes a second each client reads images at, to "
+                        "act as a slow link")
+    parser.add_argument("--settle", type=float, default=1.0,
+                        help="seconds to let the driver settle before each "
+                        "step")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="seconds to wait for the driver to listen")
+    parser.add_argument("--output", help="write the report here as JSON")
+    args = parser.parse_args()
+
+    workdir = None
+    frames = args.source
+    if not frames:
+        workdir = frames = tempfile.mkdtemp(prefix="loadtest-")
+        make_frames(workdir, 640, 480, count=8)
+    results = []
+    try:
+        for step in args.steps:
+            print >> sys.stderr, "Running step %s..." % (step,)
+            results.append(run_step(step, frames, args))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    print_report(results)
+    if args.output:
+        report = {"host": platform.node(),
+                  "python": platform.python_version(),
+                  "time": time.time(),
+                  "duration": args.duration,
+                  "source": args.source or "synthetic",
+                  "steps": results}
+        with open(args.output, "w") as out:
+            out.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+"""Benchmark writing motion commands against a fake Arduino.
+
+Measures how long the driver loop is held up by each command when writing to
+the serial port directly and when handing commands to a SerialWriter, then
+checks that a burst of commands ending in a stop gets collapsed, and that the
+writer finds the port again after it disappears for a while."""
+
+import serial
+import time
+from driver.modules.serialwriter import SerialWriter
+from driver.util.fakearduino import FakeArduino
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+BAUD = 115200
+MOTION_COMMANDS = "fblrs"
+
+def time_calls(send, messages):
+    """Get the mean and worst time spent in send() for each message."""
+    worst = 0.0
+    start = time.time()
+    for message in messages:
+        before = time.time()
+        send(message)
+        worst = max(worst, time.time() - before)
+    return (time.time() - start) / len(messages), worst
+
+def bench_call_time(count):
+    messages = [MOTION_COMMANDS[i % len(MOTION_COMMANDS)]
+                for i in range(count)]
+    print "%-14s %15s %15s" % ("Writer", "Mean call (us)", "Worst call (us)")
+
+    arduino = FakeArduino()
+    arduino.start()
+    conn = serial.Serial(arduino.path, BAUD, timeout=1)
+    mean, worst = time_calls(conn.write, messages)
+    conn.close()
+    arduino.stop()
+    print "%-14s %15.1f %15.1f" % ("synchronous", mean * 1e6, worst * 1e6)
+
+    arduino = FakeArduino()
+    arduino.start()
+    writer = SerialWriter(arduino.path, BAUD, supersedes=MOTION_COMMANDS)
+    writer.start()
+    mean, worst = time_calls(writer.submit, messages)
+    writer.stop()
+    arduino.stop()
+    print "%-14s %15.1f %15.1f" % ("SerialWriter", mean * 1e6, worst * 1e6)
+
+def bench_coalescing():
+    # Hold the writer off the port until the whole burst is queued, the way a
+    # slow or reconnecting link would.
+    arduino = FakeArduino()
+    writer = SerialWriter(arduino.path, BAUD, supersedes=MOTION_COMMANDS)
+    for i in range(10):
+        writer.submit("f")
+    writer.submit("c")
+    writer.submit("s")
+    arduino.start()
+    writer.start()
+    arduino.wait_for(2, timeout=5)
+    time.sleep(0.1)
+    print
+    print "Queued 10 x 'f', 'c', 's'; the Arduino received %r." % (
+        arduino.received(),)
+    print "Writer stats:", writer.stats()
+    writer.stop()
+    arduino.stop()
+
+def bench_reconnect(outage=1.0):
+    print
+    # Point the writer at a port that isn't there yet.
+    writer = SerialWriter("/dev/nonexistent", BAUD,
+                          supersedes=MOTION_COMMANDS,
+                          initial_backoff=0.05, max_backoff=0.4)
+    writer.start()
+    writer.submit("f")
+    start = time.time()
+    time.sleep(outage)
+    arduino = FakeArduino()
+    arduino.start()
+    # The writer reads its port each time it reconnects.
+    writer.port = arduino.path
+    arduino.wait_for(1, timeout=5)
+    print "Port came back after %.2fs; first command arrived after %.2fs." % (
+        outage, time.time() - start)
+    writer.stop()
+    arduino.stop()
+
+def main():
+    bench_call_time(2000)
+    bench_coalescing()
+    bench_reconnect()
+
+if __name__ == "__main__":
+    main()
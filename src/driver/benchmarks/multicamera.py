@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+"""Benchmark synchronized multi-camera capture against reading in turn.
+
+Each camera is played by a FileSource over the same frames, with --latency
+seconds added to every grab to stand in for a real camera's exposure and
+readout. Reading the cameras one after another, as several cv.QueryFrame
+calls would, is compared with a MultiCapture grabbing them all at once and
+then retrieving them. For each, the table gives frame sets per second and
+the skew between the first and last camera's frame in each set.
+
+Pass real camera indices with --devices to measure actual hardware."""
+
+import argparse
+import shutil
+import tempfile
+import time
+from driver.benchmarks.pipelines import make_frames
+from driver.modules.multicapture import FrameSet, MultiCapture
+from driver.modules.capture import Frame
+from driver.modules.sources import open_source
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def read_in_turn(sources, seq):
+    """Read each source in turn, as the camera module used to read one."""
+    frames = []
+    for source in sources:
+        image = source.read()
+        frames.append(Frame(seq, time.time(), image))
+    return FrameSet(seq, frames)
+
+def run(capture, count):
+    """Capture count frame sets, returning the time taken and their skews."""
+    skews = []
+    start = time.time()
+    for seq in range(1, count + 1):
+        skews.append(capture(seq).skew)
+    return time.time() - start, skews
+
+def describe(name, elapsed, skews):
+    skews = sorted(skews)
+    mean = sum(skews) / len(skews)
+    p95 = skews[int(0.95 * (len(skews) - 1))]
+    print "%-12s %10.1f %14.2f %14.2f %14.2f" % (
+        name, len(skews) / elapsed, mean * 1000, p95 * 1000,
+        skews[-1] * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cameras", type=int, default=2,
+                        help="number of file-backed cameras")
+    parser.add_argument("--devices", type=int, nargs="+",
+                        help="camera indices to use instead of files")
+    parser.add_argument("--latency", type=float, default=0.015,
+                        help="seconds each file-backed grab takes")
+    parser.add_argument("--frames", type=int, default=100,
+                        help="number of frame sets to capture")
+    args = parser.parse_args()
+
+    workdir = None
+    if args.devices:
+        specs = args.devices
+    else:
+        workdir = tempfile.mkdtemp(prefix="multicamera-bench-")
+        make_frames(workdir, 640, 480, count=8)
+        specs = [workdir] * args.cameras
+    try:
+        sources = [open_source(spec, args.latency) for spec in specs]
+        multi = MultiCapture(sources)
+        in_turn = run(lambda seq: read_in_turn(sources, seq), args.frames)
+        together = run(lambda seq: multi.capture(), args.frames)
+        multi.close()
+        for source in sources:
+            source.close()
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    print "%d cameras, %d frame sets" % (len(specs), args.frames)
+    print "%-12s %10s %14s %14s %14s" % ("Method", "Sets/s", "Mean skew ms",
+                                         "p95 skew ms", "Max skew ms")
+    describe("In turn", *in_turn)
+    describe("Synchronized", *together)
+    print "Capture:", multi.stats()
+
+if __name__ == "__main__":
+    main()
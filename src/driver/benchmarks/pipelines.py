@@ -0,0 +1,257 @@
+#! /usr/bin/env python
+"""Benchmark every camera mode and every pipe, without a camera.
+
+Frames are read from a FileSource: either a directory of images or video
+given with --source, or synthetic frames generated at each of several
+resolutions. Every CameraModule mode is run end to end through capture_jpeg(),
+and every pipe in driver.modules.pipelines is run on its own (after whatever
+it needs in front of it, like edge detection for the door detector).
+
+Each case runs in a child process, so that its peak memory is its own. The
+results are printed as JSON, e.g.
+
+  python -m driver.benchmarks.pipelines --output results.json
+
+and include frames per second, the percentiles of each step's time as
+recorded by driver.util.timing, and peak resident memory."""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import cv
+import numpy
+from driver.modules.camera import CameraModule
+from driver.modules import pipelines
+from driver.modules.pipelines import *
+from driver.modules.sources import FileSource
+from driver.util.timing import Timings, instrument
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+
+MODES = [("raw", CameraModule.RAW_VIDEO_MODE),
+         ("edge", CameraModule.EDGE_DETECT_MODE),
+         ("door", CameraModule.DOOR_DETECT_MODE)]
+
+HAAR_CASCADE = os.path.join(os.path.dirname(pipelines.__file__),
+                            "haarcascade-door.xml")
+
+# Pipe name -> function building a pipeline around that pipe for frames of
+# the given size. Pipes that need a particular kind of input get whatever
+# makes it put in front of them; only the named pipe's own time is reported.
+PIPES = {
+    "NopPipe": lambda width, height: NopPipe(None),
+    "ResizePipe": lambda width, height: ResizePipe(None, width // 2,
+                                                   height // 2),
+    "EdgeDetectPipe": lambda width, height: EdgeDetectPipe(None),
+    "ScanningDoorDetectPipe": lambda width, height: EdgeDetectPipe(
+        ScanningDoorDetectPipe(None)),
+    "HaarDoorDetectPipe": lambda width, height: HaarDoorDetectPipe(
+        None, HAAR_CASCADE),
+    "TrackingHaarDoorDetectPipe": lambda width, height:
+        TrackingHaarDoorDetectPipe(None, HAAR_CASCADE),
+    "TrackingDoorDetectPipe": lambda width, height: TrackingDoorDetectPipe(
+        None, ScanningDoorDetectPipe(None)),
+    "GoodFeaturesPipe": lambda width, height: GoodFeaturesPipe(None),
+    "ShotgunSegmentationPipe": lambda width, height: ShotgunSegmentationPipe(
+        None),
+    }
+
+def make_frames(directory, width, height, count=8, seed=0):
+    """Write count synthetic frames: a door drifting across a noisy wall."""
+    random = numpy.random.RandomState(seed)
+    for i in range(count):
+        pixels = random.randint(90, 140, (height, width, 3)).astype(
+            numpy.uint8)
+        left = width // 3 + i * width // 80
+        right = left + width // 4
+        top = height // 6
+        pixels[top:, left:right] = (40, 60, 90)
+        pixels[top:, left:left + 3] = 20
+        pixels[top:, right - 3:right] = 20
+        pixels[top:top + 3, left:right] = 20
+        image = cv.CreateImage((width, height), cv.IPL_DEPTH_8U, 3)
+        cv.SetData(image, pixels.tostring(), width * 3)
+        cv.SaveImage(os.path.join(directory, "frame%04d.png" % (i,)), image)
+
+def stage_summary(timings):
+    """Turn a Timings summary into a dictionary of milliseconds."""
+    stages = {}
+    for name, count, p50, p95, p99, worst in timings.summary():
+        stages[name] = {"count": count,
+                        "p50_ms": p50 * 1000,
+                        "p95_ms": p95 * 1000,
+                        "p99_ms": p99 * 1000,
+                        "max_ms": worst * 1000}
+    return stages
+
+def run_mode(mode, source, count, warmup):
+    timings = Timings(count)
+    camera = CameraModule(threaded=False, staged=False, timings=timings,
+                          source=source)
+    first = source.read()
+    camera.set_resolution((first.width, first.height))
+    camera.set_mode(mode)
+    for i in range(warmup):
+        camera.capture_jpeg()
+    timings.reset()
+    start = time.time()
+    for i in range(count):
+        camera.capture_jpeg()
+    return time.time() - start, timings
+
+def run_pipe(build, source, count, warmup):
+    timings = Timings(count)
+    first = source.read()
+    first_pipe = instrument(build(first.width, first.height), timings)
+    pool = default_pool
+    for i in range(warmup + count):
+        if i == warmup:
+            timings.reset()
+            start = time.time()
+        image = timings.time("camera.read", source.read)
+        result = first_pipe.process(image)
+        if result is not image:
+            pool.release(result)
+    return time.time() - start, timings
+
+def run_case(case, results):
+    """Run one case and put its result dictionary on the results queue."""
+    kind, name, path, count, warmup = case
+    # Modules announce what they're up to on stdout, which is where the
+    # results go.
+    sys.stdout = sys.stderr
+    try:
+        source = FileSource(path)
+        if kind == "mode":
+            elapsed, timings = run_mode(dict(MODES)[name], source, count,
+                                        warmup)
+        else:
+            elapsed, timings = run_pipe(PIPES[name], source, count, warmup)
+        first = source.read()
+        results.put({"kind": kind,
+                     "name": name,
+                     "resolution": [first.width, first.height],
+                     "frames": count,
+                     "seconds": elapsed,
+                     "fps": count / elapsed,
+                     "stages": stage_summary(timings),
+                     # Linux reports this in kilobytes.
+                     "peak_rss_kb": resource.getrusage(
+                        resource.RUSAGE_SELF).ru_maxrss})
+    except Exception as e:
+        traceback.print_exc()
+        results.put({"kind": kind, "name": name, "error": str(e)})
+
+def run_isolated(case, poll_interval=0.5):
+    """Run a case in a process of its own and return its result.
+
+    If the process dies without a result, e.g. because OpenCV crashed, the
+    case is reported as failed with how the process exited."""
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=run_case, args=(case, results))
+    child.start()
+    result = None
+    while result is None and child.is_alive():
+        try:
+            result = results.get(timeout=poll_interval)
+        except Queue.Empty:
+            pass
+    if result is None:
+        # The child may have put its result just before exiting.
+        try:
+            result = results.get(timeout=poll_interval)
+        except Queue.Empty:
+            child.join()
+            if child.exitcode < 0:
+                reason = "killed by signal %d" % (-child.exitcode,)
+            else:
+                reason = "exited with status %d" % (child.exitcode,)
+            kind, name = case[:2]
+            result = {"kind": kind, "name": name,
+                      "error": "Benchmark process %s without a result." % (
+                          reason,)}
+    child.join()
+    return result
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source",
+                        help="directory of images or video file to read "
+                        "frames from, instead of synthetic frames")
+    parser.add_argument("--resolutions", default=",".join(
+            "%dx%d" % resolution for resolution in RESOLUTIONS),
+                        help="synthetic frame sizes, e.g. 320x240,640x480")
+    parser.add_argument("--frames", type=int, default=50,
+                        help="frames to time in each case")
+    parser.add_argument("--warmup", type=int, default=5,
+                        help="frames to run before timing each case")
+    parser.add_argument("--only", default="",
+                        help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write JSON here, not to stdout")
+    args = parser.parse_args()
+
+    workdir = None
+    if args.source:
+        paths = [args.source]
+    else:
+        workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+        paths = []
+        for width, height in [parse_resolution(text) for text in
+                              args.resolutions.split(",")]:
+            path = os.path.join(workdir, "%dx%d" % (width, height))
+            os.mkdir(path)
+            make_frames(path, width, height)
+            paths.append(path)
+
+    cases = []
+    for path in paths:
+        for name, mode in MODES:
+            cases.append(("mode", name, path, args.frames, args.warmup))
+        for name in sorted(PIPES):
+            cases.append(("pipe", name, path, args.frames, args.warmup))
+    cases = [case for case in cases if args.only in case[1]]
+
+    results = []
+    try:
+        for case in cases:
+            print >> sys.stderr, "Running %s %s on %s..." % case[:3]
+            results.append(run_isolated(case))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    # Anything that looks like a pipe but isn't in PIPES was added without
+    # telling us how to run it.
+    missing = sorted(name for name in dir(pipelines)
+                     if name.endswith("Pipe") and name not in PIPES)
+    report = {"host": platform.node(),
+              "python": platform.python_version(),
+              "opencv": getattr(cv, "__version__", "unknown"),
+              "time": time.time(),
+              "source": args.source or "synthetic",
+              "not_benchmarked": missing,
+              "cases": results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(output + "\n")
+    else:
+        print output
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+"""Measure how long motion commands wait while the driver is busy with video.
+
+A client asks for images as fast as the driver can answer, in DOOR mode,
+while sending motion commands at a steady rate, and the time from each
+command leaving the client to its byte reaching the (fake) Arduino is
+recorded. This is run on the load test harness (see loadtest) with every
+command handled in turn on the driver's one thread (MEDIA_WORKER off), and
+with the worker thread and priority scheduling of driver.util.scheduler;
+each over a fast link and over a slow one, where the client reads images at
+--link-rate bytes a second and the driver has a small send buffer, so that
+images back up in the driver rather than in the kernel. The worst case is
+what matters for a moving robot.
+
+--camera-latency makes every frame take at least that long to read, to
+stand in for a slow camera or a heavy pipeline.
+
+Usage, from the src/ directory:
+
+  python -m driver.benchmarks.preemption [--duration 10]
+      [--command-rate 20] [--camera-latency 0.05] [--link-rate 100000]"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+from driver.benchmarks.loadtest import run_step
+from driver.benchmarks.pipelines import make_frames
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# The driver's send buffer on a slow link, in bytes.
+SLOW_LINK_SEND_BUFFER = 16384
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to run each configuration")
+    parser.add_argument("--command-rate", type=float, default=20.0,
+                        help="motion commands a second")
+    parser.add_argument("--camera-latency", type=float, default=0.05,
+                        help="seconds each camera read takes")
+    parser.add_argument("--link-rate", type=float, default=100000,
+                        help="bytes a second the slow link carries")
+    parser.add_argument("--source",
+                        help="directory of images or video file to use as "
+                        "the camera instead of synthetic frames")
+    args = parser.parse_args()
+    # Settings run_step expects of the load test's arguments.
+    args.mode_interval = 0
+    args.settle = 1.0
+    args.timeout = 30.0
+
+    workdir = None
+    frames = args.source
+    if not frames:
+        workdir = frames = tempfile.mkdtemp(prefix="preemption-")
+        make_frames(workdir, 640, 480, count=8)
+    # Far more images than the driver can make, so it's never idle.
+    step = "1:1000:%g" % (args.command_rate,)
+    link_rate = args.link_rate
+    results = []
+    try:
+        for link, rate in (("fast", None), ("slow", link_rate)):
+            for name, worker in (("in turn", False), ("scheduled", True)):
+                print >> sys.stderr, "Running %s over a %s link..." % (
+                    name, link)
+                overrides = {"MEDIA_WORKER": worker}
+                if rate:
+                    overrides["SEND_BUFFER_BYTES"] = SLOW_LINK_SEND_BUFFER
+                args.link_rate = rate
+                results.append((link, name, run_step(step, frames, args,
+                                                     overrides, ["DOOR"])))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    print "DOOR mode, images back to back, %g motion commands a second" % (
+        args.command_rate,)
+    print "Slow link: %g bytes a second" % (link_rate,)
+    print "%-5s %-10s %8s %10s %10s %10s %10s %10s" % (
+        "Link", "Commands", "Img/s", "Delivered", "p50 ms", "p95 ms",
+        "p99 ms", "Worst ms")
+    for link, name, result in results:
+        latency = result["serial_latency"]
+        delivered = "-"
+        if result["commands_sent"]:
+            delivered = "%.0f%%" % (100.0 * result["commands_delivered"] /
+                                    result["commands_sent"],)
+        if not latency:
+            print "%-5s %-10s %8.1f %10s" % (
+                link, name, result["images_per_second"], delivered)
+            continue
+        print "%-5s %-10s %8.1f %10s %10.1f %10.1f %10.1f %10.1f" % (
+            link, name, result["images_per_second"], delivered,
+            latency["p50_ms"], latency["p95_ms"], latency["p99_ms"],
+            latency["max_ms"])
+
+if __name__ == "__main__":
+    main()
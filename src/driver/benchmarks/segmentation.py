@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+"""Benchmark the segmentation engine against the original flood fill segmentor.
+
+Both are run on identical frames: a directory of images or a video given with
+--source, or else synthetic frames at a few common resolutions. Every frame is
+copied before it goes to the original segmentor, which works in place. Frame
+rates are printed for each, along with the new engine's with tiles labelled in
+parallel, and how far the single pass blur strays from fifteen smooths."""
+
+import argparse
+import shutil
+import tempfile
+import time
+import cv
+import numpy
+from driver.benchmarks.pipelines import make_frames, parse_resolution
+from driver.modules.pipelines import ShotgunSegmentationPipe, default_pool
+from driver.modules.pipelines.segmentation import blur, pixel_array
+from driver.modules.sources import FileSource
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+RESOLUTIONS = [(320, 240), (640, 480)]
+
+class LegacyShotgunSegmentationPipe:
+    """The original smooth and flood fill segmentor, kept here for
+    comparison."""
+
+    def process(self, image, x_points=8, y_points=6,
+                max_difference=(1, 3, 3, 0), passes=1):
+        x_vals = [int((i + 0.5) * (image.width/x_points))
+                  for i in range(x_points)]
+        y_vals = [int((i + 0.5) * (image.height/y_points))
+                  for i in range(y_points)]
+        coordinates = [(x, y) for x in x_vals for y in y_vals]
+
+        for i in range(15):
+            cv.Smooth(image, image)
+
+        for i in range(passes):
+            for coordinate in coordinates:
+                x, y = coordinate
+                color = image[y, x]
+                cv.FloodFill(image, coordinate, color,
+                             max_difference, max_difference)
+        return image
+
+def run(pipe, frames, copy=False):
+    """Run a pipe over every frame, returning the frame rate."""
+    start = time.time()
+    for frame in frames:
+        if copy:
+            frame = cv.CloneImage(frame)
+        result = pipe.process(frame)
+        default_pool.release(result)
+    return len(frames) / (time.time() - start)
+
+def blur_error(frame):
+    """Get the mean and largest per-pixel difference between fifteen smooths
+    and the single pass blur."""
+    smoothed = cv.CloneImage(frame)
+    for i in range(15):
+        cv.Smooth(smoothed, smoothed)
+    blurred = cv.CloneImage(frame)
+    blur(frame, blurred, 15)
+    difference = numpy.abs(pixel_array(smoothed).astype(numpy.int16) -
+                           pixel_array(blurred))
+    return difference.mean(), difference.max()
+
+def load_frames(path, count):
+    source = FileSource(path)
+    # The source reuses one buffer for every frame it reads.
+    return [cv.CloneImage(source.read()) for i in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source",
+                        help="directory of images or video file to use "
+                        "instead of synthetic frames")
+    parser.add_argument("--resolutions", default=",".join(
+            "%dx%d" % resolution for resolution in RESOLUTIONS),
+                        help="synthetic frame sizes, e.g. 320x240,640x480")
+    parser.add_argument("--frames", type=int, default=20,
+                        help="number of frames to run at each resolution")
+    parser.add_argument("--tiles", type=int, default=4,
+                        help="tiles to label in parallel")
+    args = parser.parse_args()
+
+    if args.source:
+        frame_sets = [load_frames(args.source, args.frames)]
+    else:
+        frame_sets = []
+        for width, height in [parse_resolution(text) for text in
+                              args.resolutions.split(",")]:
+            workdir = tempfile.mkdtemp(prefix="segmentation-bench-")
+            try:
+                make_frames(workdir, width, height)
+                frame_sets.append(load_frames(workdir, args.frames))
+            finally:
+                shutil.rmtree(workdir)
+
+    legacy = LegacyShotgunSegmentationPipe()
+    engine = ShotgunSegmentationPipe(None)
+    tiled = ShotgunSegmentationPipe(None, tiles=args.tiles)
+
+    print "%-12s %10s %10s %10s %10s %10s %12s" % (
+        "Resolution", "Before FPS", "After FPS", "Tiled FPS", "Speedup",
+        "Regions", "Blur error")
+    for frames in frame_sets:
+        before = run(legacy, frames, copy=True)
+        after = run(engine, frames)
+        parallel = run(tiled, frames)
+        mean_error, max_error = blur_error(frames[0])
+        print "%-12s %10.2f %10.2f %10.2f %9.1fx %10d %5.2f/%-6d" % (
+            "%dx%d" % (frames[0].width, frames[0].height), before, after,
+            parallel, max(after, parallel) / before,
+            engine.segmentation.count(), mean_error, max_error)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+"""Benchmark how long the driver takes to start.
+
+Each run starts a fresh driver process, reading frames from files and talking
+to a FakeArduino, and measures three things:
+
+  import  time to import the driver's modules
+  listen  time from starting the process until Pilot can connect
+  image   time from starting the process until the first image arrives
+
+Startup is tried three ways. "eager" does what the driver used to: import
+every module, look up the network-facing address through DNS, and open the
+camera and the Arduino before listening. "preopen" is the default, opening
+the hardware in the background while listening. "lazy" only opens the
+hardware when the first command needs it."""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from driver.benchmarks.pipelines import make_frames
+from driver.util.fakearduino import FakeArduino
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+CONTROL_PORT = 9495
+VIDEO_PORT = 9494
+
+# Run in the driver process. Prints how long the import took, then runs the
+# driver the way the mode asks.
+DRIVER_SCRIPT = """
+import sys, time
+started = time.time()
+import driver.botdriver as botdriver
+if %(eager)r:
+    import socket
+    import driver.modules.camera, driver.modules.motion
+    import driver.modules.communications
+    try:
+        import bluetooth
+    except ImportError:
+        pass
+sys.stdout.write("import %%f\\n" %% (time.time() - started,))
+sys.stdout.flush()
+settings = botdriver.settings
+settings.CAMERA_FILE = %(frames)r
+settings.ARDUINO_PORT = %(port)r
+settings.BIND_ADDRESS = "127.0.0.1"
+settings.STARTUP_PREOPEN = %(preopen)r
+if %(eager)r:
+    try:
+        socket.getaddrinfo("gmail.com", 80)
+    except socket.error:
+        pass
+bd = botdriver.BotDriver()
+if %(eager)r:
+    bd.camera
+    bd.motion
+bd.wait_for_connections()
+while 1:
+    bd.read_and_execute()
+"""
+
+MODES = [("eager", True, True),
+         ("preopen", False, True),
+         ("lazy", False, False)]
+
+def connect(port, deadline):
+    """Connect to the driver, retrying until it's listening."""
+    while time.time() < deadline:
+        try:
+            return socket.create_connection(("127.0.0.1", port), 1.0)
+        except socket.error:
+            time.sleep(0.002)
+    raise RuntimeError("The driver never started listening.")
+
+def read_until(conn, terminator):
+    data = ""
+    while not data.endswith(terminator):
+        chunk = conn.recv(1)
+        if not chunk:
+            raise RuntimeError("The driver hung up.")
+        data += chunk
+    return data
+
+def read_exactly(conn, count):
+    data = []
+    while count:
+        chunk = conn.recv(min(count, 65536))
+        if not chunk:
+            raise RuntimeError("The driver hung up.")
+        data.append(chunk)
+        count -= len(chunk)
+    return "".join(data)
+
+def run_once(eager, preopen, frames, port, timeout):
+    """Start a driver, returning (import, listen, image) times in seconds."""
+    script = DRIVER_SCRIPT % {"frames": frames, "port": port,
+                              "eager": eager, "preopen": preopen}
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(here), here, env.get("PYTHONPATH", "")])
+    started = time.time()
+    process = subprocess.Popen([sys.executable, "-c", script], env=env,
+                               stdout=subprocess.PIPE)
+    try:
+        import_time = float(process.stdout.readline().split()[1])
+        deadline = started + timeout
+        video = connect(VIDEO_PORT, deadline)
+        listen_time = time.time() - started
+        control = connect(CONTROL_PORT, deadline)
+        control.sendall("IMAGE;")
+        length = int(read_until(control, ";")[:-1])
+        read_exactly(video, length)
+        image_time = time.time() - started
+        control.sendall("QUIT;")
+        video.close()
+        control.close()
+        return import_time, listen_time, image_time
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="driver starts for each mode")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="seconds to wait for each driver")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="startup-bench-")
+    arduino = FakeArduino()
+    arduino.start()
+    try:
+        make_frames(workdir, 640, 480, count=4)
+        results = []
+        for name, eager, preopen in MODES:
+            runs = [run_once(eager, preopen, workdir, arduino.path,
+                             args.timeout)
+                    for i in range(args.runs)]
+            # Medians, so one slow start doesn't skew a mode.
+            medians = [sorted(column)[len(column) // 2]
+                       for column in zip(*runs)]
+            results.append((name, medians))
+    finally:
+        arduino.stop()
+        shutil.rmtree(workdir)
+
+    print "Median of %d starts" % (args.runs,)
+    print "%-10s %12s %12s %12s" % ("Mode", "Import ms", "Listen ms",
+                                    "Image ms")
+    for name, (import_time, listen_time, image_time) in results:
+        print "%-10s %12.1f %12.1f %12.1f" % (name, import_time * 1000,
+                                              listen_time * 1000,
+                                              image_time * 1000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+"""Benchmark the telemetry reader against a fake Arduino.
+
+First a long run of synthetic encoder reports is parsed and integrated
+directly, to show how many reports a second the reader can keep up with and
+that the ring's memory stays put once it wraps. Then the reader is run for
+real against a FakeArduino sending reports at 100Hz while the robot drives a
+square, and the pose it ends up with is checked."""
+
+import math
+import serial
+import time
+from driver.modules.telemetry import OdometryRing, TelemetryReader
+from driver.util.fakearduino import FakeArduino
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+BODY_WIDTH = 6.5
+WHEEL_CIRCUMFERENCE = 2.9
+TICKS_PER_REV = 20
+
+def square_reports(side_ticks, turn_ticks, interval_ms=10):
+    """Yield encoder report lines for driving a square, a tick per report."""
+    millis, left, right = 0, 0, 0
+    for side in range(4):
+        for i in range(side_ticks):
+            millis += interval_ms
+            left += 1
+            right += 1
+            yield "E %d %d %d\n" % (millis, left, right)
+        for i in range(turn_ticks):
+            millis += interval_ms
+            left -= 1
+            right += 1
+            yield "E %d %d %d\n" % (millis, left, right)
+
+def quarter_turn_ticks():
+    """Ticks each wheel moves, in opposite directions, for a 90 degree turn."""
+    arc = (math.pi / 2) * BODY_WIDTH / 2
+    return int(round(arc / (float(WHEEL_CIRCUMFERENCE) / TICKS_PER_REV)))
+
+def make_reader(capacity):
+    return TelemetryReader(lambda: None, OdometryRing(capacity), BODY_WIDTH,
+                           WHEEL_CIRCUMFERENCE, TICKS_PER_REV)
+
+def bench_throughput(count=200000, capacity=60 * 100):
+    lines = ["E %d %d %d\n" % (i * 10, i, i // 2) for i in range(count)]
+    # Feed it the way bulk reads would arrive: many reports at a time.
+    chunks = ["".join(lines[i:i + 50]) for i in range(0, count, 50)]
+    reader = make_reader(capacity)
+    before = reader.ring.nbytes()
+    start = time.time()
+    for chunk in chunks:
+        reader.feed(chunk, start)
+    elapsed = time.time() - start
+    print "Parsed and integrated %d reports at %.0f reports/sec." % (
+        count, count / elapsed)
+    print "Ring of %d samples: %d bytes before, %d after wrapping %d times." % (
+        capacity, before, reader.ring.nbytes(), count // capacity)
+
+def bench_history(hours=2, rate=100):
+    ring = OdometryRing(hours * 60 * 60 * rate)
+    print "%d hours at %dHz takes %.1fMB." % (hours, rate,
+                                             ring.nbytes() / 1e6)
+
+def bench_live(side_ticks=100):
+    arduino = FakeArduino()
+    arduino.start()
+    conn = serial.Serial(arduino.path, 115200, timeout=1)
+    reader = TelemetryReader(lambda: conn, OdometryRing(60 * 100),
+                             BODY_WIDTH, WHEEL_CIRCUMFERENCE, TICKS_PER_REV)
+    reader.start()
+    arduino.write("Ready.\n")
+    next_report = time.time()
+    for line in square_reports(side_ticks, quarter_turn_ticks()):
+        next_report += 0.01
+        time.sleep(max(0, next_report - time.time()))
+        arduino.write(line)
+    time.sleep(0.2)
+    x, y, theta = reader.pose()
+    linear, angular = reader.velocity()
+    print "After driving a square: x=%.2f y=%.2f theta=%.1f degrees" % (
+        x, y, math.degrees(theta))
+    print "Velocity over the last half second: %.2f/s, %.1f degrees/s" % (
+        linear, math.degrees(angular))
+    print "Reader stats:", reader.stats()
+    reader.stop()
+    conn.close()
+    arduino.stop()
+
+def main():
+    bench_throughput()
+    bench_history()
+    bench_live()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+"""Benchmark the overhead of timing the pipeline.
+
+The door detection pipeline is run over the same synthetic camera frame with
+and without every pipe wrapped by driver.util.timing.instrument(), and the
+difference in time per frame is printed along with the timings themselves.
+The cost of a single record() is measured on its own as well."""
+
+import time
+import cv
+import numpy
+from driver.modules.pipelines import (EdgeDetectPipe, ResizePipe,
+                                      ScanningDoorDetectPipe)
+from driver.util.timing import Timings, instrument
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def make_frame(width, height, seed=0):
+    """Build a synthetic color camera frame."""
+    random = numpy.random.RandomState(seed)
+    pixels = random.randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+    image = cv.CreateImage((width, height), cv.IPL_DEPTH_8U, 3)
+    cv.SetData(image, pixels.tostring(), width * 3)
+    return image
+
+def door_pipeline():
+    return EdgeDetectPipe(ScanningDoorDetectPipe(ResizePipe(None, 640, 480)))
+
+def seconds_per_frame(first_pipe, frame, count):
+    start = time.time()
+    for i in range(count):
+        first_pipe.process(frame)
+    return (time.time() - start) / count
+
+def bench_record(count=200000):
+    timings = Timings()
+    start = time.time()
+    for i in range(count):
+        timings.record("step", 0.001)
+    return (time.time() - start) / count
+
+def main(count=200):
+    frame = make_frame(640, 480)
+    timings = Timings()
+    plain = door_pipeline()
+    timed = instrument(door_pipeline(), timings)
+    # Warm up the buffer pool so neither run pays for first allocations.
+    seconds_per_frame(plain, frame, 5)
+    seconds_per_frame(timed, frame, 5)
+    timings.reset()
+
+    # Alternate between the two so drift in machine load hits both equally.
+    plain_total = timed_total = 0.0
+    for i in range(5):
+        plain_total += seconds_per_frame(plain, frame, count // 5)
+        timed_total += seconds_per_frame(timed, frame, count // 5)
+    print "Without timing: %8.3f ms/frame" % (plain_total / 5 * 1000)
+    print "With timing:    %8.3f ms/frame (%+.2f%%)" % (
+        timed_total / 5 * 1000, (timed_total / plain_total - 1) * 100)
+    print "One record():   %8.3f us" % (bench_record() * 1e6)
+    print
+    print "%-32s %8s %10s %10s %10s %10s" % ("Step", "Count", "p50 (us)",
+                                             "p95 (us)", "p99 (us)",
+                                             "max (us)")
+    for row in timings.summary():
+        print "%-32s %8d %10.0f %10.0f %10.0f %10.0f" % (
+            (row[0], row[1]) + tuple(value * 1e6 for value in row[2:]))
+    print
+    print "STATS reply:", timings.compact()
+
+if __name__ == "__main__":
+    main()
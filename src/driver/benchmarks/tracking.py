@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+"""Benchmark door tracking against detecting the door in every frame.
+
+The baseline is what DOOR mode used to do on every frame: edge detection then
+a barscan, or with --haar, a full Haar scan. The tracker finds the door with
+the same detector and then follows it with optical flow. Both are run over
+the same frames: a directory of images or a video given with --source, or
+else synthetic frames of a door drifting across a wall.
+
+A frame counts as agreeing if the tracked door overlaps the baseline's by at
+least half (intersection over union)."""
+
+import argparse
+import shutil
+import tempfile
+import time
+import cv
+from driver.benchmarks.haar import overlap
+from driver.benchmarks.pipelines import make_frames
+from driver.modules.pipelines import (EdgeDetectPipe, HaarDoorDetectPipe,
+                                      ScanningDoorDetectPipe,
+                                      TrackingDoorDetectPipe, default_pool)
+from driver.modules.sources import FileSource
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def run_baseline(detector, frames):
+    """Detect doors in every frame, returning the biggest ones and the time."""
+    edge_pipe = None
+    if getattr(detector, "needs_edges", False):
+        edge_pipe = EdgeDetectPipe(None)
+    results = []
+    start = time.time()
+    for frame in frames:
+        if edge_pipe:
+            edges = edge_pipe.process(frame)
+            doors = detector.detect(edges)
+            default_pool.release(edges)
+        else:
+            doors = detector.detect(frame)
+        results.append(max(doors, key=lambda rect: rect[2] * rect[3])
+                       if doors else None)
+    return results, time.time() - start
+
+def run_tracker(tracker, frames):
+    """Track doors through every frame, returning them and the time."""
+    results = []
+    start = time.time()
+    for frame in frames:
+        default_pool.release(tracker.process(frame))
+        results.append(tracker.door)
+    return results, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--source",
+                        help="directory of images or video file to use "
+                        "instead of synthetic frames")
+    parser.add_argument("--frames", type=int, default=200,
+                        help="number of frames to run")
+    parser.add_argument("--haar", action="store_true",
+                        help="detect doors with the Haar cascade rather than "
+                        "the barscan")
+    parser.add_argument("--confidence", type=float, default=0.5,
+                        help="share of features left below which the "
+                        "detector runs again")
+    args = parser.parse_args()
+
+    workdir = None
+    path = args.source
+    if not path:
+        workdir = path = tempfile.mkdtemp(prefix="tracking-bench-")
+        make_frames(path, 640, 480, count=40)
+    try:
+        source = FileSource(path)
+        # The source reuses one buffer for every frame it reads.
+        frames = [cv.CloneImage(source.read()) for i in range(args.frames)]
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+    if args.haar:
+        detector = HaarDoorDetectPipe(None)
+    else:
+        detector = ScanningDoorDetectPipe(None)
+    tracker = TrackingDoorDetectPipe(None, detector, args.confidence)
+    expected, baseline_time = run_baseline(detector, frames)
+    found, tracker_time = run_tracker(tracker, frames)
+
+    both = [i for i in range(len(frames)) if expected[i] and found[i]]
+    agreed = [i for i in both if overlap(expected[i], found[i]) >= 0.5]
+
+    print "%d frames of %dx%d" % (len(frames), frames[0].width,
+                                  frames[0].height)
+    print "%-10s %10s %12s" % ("Method", "FPS", "ms/frame")
+    print "%-10s %10.1f %12.2f" % ("Detect", len(frames) / baseline_time,
+                                   1000 * baseline_time / len(frames))
+    print "%-10s %10.1f %12.2f" % ("Track", len(frames) / tracker_time,
+                                   1000 * tracker_time / len(frames))
+    print "Speedup: %.1fx" % (baseline_time / tracker_time,)
+    if both:
+        print "Agreement: %.1f%% of frames where both found a door" % (
+            100.0 * len(agreed) / len(both),)
+    print "Tracker:", tracker.stats()
+
+if __name__ == "__main__":
+    main()
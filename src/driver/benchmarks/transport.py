@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+"""Benchmark sending images over loopback TCP the old way and the framed way.
+
+The old way is what NetworkCommunicationsModule.send_media has always done:
+copy the encoded image into a string, send its length and a semicolon on the
+control connection, then the image on the video connection. The framed way
+sends a frame header and the image together on the video connection alone,
+without joining them (see driver.util.framing). Both pay for the copy
+jpeg.tostring() makes of the encoder's buffer, since the driver still makes
+it either way.
+
+A client thread reads everything into a reusable buffer, so its own cost is
+kept to a minimum. Frames per second and megabytes per second are printed for
+a few image sizes."""
+
+import argparse
+import socket
+import threading
+import time
+from driver.util import framing
+from driver.util.netutils import tune_socket
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+SIZES = [16 * 1024, 64 * 1024, 256 * 1024]
+
+def connect_pair(listener):
+    """Open a loopback connection to listener, returning (server, client)."""
+    client = socket.create_connection(listener.getsockname())
+    server, address = listener.accept()
+    return server, client
+
+def drain(conn, buf, length):
+    """Read exactly length bytes from conn into buf."""
+    view = memoryview(buf)
+    while length > 0:
+        count = conn.recv_into(view, min(length, len(buf)))
+        if not count:
+            raise framing.FramingError("Connection closed.")
+        length -= count
+
+def read_length(conn):
+    """Read a "<length>;" message one byte at a time, as Pilot does."""
+    digits = []
+    while True:
+        char = conn.recv(1)
+        if char == ";":
+            return int("".join(digits))
+        if not char:
+            raise framing.FramingError("Connection closed.")
+        digits.append(char)
+
+def legacy_client(video, control, count, buf):
+    for i in range(count):
+        drain(video, buf, read_length(control))
+
+def framed_client(video, count, buf):
+    header = bytearray(framing.HEADER_SIZE)
+    for i in range(count):
+        drain(video, header, framing.HEADER_SIZE)
+        seq, timestamp, length = framing.unpack_header(str(header))
+        drain(video, buf, length)
+
+def run_legacy(listener, encoded, count, nodelay, send_buffer):
+    video, video_client = connect_pair(listener)
+    control, control_client = connect_pair(listener)
+    for conn in (video, control):
+        tune_socket(conn, nodelay, send_buffer)
+    buf = bytearray(len(encoded))
+    client = threading.Thread(target=legacy_client,
+                              args=(video_client, control_client, count, buf))
+    client.start()
+    start = time.time()
+    for i in range(count):
+        # What jpeg.tostring() costs.
+        media = str(encoded)
+        control.sendall("%s;" % len(media))
+        video.sendall(media)
+    client.join()
+    elapsed = time.time() - start
+    for conn in (video, control, video_client, control_client):
+        conn.close()
+    return elapsed
+
+def run_framed(listener, encoded, count, nodelay, send_buffer):
+    video, video_client = connect_pair(listener)
+    tune_socket(video, nodelay, send_buffer)
+    buf = bytearray(len(encoded))
+    client = threading.Thread(target=framed_client,
+                              args=(video_client, count, buf))
+    client.start()
+    start = time.time()
+    for i in range(count):
+        # The same copy as the old way; CameraModule hands out strings.
+        framing.send_frame(video, i, 0.0, str(encoded))
+    client.join()
+    elapsed = time.time() - start
+    video.close()
+    video_client.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=int, default=2000,
+                        help="images to send at each size")
+    parser.add_argument("--no-nodelay", dest="nodelay", action="store_false",
+                        help="leave Nagle's algorithm on")
+    parser.add_argument("--send-buffer", type=int, default=None,
+                        help="kernel send buffer in bytes")
+    args = parser.parse_args()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(2)
+
+    print "%d images each, TCP_NODELAY %s, send buffer %s" % (
+        args.frames, "on" if args.nodelay else "off",
+        args.send_buffer or "default")
+    print "%-10s %12s %12s %12s %12s %9s" % (
+        "Size", "Old FPS", "Old MB/s", "Framed FPS", "Framed MB/s",
+        "Speedup")
+    for size in SIZES:
+        # Stands in for the encoder's output buffer.
+        encoded = bytearray(size)
+        old = run_legacy(listener, encoded, args.frames, args.nodelay,
+                         args.send_buffer)
+        new = run_framed(listener, encoded, args.frames, args.nodelay,
+                         args.send_buffer)
+        megabytes = float(size) * args.frames / (1024 * 1024)
+        print "%-10s %12.1f %12.1f %12.1f %12.1f %8.2fx" % (
+            "%dKB" % (size // 1024,), args.frames / old, megabytes / old,
+            args.frames / new, megabytes / new, old / new)
+    listener.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
 #! /usr/bin/env python
 # Robot driver program: receives commands from Pilot and executes them.
 
+import collections
 import sys
 import os.path
-from driver.modules import CameraModule, CameraError
-from driver.modules import ArduinoMotionModule
-from driver.modules import NetworkCommunicationsModule, BluetoothCommunicationsModule
+import time
+# The camera, motion, comms, recording and delta modules pull in cv, serial
+# or bluetooth, which take a while to import and may not even be installed, so
+# they're only imported once the settings say they're needed.
+from driver.modules.ratecontrol import AdaptiveQualityController
+from driver.util.commands import CommandDecoder
+from driver.util.deferred import Deferred
+from driver.util.scheduler import CommandScheduler, CONTROL, MEDIA
+from driver.util.scheduler import command_class
+from driver.util.timing import Timings
 try:
     import driver.settings as settings
 except ImportError:
@@ -14,24 +22,142 @@ except ImportError:
     sys.path.append(os.path.dirname(os.path.realpath(__file__)))
     import driver.settings as settings
 
-class BotDriver:
-    def __init__(self):
+class BotDriver(object):
+    # Commands which only change state that the main loop looks after, so
+    # they're run right away on this thread instead of by the scheduler. IMAGE
+    # only notes the request; serve_image_requests() queues the work of
+    # answering it.
+    INLINE_COMMANDS = ("IMAGE", "STREAM", "STOP_STREAM")
+
+    def __init__(self, comms=None, camera=None, motion=None):
+        # Any of the modules can be passed in instead of being brought up
+        # here, e.g. to replay a recorded session without any hardware.
         # TODO Break all modules into their own threads and implement queues
+        self.comms = comms or self.open_comms()
+
+        # Timings for each step of getting an image out, reported by STATS.
+        self.timings = None
+        if settings.TIMING:
+            self.timings = Timings(settings.TIMING_WINDOW)
+
+        # When recording, every command packet and raw frame goes into a
+        # session file that driver/replay.py can play back.
+        self.recorder = None
+        if settings.RECORD_SESSION:
+            from driver.modules.recording import SessionRecorder
+            print "Recording session to", settings.RECORD_SESSION
+            self.recorder = SessionRecorder(settings.RECORD_SESSION)
+            if camera:
+                camera.recorder = self.recorder
+
+        # When set, JPEG quality and resolution are adjusted on the fly to
+        # suit the link.
+        self.quality_controller = None
+        if settings.ADAPTIVE_TARGET_FPS or settings.ADAPTIVE_TARGET_LATENCY:
+            # The camera starts out at the default quality and resolution;
+            # the controller is applied to it once it's open.
+            self.quality_controller = AdaptiveQualityController(
+                settings.ADAPTIVE_TARGET_FPS, settings.ADAPTIVE_TARGET_LATENCY,
+                settings.JPEG_QUALITY, settings.CAMERA_RESOLUTION)
+            if camera:
+                self.apply_quality_to(camera)
+
+        # The camera and the Arduino are opened the first time a command
+        # needs them, or in the background right away with STARTUP_PREOPEN,
+        # so neither holds up listening for Pilot. See driver.util.deferred.
+        # If your video device is on a different /dev/ node, you need to
+        # modify settings.DEFAULT_CAMERA to take that into account.
+        self.camera_loader = Deferred(lambda: camera or self.open_camera(),
+                                      "camera")
+        self.motion_loader = Deferred(lambda: motion or self.open_motion(),
+                                      "motion")
+        if settings.STARTUP_PREOPEN:
+            self.camera_loader.start()
+            self.motion_loader.start()
+
+        # Motion commands are run as soon as they're read; everything else is
+        # queued for a worker, control before media, so that capturing and
+        # encoding a frame never holds up a MOVE or STOP. Only this thread
+        # talks to the comms module: replies and images from the worker wait
+        # in the outbox for it to send. See driver.util.scheduler.
+        self.scheduler = CommandScheduler(settings.MEDIA_WORKER)
+        self.outbox = collections.deque()
+        # Whether a frame is being captured and encoded, or waiting in the
+        # outbox, for sending.
+        self.media_busy = False
+        # (time, size) of the image the comms module is still sending, so the
+        # quality controller can be told how long it took.
+        self.media_sending = None
+        self.scheduler.start()
+
+        # When streaming, frames are pushed to the client every
+        # stream_interval seconds instead of waiting for IMAGE requests.
+        self.stream_interval = None
+        self.next_stream_time = None
+        self.last_stream_seq = None
+
+        # Partially received commands, by the connection they came from.
+        self.decoders = {}
+        # Cameras that images have been asked for since the last was served.
+        self.image_requests = set()
+        # Command name -> handler. Each handler is given the command's
+        # arguments as a list of strings.
+        self.handlers = {
+            "QUIT": self.handle_quit,
+            "IMAGE": self.handle_image,
+            "STOP": self.handle_stop,
+            "EDGE": self.handle_edge,
+            "RAW": self.handle_raw,
+            "DOOR": self.handle_door,
+            "MOVE": self.handle_move,
+            "ROTATE": self.handle_rotate,
+            "STREAM": self.handle_stream,
+            "STOP_STREAM": self.handle_stop_stream,
+            "ADAPT": self.handle_adapt,
+            "DELTA": self.handle_delta,
+            "ACK": self.handle_ack,
+            "KEYFRAME": self.handle_keyframe,
+            "STATS": self.handle_stats,
+            "PLAN": self.handle_plan,
+            "CAMERAS": self.handle_cameras,
+            }
+
+        # When set, images are sent as tile deltas against the last frame the
+        # client acknowledged rather than as whole JPEGs.
+        self.delta_encoder = None
+
+    # Opening the camera can take a second or more.
+    camera = property(lambda self: self.camera_loader.get())
+    motion = property(lambda self: self.motion_loader.get())
+
+    def open_comms(self):
+        """Bring up the communications link the settings ask for."""
         if settings.USE_BLUETOOTH:
+            from driver.modules.communications import \
+                BluetoothCommunicationsModule
             print "Bringing up Bluetooth interface..."
-            self.comms = BluetoothCommunicationsModule()
-        else:
-            print "Bringing up network interface..."
-            self.comms = NetworkCommunicationsModule()
+            return BluetoothCommunicationsModule()
+        from driver.modules.communications import \
+            MultiViewerCommunicationsModule, NetworkCommunicationsModule
+        if settings.MULTI_VIEWER:
+            print "Bringing up multi-viewer network interface..."
+            return MultiViewerCommunicationsModule()
+        print "Bringing up network interface..."
+        return NetworkCommunicationsModule()
 
-        # If your video device is on a different /dev/ node, you need to modify
-        # this to take that into account.
-        self.camera = CameraModule()
-        self.motion = ArduinoMotionModule()
+    def open_camera(self):
+        from driver.modules.camera import CameraModule
+        print "Opening camera..."
+        camera = CameraModule(timings=self.timings)
+        camera.recorder = self.recorder
+        if self.quality_controller:
+            self.apply_quality_to(camera)
+        return camera
 
-        # TODO Perhaps we should break this out into an 'install()' method
-        # or perform a list comprehension (use inheritence to define modules)
-        self.installed_modules = [self.camera, self.motion, self.comms]
+    def open_motion(self):
+        from driver.modules.motion import ArduinoMotionModule
+        print "Connecting to Arduino..."
+        return ArduinoMotionModule()
 
     def wait_for_connections(self):
         """Open a communications channel and wait for connections."""
@@ -39,51 +165,421 @@ class BotDriver:
 
     def read_and_execute(self):
         """Read incoming commands and execute them."""
-        for packet in self.comms.get_packets():
-            self.parse_and_execute(packet)
+        # While streaming we can only wait for commands until the next frame
+        # is due.
+        self.send_outbox()
+        timeout = None
+        next_stream_time = self.next_stream_time
+        if next_stream_time is not None:
+            timeout = max(0, next_stream_time - time.time())
+        # The worker can't wake us when it has something to send, so check
+        # back often while it's busy. It's checked before the outbox, since
+        # the worker fills the outbox before it goes idle.
+        if not self.scheduler.idle() or self.outbox or self.media_busy:
+            poll = settings.MEDIA_POLL_INTERVAL
+            timeout = poll if timeout is None else min(timeout, poll)
+        for source, packet in self.comms.read_packets(timeout):
+            self.decode_and_execute(packet, source)
+        self.serve_image_requests()
+        if self.stream_interval and time.time() >= self.next_stream_time:
+            self.push_stream_frame()
+        self.scheduler.run_pending()
+        self.send_outbox()
+
+    # These are only called on the main thread, which reads the stream timing
+    # without a lock; STREAM and STOP_STREAM are run there for that reason.
+    def start_stream(self, fps):
+        """Start pushing frames to the client at the given rate."""
+        self.stream_interval = 1.0 / fps
+        self.next_stream_time = time.time()
+        self.last_stream_seq = None
+
+    def stop_stream(self):
+        """Go back to sending frames only when they're asked for."""
+        self.stream_interval = None
+        self.next_stream_time = None
+
+    def push_stream_frame(self):
+        """Capture a frame and push it to the client, if the link can take it."""
+        # Schedule the next frame off of when this one was due, so we hold the
+        # requested rate; but if we've fallen far behind, don't try to make up
+        # for it with a burst of frames.
+        self.next_stream_time += self.stream_interval
+        now = time.time()
+        if self.next_stream_time < now:
+            self.next_stream_time = now + self.stream_interval
+
+        # If the link is still chewing on the last frame, this one would only be
+        # dropped; skip the work of capturing and encoding it. The same goes
+        # if the worker is still busy with the last one.
+        if not self.comms.stream_ready() or self.media_busy:
+            return
+        self.media_busy = True
+        self.scheduler.submit(MEDIA, self.produce_media, True)
+
+    def produce_media(self, stream=False, cameras=(0,)):
+        """Capture and encode a frame, and leave it in the outbox to be sent.
 
-    def parse_and_execute(self, packet_data):
+        This is the worker's part of serving an image or a stream frame. An
+        image is sent from each of cameras, in order, all from the same set
+        of frames. Once the images are in the outbox, media_busy stays set
+        until the main thread has handed them to the comms module, so there's
+        only ever one set waiting."""
+        from driver.modules.camera import CameraError
+        queued = False
+        started = time.time()
+        try:
+            count = len(self.camera.sources)
+            for camera in cameras:
+                if camera >= count:
+                    print "There's no camera %d to send an image from." % (
+                        camera,)
+            cameras = [camera for camera in cameras if camera < count]
+            if not cameras:
+                return
+            try:
+                images = self.capture_media(cameras)
+            except CameraError:
+                print "An error occurred while trying to capture an image."
+                return # Not much we can do about a camera error.
+            if not images:
+                return
+            if not stream:
+                if self.recorder and cameras[0] == 0:
+                    # So a replay can answer with the same frame, after the
+                    # same commands. Only the first camera is recorded.
+                    self.recorder.record_served(self.camera.last_frame.seq,
+                                                started)
+                self.outbox.append(("media", images))
+                queued = True
+                return
+            img = images[0]
+            frame = self.camera.last_frame
+            # The capture thread may not have a new frame for us yet; there's
+            # no sense sending the same one twice.
+            if frame.seq != self.last_stream_seq:
+                self.outbox.append(("stream", frame.seq, frame.timestamp,
+                                    img))
+                queued = True
+        finally:
+            if not queued:
+                self.media_busy = False
+
+    def send_outbox(self):
+        """Send the replies and images the worker has left in the outbox.
+
+        An image waits, along with anything queued after it, until the comms
+        module has finished sending the last one."""
+        self.check_media_sent()
+        while self.outbox:
+            entry = self.outbox[0]
+            if entry[0] != "command" and not self.comms.media_ready():
+                return
+            if entry[0] == "media":
+                # Images from several cameras go one at a time.
+                self.send_media(entry[1].pop(0))
+                if entry[1]:
+                    continue
+            self.outbox.popleft()
+            if entry[0] == "command":
+                self.comms.send_command(entry[1])
+                continue
+            if entry[0] == "stream":
+                self.send_stream_frame(*entry[1:])
+            self.media_busy = False
+
+    def check_media_sent(self):
+        """Note how long the last image took to send, once it's all out."""
+        if not self.media_sending or not self.comms.media_ready():
+            return
+        start, size = self.media_sending
+        self.media_sending = None
+        elapsed = time.time() - start
+        if self.timings:
+            self.timings.record("comms.send", elapsed)
+        controller = self.quality_controller
+        if controller and controller.observe(size, elapsed):
+            self.scheduler.submit(CONTROL, self.apply_quality)
+
+    def send_command(self, command):
+        """Queue a reply on the control channel."""
+        self.outbox.append(("command", command))
+
+    def send_media(self, img):
+        """Start sending an image. The comms module finishes sending it while
+        we go on reading commands; see check_media_sent()."""
+        self.media_sending = (time.time(), len(img))
+        self.comms.send_media(img)
+        self.check_media_sent()
+
+    def send_stream_frame(self, seq, timestamp, img):
+        if self.timings:
+            accepted = self.timings.time("comms.send",
+                                         self.comms.send_stream_frame,
+                                         seq, timestamp, img)
+        else:
+            accepted = self.comms.send_stream_frame(seq, timestamp, img)
+        if accepted:
+            self.last_stream_seq = seq
+        # ADAPT runs on the worker, so the controller can go away under us.
+        controller = self.quality_controller
+        if controller and controller.observe_stream(not accepted):
+            self.scheduler.submit(CONTROL, self.apply_quality)
+
+    def start_adapting(self, target_fps=None, target_latency=None,
+                       report=True):
+        """Start adjusting image quality to hold a frame rate or latency."""
+        controller = AdaptiveQualityController(
+            target_fps, target_latency, self.camera.jpeg_quality,
+            self.camera.resolution)
+        self.quality_controller = controller
+        self.apply_quality(report)
+
+    def stop_adapting(self):
+        """Stop adjusting image quality and go back to the defaults."""
+        self.quality_controller = None
+        self.camera.set_quality(settings.JPEG_QUALITY)
+        self.camera.set_resolution(settings.CAMERA_RESOLUTION)
+        self.report_quality()
+
+    def apply_quality(self, report=True):
+        """Apply the quality controller's settings to the camera."""
+        self.apply_quality_to(self.camera)
+        if report:
+            self.report_quality()
+
+    def apply_quality_to(self, camera):
+        controller = self.quality_controller
+        if not controller:
+            # Adapting was turned off since this was asked for.
+            return
+        camera.set_quality(controller.quality)
+        camera.set_resolution(controller.resolution())
+
+    def report_quality(self):
+        """Tell the client what quality and resolution it's getting."""
+        width, height = self.camera.resolution
+        self.send_command("QUALITY %d %dx%d;" % (
+            self.camera.jpeg_quality, width, height))
+
+    def parse_and_execute(self, packet_data, source=None):
+        """Decode commands from a chunk of data and execute them.
+
+        Data from each source (usually a connection) is decoded separately, so
+        a command split across two reads from the same connection still comes
+        out whole."""
+        self.decode_and_execute(packet_data, source)
+        self.serve_image_requests()
+        self.scheduler.run_pending()
+        self.send_outbox()
+
+    def decode_and_execute(self, packet_data, source=None):
+        """Decode and execute commands, but hold off on serving images.
+
+        Motion commands are run right away and the rest are queued by
+        priority (see driver.util.scheduler). IMAGE requests are only noted
+        here; serve_image_requests() answers all of them at once with a single
+        frame."""
         #print "Received packet", packet_data
+        if self.recorder:
+            self.recorder.record_command(packet_data, source)
 
         # TCP is a streaming protocol, which means that we can't rely on our
-        # packets coming nice and orderly and one at a time. We have to
-        # implement some structure on top of the stream to do that; the simplest
-        # way is to simply add delimiters between requests. Fortunately, Pilot
-        # implements a little bit of flow control for image requests on its
-        # side.
-        for packet in packet_data.split(";"):
-            if packet == "QUIT":
-                self.clean_up()
-                exit(0)
-            elif packet == "IMAGE":
-                try:
-                    img = self.camera.capture_jpeg()
-                except CameraError:
-                    print "An error occurred while trying to capture an image."
-                    continue # Not much we can do about a camera error.
-                self.comms.send_media(img)
-
-            # Swapping video modes is pretty simple from this end...
-            elif packet == "EDGE":
-                self.camera.set_mode(CameraModule.EDGE_DETECT_MODE)
-            elif packet == "RAW":
-                self.camera.set_mode(CameraModule.RAW_VIDEO_MODE)
-            elif packet == "DOOR":
-                self.camera.set_mode(CameraModule.DOOR_DETECT_MODE)
-            # as is directing movement.
-            elif packet.startswith("MOVE"):
-                packet_parts = packet.split()
-                desired_motion = packet_parts[1]
-                self.motion.move(desired_motion)
-            elif packet.startswith("ROTATE"):
-                packet_parts = packet.split()
-                rotation = packet_parts[1]
-                self.motion.rotate(rotation)
+        # packets coming nice and orderly and one at a time. The decoder holds
+        # on to partial commands until the rest of them arrives.
+        decoder = self.decoders.get(source)
+        if decoder is None:
+            decoder = self.decoders[source] = CommandDecoder()
+        for name, args in decoder.feed(packet_data):
+            self.execute(name, args)
+
+    def execute(self, name, args):
+        """Execute a single decoded command, or queue it by priority."""
+        priority = command_class(name)
+        if name in self.INLINE_COMMANDS:
+            self.run_command(name, args)
+        else:
+            self.scheduler.submit(priority, self.run_command, name, args)
+
+    def run_command(self, name, args):
+        """Run a command's handler."""
+        handler = self.handlers.get(name)
+        if handler is None:
+            print "Unknown command", name
+            return
+        try:
+            handler(args)
+        except IndexError:
+            print "Missing arguments for command", name
+
+    def handle_quit(self, args):
+        self.clean_up()
+        exit(0)
+
+    # IMAGE asks for an image from the first camera, and IMAGE <n> for one
+    # from camera n, counting from 0. Images asked for together come from the
+    # same set of frames, and are sent in camera order.
+    def handle_image(self, args):
+        camera = 0
+        if args:
+            try:
+                camera = int(args[0])
+            except ValueError:
+                print "Expected a camera number after IMAGE:", args[0]
+                return
+        self.image_requests.add(camera)
+
+    def handle_stop(self, args):
+        self.motion.stop()
+
+    def capture_media(self, cameras=(0,)):
+        """Capture a frame from each of cameras and encode them for sending.
+
+        These are JPEGs, unless delta mode is on, in which case it's a delta
+        packet; see driver.modules.deltacodec. Delta mode only covers the
+        first camera, so images from any other aren't sent at all."""
+        if not self.delta_encoder:
+            return self.camera.capture_jpegs(cameras)
+        if 0 not in cameras:
+            print "Delta mode only sends images from the first camera."
+            return []
+        image = self.camera.capture_image()
+        self.delta_encoder.quality = self.camera.jpeg_quality
+        if self.timings:
+            packet = self.timings.time("delta.encode",
+                                       self.delta_encoder.encode,
+                                       self.camera.last_frame.seq, image)
+        else:
+            packet = self.delta_encoder.encode(self.camera.last_frame.seq,
+                                               image)
+        self.camera.pool.release(image)
+        return [packet]
+
+    def serve_image_requests(self):
+        """Capture a frame and send it, if anyone asked for one.
+
+        However many IMAGE requests came in since the last call, the frame is
+        only captured and encoded once; the comms module sends that one frame
+        to everyone who is watching. Requests that come in while a frame is
+        being captured or waiting to be sent wait for the next one."""
+        if not self.image_requests or self.media_busy:
+            return
+        cameras = sorted(self.image_requests)
+        self.image_requests = set()
+        self.media_busy = True
+        self.scheduler.submit(MEDIA, self.produce_media, False, cameras)
+
+    # Swapping video modes is pretty simple from this end...
+    def handle_edge(self, args):
+        self.camera.set_mode(self.camera.EDGE_DETECT_MODE)
+
+    def handle_raw(self, args):
+        self.camera.set_mode(self.camera.RAW_VIDEO_MODE)
+
+    def handle_door(self, args):
+        self.camera.set_mode(self.camera.DOOR_DETECT_MODE)
+
+    # as is directing movement.
+    def handle_move(self, args):
+        self.motion.move(args[0])
+
+    def handle_rotate(self, args):
+        self.motion.rotate(args[0])
+
+    # Streaming frames replaces the IMAGE request/reply cycle.
+    def handle_stream(self, args):
+        try:
+            fps = float(args[0])
+        except ValueError:
+            print "Expected a frame rate after STREAM:", args[0]
+            return
+        if fps > 0:
+            self.start_stream(fps)
+        else:
+            self.stop_stream()
+
+    def handle_stop_stream(self, args):
+        self.stop_stream()
+
+    # Clients that can take QUALITY reports can ask for quality to follow the
+    # link with ADAPT <fps>, and turn it off again with ADAPT 0.
+    # Delta mode, for slow links: DELTA 1 turns it on and DELTA 0 off. Clients
+    # acknowledge each frame they decode with ACK <seq>, and can ask for a
+    # whole frame with KEYFRAME if they lose track. This assumes one client.
+    def handle_delta(self, args):
+        if args[0] == "1":
+            from driver.modules.deltacodec import DeltaEncoder
+            self.delta_encoder = DeltaEncoder(
+                settings.DELTA_TILE_SIZE, settings.DELTA_THRESHOLD,
+                settings.DELTA_KEYFRAME_INTERVAL, self.camera.jpeg_quality)
+        else:
+            self.delta_encoder = None
+
+    def handle_ack(self, args):
+        if self.delta_encoder:
+            try:
+                self.delta_encoder.acknowledge(int(args[0]))
+            except ValueError:
+                print "Expected a frame number after ACK:", args[0]
+
+    def handle_keyframe(self, args):
+        if self.delta_encoder:
+            self.delta_encoder.request_keyframe()
+
+    # STATS replies on the control channel with "STATS <timings>;", where the
+    # timings are as described in Timings.compact(). STATS RESET starts the
+    # timings over. Like QUALITY, Pilot doesn't understand the reply.
+    def handle_stats(self, args):
+        if args and args[0] == "RESET":
+            if self.timings:
+                self.timings.reset()
+            return
+        if self.timings:
+            self.send_command("STATS %s;" % (self.timings.compact(),))
+        else:
+            self.send_command("STATS;")
+
+    # PLAN replies on the control channel with "PLAN <plan>;", describing the
+    # current video pipeline as in Plan.describe(). Pilot doesn't understand
+    # the reply either.
+    def handle_plan(self, args):
+        self.send_command("PLAN %s;" % (self.camera.plan.describe(),))
+
+    # CAMERAS replies on the control channel with "CAMERAS <count> <last>
+    # <mean> <max>;", giving the number of cameras and how far apart in
+    # milliseconds their frames were taken, for the last set of frames, on
+    # average and at worst. Pilot doesn't understand this reply either.
+    def handle_cameras(self, args):
+        stats = self.camera.skew_stats()
+        if not stats:
+            self.send_command("CAMERAS 1 0.0 0.0 0.0;")
+            return
+        self.send_command("CAMERAS %d %.1f %.1f %.1f;" % (
+            stats["cameras"], stats["last_skew"] * 1000,
+            stats["mean_skew"] * 1000, stats["max_skew"] * 1000))
+
+    def handle_adapt(self, args):
+        try:
+            fps = float(args[0])
+        except ValueError:
+            print "Expected a frame rate after ADAPT:", args[0]
+            return
+        if fps > 0:
+            self.start_adapting(fps)
+        else:
+            self.stop_adapting()
 
     def clean_up(self):
         """Free up module resources in preparation for closing."""
-        for module in self.installed_modules:
-            module.close()
+        self.scheduler.stop(1.0)
+        # Anything that never got opened has nothing to close, but something
+        # still being opened in the background will need closing once it is.
+        for loader in (self.camera_loader, self.motion_loader):
+            if loader.settle():
+                loader.get().close()
+        self.comms.close()
+        if self.recorder:
+            self.recorder.close()
 
 def main():
     bluetooth = False
@@ -92,6 +588,24 @@ def main():
         for num, arg in enumerate(sys.argv):
             if arg == "-b":
                 settings.USE_BLUETOOTH = True
+            elif arg == "-m":
+                settings.MULTI_VIEWER = True
+            elif arg == "-t":
+                settings.CAMERA_THREADED = True
+            elif arg == "-s":
+                settings.PIPELINE_STAGED = True
+            elif arg == "-i":
+                settings.TIMING = True
+            elif arg == "-f":
+                if len(sys.argv) > num+1:
+                    settings.CAMERA_FILE = sys.argv[num+1]
+                else:
+                    print "Expected a directory or video after '-f' argument."
+            elif arg == "-r":
+                if len(sys.argv) > num+1:
+                    settings.RECORD_SESSION = sys.argv[num+1]
+                else:
+                    print "Expected a file name after '-r' argument."
             elif arg == "-p":
                 print "Setting port."
                 if len(sys.argv) > num+1:
@@ -1,6 +1,6 @@
 #! /usr/bin/python
 
-from modules import CameraModule
+from modules.camera import CameraModule
 import cv
 import sys
 
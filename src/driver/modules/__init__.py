@@ -1,6 +1,4 @@
-# This package contains BotDriver modules. If you want to be able to import
-# them from the top-level package, add an import statement here.
-
-from camera import CameraModule, CameraError
-from motion import ArduinoMotionModule
-from communications import NetworkCommunicationsModule, BluetoothCommunicationsModule
+# This package contains BotDriver modules. Import them from their own
+# submodules, e.g. driver.modules.camera, rather than from here: importing one
+# shouldn't drag in cv, serial and bluetooth for all the others, since the
+# driver only loads what the chosen mode needs.
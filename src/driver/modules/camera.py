@@ -1,7 +1,16 @@
 """BotDriver module designed to handle input from a webcam."""
 
 import cv
+import time
+from capture import Frame, FrameGrabber
+from framebus import FrameBus
+from multicapture import MultiCapture, MultiCaptureError
+from sources import open_source
 from pipelines import *
+from planning import Stage, plan_pipeline
+from staging import StagedPipeline
+from driver.util.lrucache import ByteLRUCache
+from driver.util.timing import instrument
 import driver.settings as settings
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
@@ -14,49 +23,369 @@ class CameraModule:
     EDGE_DETECT_MODE = 1
     DOOR_DETECT_MODE = 2
     
-    def __init__(self):
-        self.capture = cv.CaptureFromCAM(settings.DEFAULT_CAMERA)
+    def __init__(self, threaded=None, ring_depth=None, drop_policy=None,
+                 staged=None, timings=None, source=None, sources=None):
+        # Frames come from the camera unless we're given something else to read
+        # them from, like a FileSource (see driver.modules.sources).
+        if sources is None and source is None and settings.CAMERA_DEVICES:
+            sources = [open_source(spec, settings.CAMERA_FILE_LATENCY)
+                       for spec in settings.CAMERA_DEVICES]
+        if sources:
+            source = sources[0]
+        elif source is None:
+            if settings.CAMERA_FILE:
+                source = open_source(settings.CAMERA_FILE)
+            else:
+                source = open_source(settings.DEFAULT_CAMERA)
+        # The first camera is the one images are sent from unless another is
+        # asked for.
+        self.source = source
+        self.sources = sources or [source]
+        # With more than one camera, they're all captured together and each
+        # gets a pipeline of its own (see driver.modules.multicapture).
+        self.multi_capture = None
+        if len(self.sources) > 1:
+            self.multi_capture = MultiCapture(self.sources)
+        # Size of the images coming out of the pipeline, and the quality they're
+        # encoded at.
+        self.resolution = settings.CAMERA_RESOLUTION
+        self.jpeg_quality = settings.JPEG_QUALITY
+        # Ask the camera to capture at the size we send, so there's nothing to
+        # resize. Whatever it settles on is what pipelines are planned for.
+        if settings.CAMERA_REQUEST_RESOLUTION:
+            self.capture_sizes = [source.request_size(self.resolution)
+                                  for source in self.sources]
+        else:
+            self.capture_sizes = [source.size() for source in self.sources]
+        self.capture_size = self.capture_sizes[0]
+        # When given a Timings (see driver.util.timing), we record how long it
+        # takes to read the camera, run each pipe and encode images. Without
+        # one, none of that is measured at all.
+        self.timings = timings
+        # Pool shared by all of the pipeline stages. Its counters can be read
+        # at any time with self.pool.stats().
+        self.pool = default_pool
+
+        # The most recent frame handed to the pipeline, so callers can find out
+        # its sequence number and when it was captured.
+        self.last_frame = None
+        self.frame_count = 0
+        # Likewise the most recent set of frames from all of the cameras.
+        self.last_frame_set = None
+        # When set, every raw frame read is appended to a session recording
+        # (see driver.modules.recording).
+        self.recorder = None
+        # When set, every raw frame is published for other processes on the
+        # board to read (see driver.modules.framebus).
+        self.frame_bus = None
+        if settings.FRAME_BUS:
+            self.frame_bus = FrameBus(settings.FRAME_BUS,
+                                      settings.FRAME_BUS_SLOTS)
+
+        # In threaded mode a background thread keeps reading the camera, and
+        # requests are served from the newest frame it has.
+        if threaded is None:
+            threaded = settings.CAMERA_THREADED
+        if ring_depth is None:
+            ring_depth = settings.CAMERA_RING_DEPTH
+        if drop_policy is None:
+            drop_policy = settings.CAMERA_DROP_POLICY
+        if staged is None:
+            staged = settings.PIPELINE_STAGED
+        if self.multi_capture and (threaded or staged):
+            # Each camera reading on its own would undo the synchronization.
+            raise CameraError("Multi-camera capture can't be threaded or "
+                              "staged.")
+        self.grabber = None
+        if threaded:
+            self.grabber = FrameGrabber(self.source, ring_depth, drop_policy)
+            if self.frame_bus:
+                # Publish every frame as it's captured, whether or not anyone
+                # here asks for it.
+                self.grabber.listeners.append(self.frame_bus.publish)
+            self.grabber.start()
+
+        # In staged mode every pipe runs on its own worker, and requests are
+        # served from the newest frame to come out of the far end.
+        self.staged = staged
+        self.staged_pipeline = None
+
+        # Encoded images, keyed by (frame sequence, mode, quality, resolution).
+        # Hit and miss counts can be read with self.jpeg_cache.stats().
+        self.jpeg_cache = ByteLRUCache(settings.JPEG_CACHE_MAX_BYTES)
+
         self.set_mode(self.RAW_VIDEO_MODE)
         
     def capture_image_to_file(self, filename):
         """Capture an image and write it to a file."""
         image = self.capture_image()
         cv.SaveImage(filename, image)
+        self.pool.release(image)
 
     def capture_image(self):
         """Capture and process an image from the webcam."""
-        image = cv.QueryFrame(self.capture)
-        if not image:
-            raise CameraError("Failed to capture image!")
-        image = self.pass_to_pipeline(image)
+        if self.staged_pipeline:
+            return self.staged_frame().image
+        frame = self.capture_frame()
+        image = self.pass_to_pipeline(frame.image)
         return image        
 
-    def capture_jpeg(self):
-        """Capture an image from the webcam and return it encoded as a JPEG."""
-        image = self.capture_image()
-        jpeg = cv.EncodeImage('.jpeg', image)
-        return jpeg.tostring()
+    def staged_frame(self):
+        """Get the newest frame to come out of the staged pipeline."""
+        frame = self.staged_pipeline.latest(
+            settings.CAMERA_FIRST_FRAME_TIMEOUT)
+        if not frame:
+            raise CameraError("No frames through the pipeline yet!")
+        self.last_frame = frame
+        return frame
+
+    def capture_frame(self):
+        """Get a raw frame from the webcam, without processing it.
+
+        In threaded mode this is the newest frame in the capture ring, and
+        only blocks while waiting for the very first frame. With several
+        cameras, all of them grab a frame together and this is the first
+        one's; see capture_frame_set()."""
+        if self.multi_capture:
+            return self.capture_frame_set([0]).frames[0]
+        if self.grabber:
+            if self.timings:
+                frame = self.timings.time(
+                    "camera.read", self.grabber.latest,
+                    settings.CAMERA_FIRST_FRAME_TIMEOUT)
+            else:
+                frame = self.grabber.latest(
+                    settings.CAMERA_FIRST_FRAME_TIMEOUT)
+            if not frame:
+                raise CameraError("No frames captured yet!")
+        else:
+            image = self.query_frame()
+            if not image:
+                raise CameraError("Failed to capture image!")
+            self.frame_count += 1
+            frame = Frame(self.frame_count, time.time(), image)
+            if self.frame_bus:
+                self.frame_bus.publish(frame)
+        if self.recorder:
+            self.recorder.record_frame(frame)
+        self.last_frame = frame
+        return frame
+
+    def capture_frame_set(self, cameras=None):
+        """Get raw frames from every camera, taken together, without
+        processing them.
+
+        cameras lists the cameras whose frames are wanted, or None for all
+        of them. The first camera's is always retrieved, since last_frame,
+        recordings and the frame bus follow it; every other camera only
+        grabs, and has None in place of a frame.
+
+        Returns a FrameSet (see driver.modules.multicapture), whose skew says
+        how far apart the cameras took their frames."""
+        if not self.multi_capture:
+            raise CameraError("Only one camera is configured!")
+        if cameras is not None:
+            cameras = sorted(set(cameras) | set([0]))
+        try:
+            if self.timings:
+                frame_set = self.timings.time("camera.read",
+                                              self.multi_capture.capture,
+                                              cameras)
+            else:
+                frame_set = self.multi_capture.capture(cameras)
+        except MultiCaptureError, e:
+            raise CameraError(str(e))
+        self.frame_count += 1
+        frame = frame_set.frames[0]
+        if self.frame_bus:
+            self.frame_bus.publish(frame)
+        if self.recorder:
+            self.recorder.record_frame(frame)
+        self.last_frame_set = frame_set
+        self.last_frame = frame
+        return frame_set
+
+    def skew_stats(self):
+        """Get the multi-camera capture's counters, including how far apart
+        in time the cameras' frames were; see MultiCapture.stats(). Returns
+        None with only one camera."""
+        if self.multi_capture:
+            return self.multi_capture.stats()
+        return None
+
+    def capture_jpeg(self, quality=None, camera=0):
+        """Capture an image from the webcam and return it encoded as a JPEG.
+
+        Encoded images are cached by frame, mode, quality and resolution, so
+        asking again before the camera has a new frame costs next to nothing.
+        That only happens in threaded or staged mode; otherwise every request
+        reads a fresh frame.
+
+        With several cameras, camera picks which one's image to encode. To get
+        images from more than one camera taken together, use capture_jpegs()."""
+        return self.capture_jpegs([camera], quality)[0]
+
+    def capture_jpegs(self, cameras, quality=None):
+        """Capture images from a list of cameras, all from the same set of
+        frames, and return them encoded as JPEGs in the same order."""
+        if quality is None:
+            quality = self.jpeg_quality
+        for camera in cameras:
+            if not 0 <= camera < len(self.sources):
+                raise CameraError("No camera %d!" % (camera,))
+
+        if self.staged_pipeline:
+            frames = [self.staged_frame()]
+        elif self.multi_capture:
+            frames = self.capture_frame_set(cameras).frames
+        else:
+            frames = [self.capture_frame()]
+        return [self._encode_jpeg(frames[camera], camera, quality)
+                for camera in cameras]
+
+    def _encode_jpeg(self, frame, camera, quality):
+        """Run a camera's frame through its pipeline and encode it, unless
+        it's in the cache already."""
+        def encode():
+            if self.staged_pipeline:
+                image = frame.image
+            else:
+                image = self.first_pipes[camera].process(frame.image)
+            params = [cv.CV_IMWRITE_JPEG_QUALITY, quality]
+            if self.timings:
+                jpeg = self.timings.time("jpeg.encode", cv.EncodeImage,
+                                         '.jpeg', image, params)
+            else:
+                jpeg = cv.EncodeImage('.jpeg', image, params)
+            # The pipeline's output may have been leased from the buffer pool;
+            # now that it's encoded we're done with it.
+            self.pool.release(image)
+            return jpeg.tostring()
+
+        key = (frame.seq, self.mode, quality, self.resolution, camera)
+        return self.jpeg_cache.get_or_compute(key, encode)
         
     def pass_to_pipeline(self, image):
         """Perform preprocessing on the image by passing it to a pipeline."""
         processed_image = self.first_pipe.process(image)
         return processed_image
 
+    def staged_source(self):
+        """Get the next raw frame for the staged pipeline.
+
+        Unlike capture_frame, this waits for a new frame rather than handing
+        back the one the pipeline has already seen, and the frame it returns
+        is the pipeline's to keep."""
+        if self.grabber:
+            frame = self.grabber.next_frame(
+                self.staged_seq, settings.CAMERA_FIRST_FRAME_TIMEOUT)
+            if not frame:
+                raise CameraError("Timed out waiting for a frame!")
+            self.staged_seq = frame.seq
+            if self.recorder:
+                self.recorder.record_frame(frame)
+            return frame
+        image = self.query_frame()
+        if not image:
+            raise CameraError("Failed to capture image!")
+        # The capture owns the frame it hands back, so the pipeline needs its
+        # own copy. The first stage gives it back to the pool when it's done.
+        copy = self.pool.lease((image.width, image.height), image.depth,
+                               image.nChannels)
+        cv.Copy(image, copy)
+        self.frame_count += 1
+        frame = Frame(self.frame_count, time.time(), copy)
+        if self.frame_bus:
+            self.frame_bus.publish(frame)
+        if self.recorder:
+            self.recorder.record_frame(frame)
+        return frame
+
+    def query_frame(self):
+        """Read a frame straight from the camera."""
+        if self.timings:
+            return self.timings.time("camera.read", self.source.read)
+        return self.source.read()
+
+    def queue_depths(self):
+        """Get the depth of each stage's queue in staged mode.
+
+        See StagedPipeline.depths(). Returns an empty list when the pipeline
+        isn't staged."""
+        if self.staged_pipeline:
+            return self.staged_pipeline.depths()
+        return []
+
     def set_mode(self, mode):
         """Set the video pipeline mode for this camera module."""
         if mode == self.RAW_VIDEO_MODE:
             print "Setting up raw video pipeline."
-            self.first_pipe = ResizePipe(None)
+            stages = []
         elif mode == self.EDGE_DETECT_MODE:
             print "Setting up edge detection pipeline."
-            last_pipe = ResizePipe(None)
-            self.first_pipe = EdgeDetectPipe(last_pipe)
+            stages = [Stage(EdgeDetectPipe)]
         elif mode == self.DOOR_DETECT_MODE:
             print "Setting up door detection pipeline."
-            last_pipe = ResizePipe(None)
-            second_pipe = ScanningDoorDetectPipe(last_pipe)
-            self.first_pipe = EdgeDetectPipe(second_pipe)
+            if settings.DOOR_TRACKING:
+                # Find the door with the barscan, then follow it with optical
+                # flow until we lose it.
+                stages = [Stage(TrackingDoorDetectPipe,
+                                ScanningDoorDetectPipe(None),
+                                settings.DOOR_TRACKING_MIN_CONFIDENCE,
+                                redetect_interval=
+                                settings.DOOR_REDETECT_INTERVAL)]
+            else:
+                stages = [Stage(EdgeDetectPipe),
+                          Stage(ScanningDoorDetectPipe)]
+        # The resize goes wherever it saves the most work; see
+        # driver.modules.planning. Every camera gets its own pipeline, since
+        # pipes like the door tracker remember what they saw last frame.
+        self.plans = [plan_pipeline(stages, capture_size, self.resolution,
+                                    self.pool)
+                      for capture_size in self.capture_sizes]
+        for plan in self.plans:
+            print "Pipeline plan:", plan.describe()
+        self.plan = self.plans[0]
+        self.resize_pipe = self.plan.resize_pipe
+        self.first_pipes = [plan.first_pipe for plan in self.plans]
+        self.mode = mode
+        if self.timings and not self.staged:
+            # Staged pipelines time each stage themselves.
+            self.first_pipes = [instrument(pipe, self.timings)
+                                for pipe in self.first_pipes]
+        self.first_pipe = self.first_pipes[0]
+
+        if self.staged:
+            if self.staged_pipeline:
+                self.staged_pipeline.stop()
+            self.staged_seq = 0
+            self.staged_pipeline = StagedPipeline(
+                self.first_pipe, self.staged_source,
+                settings.PIPELINE_QUEUE_DEPTH, settings.PIPELINE_WORKERS,
+                self.pool, self.timings)
+            self.staged_pipeline.start()
+
+    def set_resolution(self, resolution):
+        """Change the size of the images coming out of the pipeline.
+
+        This takes effect right away, without rebuilding the pipeline."""
+        self.resolution = tuple(resolution)
+        for plan in self.plans:
+            plan.set_output_size(self.resolution)
+
+    def set_quality(self, quality):
+        """Change the JPEG quality images are encoded at, from 0 to 100."""
+        self.jpeg_quality = quality
 
     def close(self):
         """Close the module and perform any clean up necessary."""
-        pass
+        if self.staged_pipeline:
+            self.staged_pipeline.stop()
+        if self.grabber:
+            self.grabber.stop()
+        if self.multi_capture:
+            self.multi_capture.close()
+        if self.frame_bus:
+            self.frame_bus.close()
+        for source in self.sources:
+            source.close()
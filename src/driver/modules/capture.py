@@ -0,0 +1,172 @@
+"""Background frame capture for the camera module.
+
+Querying the camera only when someone asks for an image means every request
+pays the full sensor read latency, and whatever the driver had queued up
+internally comes back stale. A FrameGrabber instead reads frames continuously
+on its own thread and keeps the newest few in a small ring buffer, each tagged
+with a sequence number and the time it was captured, so readers can pick up
+the latest frame without waiting on the camera."""
+
+import cv
+import threading
+import time
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class Frame:
+    """A captured image along with its sequence number and timestamp."""
+
+    def __init__(self, seq, timestamp, image):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.image = image
+
+class FrameGrabber:
+    """Captures frames from a camera on a background thread.
+
+    The ring buffer holds the last `depth` frames. When readers fall behind,
+    the drop policy decides what happens to new frames:
+
+      DROP_OLDEST: New frames overwrite the oldest ones in the ring. Readers
+        always see the freshest image, but may miss some in between.
+      DROP_NEWEST: Once the ring is full of frames nobody has read yet, new
+        frames are thrown away until a reader catches up. Readers see every
+        frame in a run, at the cost of them getting older.
+
+    Either way, gaps in the sequence numbers tell readers what they missed."""
+
+    DROP_OLDEST = "oldest"
+    DROP_NEWEST = "newest"
+
+    def __init__(self, source, depth=4, drop_policy=DROP_OLDEST):
+        if depth < 1:
+            raise ValueError("Ring depth must be at least 1.")
+        if drop_policy not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("Unknown drop policy %s." % (drop_policy,))
+        self.source = source
+        self.depth = depth
+        self.drop_policy = drop_policy
+
+        self.ring = [None] * depth
+        # Sequence number of the newest frame in the ring, and of the newest
+        # frame any reader has taken.
+        self.last_seq = 0
+        self.last_read_seq = 0
+
+        self.captured = 0
+        self.dropped = 0
+        self.failures = 0
+
+        self.running = False
+        self.thread = None
+        self.new_frame = threading.Condition(threading.Lock())
+        # Called with every new Frame, on the capture thread, once it's in the
+        # ring.
+        self.listeners = []
+
+    def start(self):
+        """Start capturing frames in the background."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="FrameGrabber")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop capturing and wait for the capture thread to finish."""
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def latest(self, timeout=None):
+        """Get the newest frame in the ring.
+
+        This only blocks if nothing has been captured yet, in which case it
+        waits up to timeout seconds for the first frame. Returns None if there
+        is still no frame after that."""
+        with self.new_frame:
+            if self.last_seq == 0 and timeout:
+                self.new_frame.wait(timeout)
+            if self.last_seq == 0:
+                return None
+            frame = self.ring[self.last_seq % self.depth]
+            self.last_read_seq = max(self.last_read_seq, frame.seq)
+            return frame
+
+    def next_frame(self, seq, timeout=None):
+        """Wait for a frame newer than seq and return the newest one.
+
+        Returns None if no such frame arrives within timeout seconds."""
+        with self.new_frame:
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while self.last_seq <= seq:
+                if deadline is None:
+                    self.new_frame.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self.new_frame.wait(remaining)
+            frame = self.ring[self.last_seq % self.depth]
+            self.last_read_seq = max(self.last_read_seq, frame.seq)
+            return frame
+
+    def since(self, seq):
+        """Get every frame still in the ring newer than seq, oldest first."""
+        with self.new_frame:
+            first = max(seq + 1, self.last_seq - self.depth + 1, 1)
+            frames = [self.ring[i % self.depth]
+                      for i in range(first, self.last_seq + 1)]
+            if frames:
+                self.last_read_seq = max(self.last_read_seq, frames[-1].seq)
+            return frames
+
+    def stats(self):
+        """Get a snapshot of the grabber's counters as a dictionary."""
+        with self.new_frame:
+            return {"captured": self.captured,
+                    "dropped": self.dropped,
+                    "failures": self.failures,
+                    "last_seq": self.last_seq,
+                    "unread": self.last_seq - self.last_read_seq}
+
+    def _run(self):
+        while self.running:
+            image = self.source.read()
+            timestamp = time.time()
+            if not image:
+                self.failures += 1
+                # Don't spin on a camera that has gone away.
+                time.sleep(0.01)
+                continue
+
+            with self.new_frame:
+                self.captured += 1
+                if (self.drop_policy == self.DROP_NEWEST and
+                    self.last_seq - self.last_read_seq >= self.depth):
+                    # The ring is full of frames nobody has looked at yet. We
+                    # still had to read this one to keep the camera's own
+                    # queue from going stale.
+                    self.dropped += 1
+                    continue
+                if self.last_seq - self.last_read_seq >= self.depth:
+                    # We're about to overwrite a frame nobody read.
+                    self.dropped += 1
+
+            # The source hands back a buffer it owns, which will be overwritten
+            # on the next read, so the ring needs its own copy. The copy is
+            # never reused either, since readers may still be working on an old
+            # frame after it leaves the ring.
+            image = cv.CloneImage(image)
+
+            with self.new_frame:
+                self.last_seq += 1
+                frame = Frame(self.last_seq, timestamp, image)
+                self.ring[self.last_seq % self.depth] = frame
+                self.new_frame.notify_all()
+            for listener in self.listeners:
+                listener(frame)
@@ -3,17 +3,25 @@
 This module provides two methods for communications: Bluetooth and Network.
 Bluetooth, as the name implies, communicates over a short-range radio link
 directly with the Pilot program. Network talks over TCP, using whatever link is
-available at the time."""
+available at the time. MultiViewer also talks over TCP, but serves any number
+of Pilots at once."""
 
-import bluetooth
+import collections
+import errno
 import select
 import socket
+import time
 import uuid
-from util import netutils
+from driver.util import framing, netutils
+from driver.util.framing import FrameWriter
 import driver.settings as settings
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
+# Only imported once a Bluetooth link is brought up, so the network links
+# start quickly, and work on machines without PyBluez.
+bluetooth = None
+
 class NetworkCommunicationsModule:
     """An interface to standard TCP/IP network communications links."""
 
@@ -24,7 +32,11 @@ class NetworkCommunicationsModule:
         # Opening up to the world, we create a pair of server sockets.
         self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.addr = netutils.get_ip_addr()
+        self.addr = settings.BIND_ADDRESS
+        # Let a restarted driver listen again right away, rather than waiting
+        # for the last one's connections to time out.
+        for sock in (self.video_socket, self.control_socket):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         # Video will always be sent on the video socket outbound channel.
         # Commands can be received on either socket; but it's generally a good
@@ -33,14 +45,23 @@ class NetworkCommunicationsModule:
         self.video_socket.bind((self.addr, self.DEFAULT_VIDEO_PORT))
         self.control_socket.bind((self.addr, self.DEFAULT_CONTROL_PORT))
 
+        # When set, images go out as self-framed frames on the video channel
+        # (see driver.util.framing) instead of with their length on the
+        # control channel. Pilot doesn't understand these yet.
+        self.framed = settings.MEDIA_FRAMED
+        self.media_seq = 0
+
     def wait_for_connections(self):
         # Begin listening with no timeout, and get ready for incoming requests.
         self.video_socket.listen(0)
         self.control_socket.listen(0)
         self.video_conn = None
         self.control_conn = None
+        # Writes images and stream frames to the video channel a piece at a
+        # time, so a slow link never holds up reading commands.
+        self.video_writer = None
 
-        print "Listening on %s." % (self.addr,)
+        print "Listening on %s." % (netutils.describe_addr(self.addr),)
 
         # We'll go ahead and wait for connections using select() so we can
         # accept connections in any order.
@@ -56,19 +77,40 @@ class NetworkCommunicationsModule:
                     print "Accepted connection from %s." % (address,)
                 sock.close()
                 available_sockets.remove(sock)
+        for conn in (self.video_conn, self.control_conn):
+            netutils.tune_socket(conn, settings.TCP_NODELAY,
+                                 settings.SEND_BUFFER_BYTES)
+        self.video_writer = FrameWriter(self.video_conn)
+
+    def get_packets(self, timeout=None):
+        """Return all packets from the network interface.
 
-    def get_packets(self):
-        """Return all packets from the network interface."""
+        Blocks until at least one packet arrives, or until timeout seconds
+        have passed if a timeout is given."""
+        return [packet for connection, packet in self.read_packets(timeout)]
+
+    def read_packets(self, timeout=None):
+        """Return all packets from the network interface, with their sources.
+
+        Works just like get_packets(), but returns (connection, packet) tuples
+        so that data from each connection can be kept separate. The rest of an
+        image that's being sent goes out while we wait, and we return early,
+        with no packets, when the video channel can take more of it."""
         # Get all of the sockets ready for reading using select()...
+        wlist = []
+        if self.video_writer.busy():
+            wlist = [self.video_conn]
         rlist, wlist, xlist = select.select(
-            [self.video_conn, self.control_conn], [], [])
+            [self.video_conn, self.control_conn], wlist, [], timeout)
+        if wlist:
+            self.video_writer.flush()
 
         packets = []
 
         # Now, go through the list and execute commands from each socket.
         for connection in rlist:
             packet = connection.recv(4096)
-            packets.append(packet)
+            packets.append((connection, packet))
 
         return packets
 
@@ -77,11 +119,46 @@ class NetworkCommunicationsModule:
         self.control_conn.sendall(command)
 
     def send_media(self, media):
-        """Send data using the media channel."""
+        """Start sending data using the media channel.
+
+        Only as much as the socket will take right away is sent; the rest
+        goes out while packets are read. Wait for media_ready() before sending
+        the next image, or this blocks until the last one is out."""
+        # A half-sent image or stream frame has to go out before anything else
+        # can.
+        self.video_writer.finish()
+        if self.framed:
+            # Header and image go out together on the one socket, straight
+            # from the encoder's string.
+            self.media_seq += 1
+            self.video_writer.offer(self.media_seq, time.time(), media)
+            return
         # The first thing we expect on the receive side is a string containing
         # the length of the media file, followed by a semicolon.
         self.control_conn.sendall("%s;" % len(media))
-        self.video_conn.sendall(media)
+        self.video_writer.offer_parts([memoryview(media)])
+
+    def media_ready(self):
+        """Whether the media channel has finished sending what it was given."""
+        self.video_writer.flush()
+        return not self.video_writer.busy()
+
+    def send_stream_frame(self, seq, timestamp, media):
+        """Push a self-framed frame on the media channel without blocking.
+
+        Returns False if the frame was dropped because the link hasn't finished
+        sending the last one."""
+        return self.video_writer.offer(seq, timestamp, media)
+
+    def stream_ready(self):
+        """Whether the media channel can take another stream frame right now.
+
+        If it can't, the frame that would have been sent counts as dropped."""
+        self.video_writer.flush()
+        if self.video_writer.busy():
+            self.video_writer.dropped += 1
+            return False
+        return True
 
     def close(self):
         """Close the module and perform any clean up necessary."""
@@ -90,12 +167,330 @@ class NetworkCommunicationsModule:
         if self.control_conn:
             self.control_conn.close()
 
+
+class ClientSession:
+    """A single client of the multi-viewer module.
+
+    Pilot opens a video connection and then a control connection, so the two
+    are paired up by the host they come from. A client may also connect only
+    a control channel, in which case it can send commands but won't be sent
+    any images.
+
+    Images waiting to go out are kept in a bounded queue; if the client can't
+    keep up, the oldest images are dropped so that it never falls more than a
+    few frames behind, and never holds up anyone else."""
+
+    def __init__(self, host, queue_depth):
+        self.host = host
+        self.queue_depth = queue_depth
+        self.video_conn = None
+        self.control_conn = None
+
+        # Images waiting to be sent. The same string is shared by every
+        # session it was sent to.
+        self.media_queue = collections.deque()
+        # Data being written to each connection, and how much of it is out.
+        # What's left for the video connection is a list of memoryviews, which
+        # may be shared with other sessions.
+        self.control_out = collections.deque()
+        self.control_offset = 0
+        self.video_out = None
+
+        self.sent = 0
+        self.dropped = 0
+
+    def is_viewer(self):
+        """Whether this client can be sent images."""
+        return self.video_conn is not None and self.control_conn is not None
+
+    def connections(self):
+        return [conn for conn in (self.video_conn, self.control_conn) if conn]
+
+    def queue_media(self, media):
+        if len(self.media_queue) >= self.queue_depth:
+            self.media_queue.popleft()
+            self.dropped += 1
+        self.media_queue.append(media)
+
+    def queue_command(self, command):
+        self.control_out.append(command)
+
+    def offer_stream_frame(self, parts):
+        """Start sending a self-framed stream frame, given as the list from
+        framing.frame_parts(), unless the video channel is still busy. Returns
+        False if the frame was dropped."""
+        if self.video_out is not None:
+            self.dropped += 1
+            return False
+        self.video_out = parts
+        return True
+
+    def wants_write(self, conn):
+        if conn is self.control_conn:
+            return len(self.control_out) > 0
+        return self.video_out is not None or (
+            len(self.media_queue) > 0 and self.is_viewer())
+
+    def flush(self):
+        """Write as much as the connections will take without blocking."""
+        if self.video_out is None and self.media_queue and self.is_viewer():
+            # Pilot expects the length of the image on the control channel,
+            # followed by the image itself on the video channel.
+            media = self.media_queue.popleft()
+            self.control_out.append("%s;" % len(media))
+            self.video_out = [memoryview(media)]
+            self.sent += 1
+
+        while self.control_out:
+            data = self.control_out[0]
+            self.control_offset = send_some(self.control_conn, data,
+                                            self.control_offset)
+            if self.control_offset < len(data):
+                break
+            self.control_out.popleft()
+            self.control_offset = 0
+
+        if self.video_out is not None:
+            self.video_out = send_parts_some(self.video_conn, self.video_out)
+
+    def close(self):
+        for conn in self.connections():
+            conn.close()
+
+def send_some(conn, data, offset):
+    """Send as much of data as a non-blocking socket will take.
+
+    Returns the offset of the first byte which hasn't been sent."""
+    try:
+        return offset + conn.send(memoryview(data)[offset:])
+    except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return offset
+        raise
+
+def send_parts_some(conn, parts):
+    """Send as much of a list of memoryviews as a non-blocking socket will
+    take, without joining them.
+
+    Returns what's left to send, or None once it's all out."""
+    while parts:
+        try:
+            sent = framing.send_parts(conn, parts)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return parts
+            raise
+        parts = framing.skip_bytes(parts, sent)
+    return None
+
+class MultiViewerCommunicationsModule:
+    """A TCP/IP interface which serves any number of clients at once.
+
+    Instead of accepting one video and one control connection and closing the
+    listening sockets, this keeps listening for the life of the driver and
+    runs every connection through a single non-blocking select() loop.
+    Commands from every client are handed back from get_packets(), and each
+    image passed to send_media() goes out to every connected viewer, so it
+    only has to be captured and encoded once no matter how many are watching.
+    Every viewer has its own bounded queue, so a slow one drops frames rather
+    than stalling the others."""
+
+    DEFAULT_VIDEO_PORT = 9494
+    DEFAULT_CONTROL_PORT = 9495
+
+    def __init__(self, queue_depth=None):
+        if queue_depth is None:
+            queue_depth = settings.VIEWER_QUEUE_DEPTH
+        self.queue_depth = queue_depth
+
+        self.video_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addr = settings.BIND_ADDRESS
+        for sock in (self.video_socket, self.control_socket):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.video_socket.bind((self.addr, self.DEFAULT_VIDEO_PORT))
+        self.control_socket.bind((self.addr, self.DEFAULT_CONTROL_PORT))
+
+        self.sessions = []
+        # Connection -> the session it belongs to.
+        self.session_for = {}
+
+    def wait_for_connections(self):
+        """Start listening for clients.
+
+        Unlike the single client modules this returns right away; clients are
+        accepted as they arrive while packets are being read."""
+        self.video_socket.listen(5)
+        self.control_socket.listen(5)
+        self.video_socket.setblocking(0)
+        self.control_socket.setblocking(0)
+        print "Listening on %s for any number of clients." % (
+            netutils.describe_addr(self.addr),)
+
+    def get_packets(self, timeout=None):
+        """Return all packets from every client.
+
+        Blocks until at least one packet arrives, or until timeout seconds
+        have passed if a timeout is given. Pending writes keep going out while
+        we wait."""
+        return [packet for connection, packet in self.read_packets(timeout)]
+
+    def read_packets(self, timeout=None):
+        """Return all packets from every client, with their sources.
+
+        Works just like get_packets(), but returns (connection, packet) tuples
+        so that data from each connection can be kept separate."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            connections = self.session_for.keys()
+            rlist = [self.video_socket, self.control_socket] + connections
+            wlist = [conn for conn in connections
+                     if self.session_for[conn].wants_write(conn)]
+            wait = None
+            if deadline is not None:
+                wait = max(0, deadline - time.time())
+            readable, writable, errors = select.select(rlist, wlist, [], wait)
+
+            for conn in writable:
+                self._flush(self.session_for.get(conn))
+
+            packets = []
+            for sock in readable:
+                if sock is self.video_socket or sock is self.control_socket:
+                    self._accept(sock)
+                    continue
+                session = self.session_for.get(sock)
+                if session is None:
+                    continue
+                try:
+                    packet = sock.recv(4096)
+                except socket.error:
+                    packet = ""
+                if not packet:
+                    self._drop(session)
+                    continue
+                packets.append((sock, packet))
+
+            if packets or (deadline is not None and time.time() >= deadline):
+                return packets
+
+    def send_command(self, command):
+        """Send data to every client on its command channel."""
+        for session in list(self.sessions):
+            if session.control_conn:
+                session.queue_command(command)
+                self._flush(session)
+
+    def send_media(self, media):
+        """Send an image to every viewer."""
+        for session in list(self.sessions):
+            if session.is_viewer():
+                session.queue_media(media)
+                self._flush(session)
+
+    def media_ready(self):
+        """Whether another image can be sent. Images are queued for each
+        viewer, so there's always room."""
+        return True
+
+    def send_stream_frame(self, seq, timestamp, media):
+        """Push a self-framed frame to every viewer without blocking.
+
+        Viewers whose video channel is still busy with the last frame miss
+        this one. Returns False only if every viewer missed it."""
+        # Built once and shared; each session keeps its own list of what's
+        # left, so nothing is copied however many viewers there are.
+        parts = framing.frame_parts(seq, timestamp, media)
+        accepted = False
+        for session in list(self.sessions):
+            if session.video_conn and session.offer_stream_frame(parts):
+                accepted = True
+                self._flush(session)
+        return accepted
+
+    def stream_ready(self):
+        """Whether any viewer can take another stream frame right now."""
+        for session in list(self.sessions):
+            if session.video_conn:
+                self._flush(session)
+                if session.video_out is None:
+                    return True
+        return False
+
+    def viewer_stats(self):
+        """Get (host, images sent, images dropped, images queued) for each
+        client."""
+        return [(session.host, session.sent, session.dropped,
+                 len(session.media_queue)) for session in self.sessions]
+
+    def close(self):
+        """Close the module and perform any clean up necessary."""
+        for session in list(self.sessions):
+            self._drop(session)
+        self.video_socket.close()
+        self.control_socket.close()
+
+    def _accept(self, listener):
+        try:
+            conn, address = listener.accept()
+        except socket.error:
+            return
+        conn.setblocking(0)
+        netutils.tune_socket(conn, settings.TCP_NODELAY,
+                             settings.SEND_BUFFER_BYTES)
+        host = address[0]
+        is_video = listener is self.video_socket
+
+        # Pair this connection with the oldest half-open session from the same
+        # host, if there is one.
+        session = None
+        for candidate in self.sessions:
+            if candidate.host != host:
+                continue
+            if is_video and candidate.video_conn is None:
+                session = candidate
+                break
+            if not is_video and candidate.control_conn is None:
+                session = candidate
+                break
+        if session is None:
+            session = ClientSession(host, self.queue_depth)
+            self.sessions.append(session)
+
+        if is_video:
+            session.video_conn = conn
+        else:
+            session.control_conn = conn
+            print "Accepted connection from %s." % (address,)
+        self.session_for[conn] = session
+
+    def _flush(self, session):
+        if session is None:
+            return
+        try:
+            session.flush()
+        except socket.error as e:
+            print "Dropping client %s: %s" % (session.host, e)
+            self._drop(session)
+
+    def _drop(self, session):
+        for conn in session.connections():
+            self.session_for.pop(conn, None)
+        session.close()
+        if session in self.sessions:
+            self.sessions.remove(session)
+
             
 class BluetoothCommunicationsModule:
     """An interface to Bluetooth radio links."""
     UUID = 'c917b21c-492f-4cb6-bc87-77f4031b88af'
 
     def __init__(self, service_name = "BotDriver"):
+        global bluetooth
+        import bluetooth
         self.video_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         self.control_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         self.video_socket.bind(("", bluetooth.PORT_ANY))
@@ -109,6 +504,7 @@ class BluetoothCommunicationsModule:
         
         self.video_conn = None
         self.control_conn = None
+        self.stream_writer = None
 
         print "Listening on bluetooth."
         print "Video channel: %s" % (video_port,)
@@ -137,16 +533,26 @@ class BluetoothCommunicationsModule:
                     print "Accepted connection from %s." % (address,)
                 available_sockets.remove(sock)
 
-    def get_packets(self):
-        """Return all of the packets from the Bluetooth interface."""
+    def get_packets(self, timeout=None):
+        """Return all of the packets from the Bluetooth interface.
+
+        Blocks until at least one packet arrives, or until timeout seconds
+        have passed if a timeout is given."""
+        return [packet for connection, packet in self.read_packets(timeout)]
+
+    def read_packets(self, timeout=None):
+        """Return all packets from the Bluetooth interface, with their sources.
+
+        Works just like get_packets(), but returns (connection, packet) tuples
+        so that data from each connection can be kept separate."""
         rlist, wlist, xlist = select.select(
-            [self.video_conn, self.control_conn], [], [])
+            [self.video_conn, self.control_conn], [], [], timeout)
 
         packets = []
 
         for connection in rlist:
             packet = connection.recv(4096)
-            packets.append(packet)
+            packets.append((connection, packet))
 
         return packets
 
@@ -154,8 +560,36 @@ class BluetoothCommunicationsModule:
         self.control_conn.sendall(command)
 
     def send_media(self, media):
+        # RFCOMM sockets can't be written to without blocking, so this sends
+        # the whole image before returning.
+        if self.stream_writer:
+            self.stream_writer.finish()
         self.video_conn.sendall(media)
 
+    def media_ready(self):
+        return True
+
+    def send_stream_frame(self, seq, timestamp, media):
+        """Push a self-framed frame on the media channel without blocking.
+
+        Returns False if the frame was dropped because the link hasn't finished
+        sending the last one."""
+        if not self.stream_writer:
+            self.stream_writer = FrameWriter(self.video_conn)
+        return self.stream_writer.offer(seq, timestamp, media)
+
+    def stream_ready(self):
+        """Whether the media channel can take another stream frame right now.
+
+        If it can't, the frame that would have been sent counts as dropped."""
+        if not self.stream_writer:
+            return True
+        self.stream_writer.flush()
+        if self.stream_writer.busy():
+            self.stream_writer.dropped += 1
+            return False
+        return True
+
     def close(self):
         """Close the module and perform any clean up necessary."""
         self.video_conn.close()
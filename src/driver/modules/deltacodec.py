@@ -0,0 +1,295 @@
+"""Tile-based delta encoding of video frames for low bandwidth links.
+
+When the robot is standing still or creeping along, each frame is nearly the
+same as the last, and sending a whole JPEG every time wastes most of the link.
+The DeltaEncoder splits each frame into square tiles, compares them all at once
+against a reference frame the client is known to have, and sends only the tiles
+that changed. The changed tiles are packed side by side into a single mosaic
+image so that they share one set of JPEG headers.
+
+The reference is always a frame the client has acknowledged (with ACK <seq>),
+never just the last one sent, since that may not have arrived yet. It's kept
+as the client will have decoded it, JPEG losses and all, rather than as it
+was captured; otherwise tiles that change too little to be sent on any one
+frame could drift away from what the client shows until the next keyframe. Because of
+that the client has to keep a few recent frames around, which DeltaDecoder
+does. Every so often, or whenever there's no usable reference, a keyframe
+carrying the whole image is sent instead.
+
+Packets start with a header (all fields in network byte order):
+
+  magic       4 bytes   "RCDT"
+  type        1 byte    0 for a keyframe, 1 for a delta
+  seq         4 bytes   sequence number of this frame
+  ref_seq     4 bytes   frame this delta applies to (unused for keyframes)
+  width       2 bytes   frame size in pixels
+  height      2 bytes
+  tile_size   2 bytes   tile edge length in pixels
+  tile_count  2 bytes   number of tiles in this packet
+
+A delta continues with tile_count (column, row) pairs of 2 byte tile indices,
+followed by a JPEG of the mosaic, whose tiles are laid out left to right, top
+to bottom in the same order. A keyframe is followed by a JPEG of the whole
+frame."""
+
+import cv
+import numpy
+import struct
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+DELTA_MAGIC = "RCDT"
+HEADER_FORMAT = "!4sBIIHHHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TILE_FORMAT = "!HH"
+# Bytes taken by each tile's index, not the size of a tile.
+TILE_ENTRY_SIZE = struct.calcsize(TILE_FORMAT)
+
+KEYFRAME = 0
+DELTA = 1
+
+# Most tiles laid side by side in one row of the mosaic.
+MOSAIC_COLUMNS = 16
+
+class DeltaError(Exception):
+    pass
+
+def as_array(image):
+    """Get an image as a height x width x channels numpy array."""
+    if isinstance(image, numpy.ndarray):
+        pixels = image
+    else:
+        if type(image) == cv.iplimage:
+            image = cv.GetMat(image)
+        pixels = numpy.asarray(image)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, numpy.newaxis]
+    return pixels
+
+def encode_jpeg(pixels, quality):
+    """Encode a numpy image as a JPEG string."""
+    mat = cv.fromarray(numpy.ascontiguousarray(pixels))
+    return cv.EncodeImage('.jpeg', mat,
+                          [cv.CV_IMWRITE_JPEG_QUALITY, quality]).tostring()
+
+def decode_jpeg(data, channels):
+    """Decode a JPEG string into a numpy image."""
+    buf = cv.CreateMatHeader(1, len(data), cv.CV_8UC1)
+    cv.SetData(buf, data, len(data))
+    if channels == 1:
+        flags = cv.CV_LOAD_IMAGE_GRAYSCALE
+    else:
+        flags = cv.CV_LOAD_IMAGE_COLOR
+    return as_array(cv.DecodeImageM(buf, flags))
+
+def tile_grid(height, width, tile_size):
+    """Get the number of (rows, columns) of tiles covering an image."""
+    return ((height + tile_size - 1) // tile_size,
+            (width + tile_size - 1) // tile_size)
+
+def pad_to_tiles(pixels, tile_size):
+    """Pad an image with zeros out to a whole number of tiles."""
+    height, width = pixels.shape[:2]
+    rows, cols = tile_grid(height, width, tile_size)
+    if rows * tile_size == height and cols * tile_size == width:
+        return pixels
+    padded = numpy.zeros((rows * tile_size, cols * tile_size,
+                          pixels.shape[2]), dtype=pixels.dtype)
+    padded[:height, :width] = pixels
+    return padded
+
+def changed_tiles(current, reference, tile_size, threshold):
+    """Find the tiles whose mean absolute difference exceeds threshold.
+
+    Returns a boolean array with one element per tile."""
+    current = pad_to_tiles(current, tile_size)
+    reference = pad_to_tiles(reference, tile_size)
+    rows, cols = current.shape[0] // tile_size, current.shape[1] // tile_size
+    diff = numpy.abs(current.astype(numpy.int16) -
+                     reference.astype(numpy.int16))
+    # Split the rows and columns of pixels into (tile, pixel within tile)
+    # pairs, then average over everything but the tile indices.
+    diff = diff.reshape(rows, tile_size, cols, tile_size, -1)
+    return diff.mean(axis=(1, 3, 4)) > threshold
+
+def paste_tiles(frame, mosaic, tiles, tile_size):
+    """Copy tiles from a mosaic into a padded frame, in place.
+
+    tiles is a list of (row, column) tile indices, in mosaic order."""
+    columns = min(len(tiles), MOSAIC_COLUMNS)
+    size = tile_size
+    for i, (row, col) in enumerate(tiles):
+        m_row, m_col = divmod(i, columns)
+        frame[row * size:(row + 1) * size,
+              col * size:(col + 1) * size] = \
+            mosaic[m_row * size:(m_row + 1) * size,
+                   m_col * size:(m_col + 1) * size]
+
+class DeltaEncoder:
+    """Encodes frames as keyframes or deltas against an acknowledged frame."""
+
+    def __init__(self, tile_size=32, threshold=4.0, keyframe_interval=60,
+                 quality=95, max_references=8):
+        self.tile_size = tile_size
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.quality = quality
+        self.max_references = max_references
+
+        # Frames we've sent and might yet be acknowledged, by sequence number.
+        self.references = {}
+        self.acked_seq = None
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = True
+
+        self.frames = 0
+        self.keyframes = 0
+        self.tiles_sent = 0
+        self.bytes_out = 0
+
+    def acknowledge(self, seq):
+        """Note that the client has decoded frame seq."""
+        if seq not in self.references:
+            return
+        if self.acked_seq is None or seq > self.acked_seq:
+            self.acked_seq = seq
+            # The client will only ever be sent deltas against this frame or
+            # newer ones now, so anything older can go.
+            for old in [s for s in self.references if s < seq]:
+                del self.references[old]
+
+    def request_keyframe(self):
+        """Send a whole frame next time, e.g. because the client lost track."""
+        self.keyframe_requested = True
+
+    def encode(self, seq, image):
+        """Encode a frame, returning the packet to send."""
+        pixels = as_array(image)
+        height, width = pixels.shape[:2]
+
+        reference = None
+        if self.acked_seq is not None:
+            reference = self.references.get(self.acked_seq)
+        if (reference is None or self.keyframe_requested or
+            reference.shape != pixels.shape or
+            self.frames_since_keyframe >= self.keyframe_interval):
+            packet, decoded = self._keyframe(seq, pixels)
+        else:
+            packet, decoded = self._delta(seq, pixels, reference)
+
+        # What the client will see, to diff against later. It's our own copy,
+        # so the pipeline is free to reuse the image's memory.
+        self.references[seq] = decoded
+        if len(self.references) > self.max_references:
+            # Keep the acknowledged frame no matter what; it's the only one
+            # we can send deltas against.
+            for old in sorted(self.references):
+                if old != self.acked_seq:
+                    del self.references[old]
+                    break
+
+        self.frames += 1
+        self.bytes_out += len(packet)
+        return packet
+
+    def stats(self):
+        return {"frames": self.frames,
+                "keyframes": self.keyframes,
+                "tiles_sent": self.tiles_sent,
+                "bytes_out": self.bytes_out}
+
+    def _keyframe(self, seq, pixels):
+        height, width = pixels.shape[:2]
+        self.keyframes += 1
+        self.frames_since_keyframe = 1
+        self.keyframe_requested = False
+        header = struct.pack(HEADER_FORMAT, DELTA_MAGIC, KEYFRAME, seq, 0,
+                             width, height, self.tile_size, 0)
+        jpeg = encode_jpeg(pixels, self.quality)
+        return header + jpeg, decode_jpeg(jpeg, pixels.shape[2])
+
+    def _delta(self, seq, pixels, reference):
+        height, width = pixels.shape[:2]
+        self.frames_since_keyframe += 1
+        changed = numpy.argwhere(changed_tiles(pixels, reference,
+                                               self.tile_size,
+                                               self.threshold))
+        header = struct.pack(HEADER_FORMAT, DELTA_MAGIC, DELTA, seq,
+                             self.acked_seq, width, height, self.tile_size,
+                             len(changed))
+        if len(changed) == 0:
+            return header, reference
+
+        size = self.tile_size
+        padded = pad_to_tiles(pixels, size)
+        columns = min(len(changed), MOSAIC_COLUMNS)
+        mosaic_rows = (len(changed) + columns - 1) // columns
+        mosaic = numpy.zeros((mosaic_rows * size, columns * size,
+                              pixels.shape[2]), dtype=pixels.dtype)
+        indices = []
+        for i, (row, col) in enumerate(changed):
+            m_row, m_col = divmod(i, columns)
+            mosaic[m_row * size:(m_row + 1) * size,
+                   m_col * size:(m_col + 1) * size] = \
+                padded[row * size:(row + 1) * size,
+                       col * size:(col + 1) * size]
+            indices.append(struct.pack(TILE_FORMAT, col, row))
+        self.tiles_sent += len(changed)
+        jpeg = encode_jpeg(mosaic, self.quality)
+
+        # Rebuild the frame the way the client will: the reference with the
+        # decoded tiles pasted over it.
+        decoded = pad_to_tiles(reference, size).copy()
+        paste_tiles(decoded, decode_jpeg(jpeg, pixels.shape[2]), changed,
+                    size)
+        return (header + "".join(indices) + jpeg,
+                decoded[:height, :width].copy())
+
+class DeltaDecoder:
+    """Reference decoder for the delta format.
+
+    Keeps the last few decoded frames, since a delta may be against any frame
+    the client has acknowledged rather than the most recent one."""
+
+    def __init__(self, channels=3, max_frames=16):
+        self.channels = channels
+        self.max_frames = max_frames
+        self.frames = {}
+
+    def decode(self, packet):
+        """Decode a packet, returning (seq, frame as a numpy array).
+
+        Raises DeltaError if the frame the delta applies to is unknown; the
+        client should ask for a keyframe if that happens."""
+        if len(packet) < HEADER_SIZE:
+            raise DeltaError("Packet too short.")
+        (magic, kind, seq, ref_seq, width, height, tile_size,
+         tile_count) = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+        if magic != DELTA_MAGIC:
+            raise DeltaError("Bad packet magic %r." % (magic,))
+
+        if kind == KEYFRAME:
+            frame = decode_jpeg(packet[HEADER_SIZE:], self.channels)
+        elif kind == DELTA:
+            if ref_seq not in self.frames:
+                raise DeltaError("Missing reference frame %d." % (ref_seq,))
+            reference = self.frames[ref_seq]
+            frame = pad_to_tiles(reference, tile_size).copy()
+            if tile_count:
+                offset = HEADER_SIZE + tile_count * TILE_ENTRY_SIZE
+                mosaic = decode_jpeg(packet[offset:], self.channels)
+                tiles = []
+                for i in range(tile_count):
+                    col, row = struct.unpack_from(
+                        TILE_FORMAT, packet,
+                        HEADER_SIZE + i * TILE_ENTRY_SIZE)
+                    tiles.append((row, col))
+                paste_tiles(frame, mosaic, tiles, tile_size)
+            frame = frame[:height, :width]
+        else:
+            raise DeltaError("Unknown packet type %d." % (kind,))
+
+        self.frames[seq] = frame
+        while len(self.frames) > self.max_frames:
+            del self.frames[min(self.frames)]
+        return seq, frame
@@ -0,0 +1,334 @@
+"""A shared memory bus that hands camera frames to other local processes.
+
+Anything else on the board that wants camera frames, like a second detector
+or a debug viewer, would otherwise have to ask BotDriver for them over a
+socket and get a freshly encoded JPEG each time. Instead, the camera module
+can publish every raw frame to a FrameBus: a ring of slots in a file under
+/dev/shm, which any number of processes can map and read frames straight out
+of, without copying them and without the writer knowing they're there.
+Readers can come and go at any time.
+
+The file starts with a header:
+
+  magic      4s  "RCFB"
+  version    I   BUS_VERSION
+  state      I   LIVE, RETIRED once the writer has replaced the file, or
+                 CLOSED once it has stopped
+  slots      I   number of slots in the ring
+  slot_bytes I   bytes of pixel data each slot can hold
+  (4 bytes of padding)
+  latest     Q   sequence number of the newest complete frame, 0 for none
+
+followed by the slots, each a header and then the frame's pixels, rows packed
+with no padding:
+
+  version    Q   even while the slot is stable, odd while it's being written
+  seq        Q   the frame's sequence number
+  timestamp  d   when it was captured
+  width, height, depth, channels, step    I each, as in an IPL image
+
+Frame seq lives in slot seq % slots. Nothing is locked: the writer makes a
+slot's version odd, fills the slot, then makes it even again, and a reader
+knows a frame it read is intact if the version was the same even number
+before and after (a seqlock). Readers get a view of the pixels in place, so
+they must check BusFrame.valid() once they're done with it; the slot is only
+reused after slots - 1 newer frames have gone by. All fields are in the
+machine's byte order, since only processes on the same board read them."""
+
+import mmap
+import os
+import struct
+import time
+import cv
+import numpy
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+BUS_MAGIC = "RCFB"
+BUS_VERSION = 1
+
+LIVE = 1
+RETIRED = 2
+CLOSED = 3
+
+HEADER_FORMAT = "=4sIIIIxxxxQ"
+# Slots start on a cache line.
+HEADER_SIZE = 64
+STATE_OFFSET = 8
+LATEST_OFFSET = 24
+
+SLOT_HEADER_FORMAT = "=QQdIIIII"
+SLOT_HEADER_SIZE = 64
+SLOT_META_FORMAT = "=QdIIIII"
+SLOT_META_OFFSET = 8
+
+# IPL depths we can share, and the numpy types of their pixels.
+DEPTH_TYPES = {
+    cv.IPL_DEPTH_8U: numpy.uint8,
+    cv.IPL_DEPTH_8S: numpy.int8,
+    cv.IPL_DEPTH_16U: numpy.uint16,
+    cv.IPL_DEPTH_16S: numpy.int16,
+    cv.IPL_DEPTH_32S: numpy.int32,
+    cv.IPL_DEPTH_32F: numpy.float32,
+    cv.IPL_DEPTH_64F: numpy.float64,
+    }
+
+class FrameBusError(Exception):
+    pass
+
+def image_array(image):
+    """Get a (rows, cols, channels) numpy view of a CV image."""
+    if type(image) == cv.iplimage:
+        image = cv.GetMat(image)
+    pixels = numpy.asarray(image)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, numpy.newaxis]
+    return pixels
+
+def round_up(count, multiple=64):
+    return (count + multiple - 1) // multiple * multiple
+
+class FrameBus:
+    """The writing end of a frame bus.
+
+    The file is created when the first frame is published, with room in each
+    slot for frames of that size. If a bigger frame comes along the file is
+    replaced by a bigger one, and readers move over to it by themselves."""
+
+    def __init__(self, path, slots=4):
+        if slots < 2:
+            raise ValueError("A frame bus needs at least two slots.")
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = 0
+        self.file = None
+        self.map = None
+        self.last_seq = 0
+
+        self.published = 0
+
+    def publish(self, frame):
+        """Put a Frame on the bus, unless it's the same one as last time."""
+        if frame.seq == self.last_seq:
+            return
+        self.write(frame.seq, frame.timestamp, image_array(frame.image),
+                   frame.image.depth)
+
+    def write(self, seq, timestamp, pixels, depth):
+        """Put a (rows, cols, channels) array of pixels on the bus."""
+        height, width, channels = pixels.shape
+        step = width * channels * pixels.itemsize
+        length = step * height
+        if length > self.slot_bytes:
+            self._create(round_up(length))
+
+        slot = self._slot_offset(seq)
+        version, = struct.unpack_from("=Q", self.map, slot)
+        # Odd while we write, so readers know not to trust the slot.
+        struct.pack_into("=Q", self.map, slot, version + 1)
+        struct.pack_into(SLOT_META_FORMAT, self.map, slot + SLOT_META_OFFSET,
+                         seq, timestamp, width, height, depth, channels, step)
+        target = numpy.ndarray(pixels.shape, pixels.dtype, self.map,
+                               slot + SLOT_HEADER_SIZE)
+        # This is the one and only copy of the frame.
+        target[...] = pixels
+        struct.pack_into("=Q", self.map, slot, version + 2)
+        struct.pack_into("=Q", self.map, LATEST_OFFSET, seq)
+        self.last_seq = seq
+        self.published += 1
+
+    def close(self):
+        """Tell readers we've stopped, and remove the bus file.
+
+        Readers which have it mapped can still read the last frames."""
+        if self.map is None:
+            return
+        struct.pack_into("=I", self.map, STATE_OFFSET, CLOSED)
+        self.map.close()
+        self.file.close()
+        self.map = None
+        self.file = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {"published": self.published,
+                "last_seq": self.last_seq,
+                "slots": self.slots,
+                "slot_bytes": self.slot_bytes}
+
+    def _slot_offset(self, seq):
+        return (HEADER_SIZE +
+                (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_bytes))
+
+    def _create(self, slot_bytes):
+        """Make a new bus file with slot_bytes per slot and move to it."""
+        size = HEADER_SIZE + self.slots * (SLOT_HEADER_SIZE + slot_bytes)
+        # Build the new file to one side and rename it into place, so readers
+        # opening the path never see half of one.
+        temp_path = "%s.%d" % (self.path, os.getpid())
+        new_file = open(temp_path, "w+b")
+        new_file.truncate(size)
+        new_map = mmap.mmap(new_file.fileno(), size)
+        struct.pack_into(HEADER_FORMAT, new_map, 0, BUS_MAGIC, BUS_VERSION,
+                         LIVE, self.slots, slot_bytes, 0)
+        os.rename(temp_path, self.path)
+
+        if self.map is not None:
+            struct.pack_into("=I", self.map, STATE_OFFSET, RETIRED)
+            self.map.close()
+            self.file.close()
+        self.file = new_file
+        self.map = new_map
+        self.slot_bytes = slot_bytes
+
+class BusFrame:
+    """A frame read from a bus, still sitting in the bus's memory.
+
+    pixels is a (rows, cols, channels) numpy view of the frame in place. It
+    stays good until the writer comes back around to the frame's slot; use
+    valid() after reading it to find out whether it did. The frame keeps the
+    bus mapped for as long as it's around."""
+
+    def __init__(self, bus_map, offset, version, seq, timestamp, pixels,
+                 depth):
+        self.map = bus_map
+        self.offset = offset
+        self.version = version
+        self.seq = seq
+        self.timestamp = timestamp
+        self.pixels = pixels
+        self.depth = depth
+
+    def valid(self):
+        """Whether the frame is still intact."""
+        return struct.unpack_from("=Q", self.map, self.offset)[0] == \
+            self.version
+
+    def copy(self):
+        """Get a copy of the pixels, or None if the frame has been
+        overwritten."""
+        pixels = self.pixels.copy()
+        if not self.valid():
+            return None
+        return pixels
+
+    def image(self):
+        """Get a copy of the frame as a CV image, or None if the frame has
+        been overwritten."""
+        height, width, channels = self.pixels.shape
+        image = cv.CreateImage((width, height), self.depth, channels)
+        image_array(image)[...] = self.pixels
+        if not self.valid():
+            return None
+        return image
+
+class FrameBusReader:
+    """The reading end of a frame bus.
+
+    Any number of these can read the same bus from any number of processes.
+    Opening one before the writer has created the bus is fine; it finds the
+    bus once it's there."""
+
+    def __init__(self, path, poll_interval=0.001):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.file = None
+        self.map = None
+        self.inode = None
+        self.slots = 0
+        self.slot_bytes = 0
+
+        self.frames = 0
+        self.retries = 0
+
+    def latest(self):
+        """Get the newest frame on the bus as a BusFrame, or None if there
+        isn't one."""
+        if not self._attached():
+            return None
+        while True:
+            seq, = struct.unpack_from("=Q", self.map, LATEST_OFFSET)
+            if seq == 0:
+                return None
+            frame = self._read_slot(seq)
+            if frame is not None:
+                self.frames += 1
+                return frame
+            # The writer lapped us while we read; go again with a newer one.
+            self.retries += 1
+
+    def next_frame(self, seq, timeout=None):
+        """Wait for a frame newer than seq and return the newest one.
+
+        Returns None if no such frame arrives within timeout seconds."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            frame = self.latest()
+            if frame is not None and frame.seq > seq:
+                return frame
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        """Stop reading the bus.
+
+        The bus stays mapped until the last frame read from it is gone, so
+        frames already read can still be used."""
+        if self.file is not None:
+            self.file.close()
+        self.map = None
+        self.file = None
+        self.inode = None
+
+    def _attached(self):
+        """Make sure we're reading the writer's current bus file."""
+        if self.map is not None:
+            state, = struct.unpack_from("=I", self.map, STATE_OFFSET)
+            if state == LIVE:
+                return True
+            # The writer has moved to a new file, or stopped. Either way, the
+            # frames we have are as good as any until a new file turns up.
+            try:
+                if os.stat(self.path).st_ino == self.inode:
+                    return True
+            except OSError:
+                return True
+            self.close()
+        try:
+            self.file = open(self.path, "r+b")
+        except IOError:
+            return False
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        magic, version, state, self.slots, self.slot_bytes, latest = \
+            struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != BUS_MAGIC or version != BUS_VERSION:
+            self.close()
+            raise FrameBusError("%s isn't a version %d frame bus." % (
+                self.path, BUS_VERSION))
+        return True
+
+    def _slot_version(self, offset):
+        return struct.unpack_from("=Q", self.map, offset)[0]
+
+    def _read_slot(self, seq):
+        offset = (HEADER_SIZE +
+                  (seq % self.slots) * (SLOT_HEADER_SIZE + self.slot_bytes))
+        version = self._slot_version(offset)
+        if version % 2:
+            return None
+        slot_seq, timestamp, width, height, depth, channels, step = \
+            struct.unpack_from(SLOT_META_FORMAT, self.map,
+                               offset + SLOT_META_OFFSET)
+        if slot_seq != seq or self._slot_version(offset) != version:
+            return None
+        pixels = numpy.ndarray((height, width, channels), DEPTH_TYPES[depth],
+                               self.map, offset + SLOT_HEADER_SIZE)
+        return BusFrame(self.map, offset, version, seq, timestamp, pixels,
+                        depth)
@@ -3,6 +3,8 @@
 
 import serial
 import time
+from serialwriter import SerialWriter
+from telemetry import OdometryRing, TelemetryReader
 import driver.settings as settings
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
@@ -19,7 +21,36 @@ class ArduinoMotionModule():
     def __init__(self):
         self.port = settings.ARDUINO_PORT
         self.baud = settings.ARDUINO_BAUD
-        self._connect()
+        self.writer = None
+        if settings.MOTION_ASYNC:
+            # The writer connects on its own once there's something to send,
+            # so a missing Arduino doesn't hold up startup either.
+            self.writer = SerialWriter(
+                self.port, self.baud, settings.MOTION_QUEUE_SIZE,
+                supersedes=(self.FORWARD + self.BACKWARD + self.ROTATE_CW +
+                            self.ROTATE_CCW + self.STOP),
+                max_backoff=settings.MOTION_MAX_BACKOFF,
+                keep_open=settings.TELEMETRY)
+            self.writer.start()
+        else:
+            self._connect()
+
+        self.telemetry = None
+        if settings.TELEMETRY:
+            ring = OdometryRing(int(settings.TELEMETRY_HISTORY *
+                                    settings.TELEMETRY_RATE))
+            if self.writer:
+                # Read from whatever connection the writer has open, and let
+                # it know when that connection breaks.
+                self.telemetry = TelemetryReader(
+                    lambda: self.writer.conn, ring, settings.BODY_WIDTH,
+                    settings.WHEEL_CIRCUMFERENCE, settings.TICKS_PER_REV,
+                    on_error=self.writer.drop_connection)
+            else:
+                self.telemetry = TelemetryReader(
+                    lambda: self.conn, ring, settings.BODY_WIDTH,
+                    settings.WHEEL_CIRCUMFERENCE, settings.TICKS_PER_REV)
+            self.telemetry.start()
 
     def move(self, direction):
         """Move in the given direction."""
@@ -39,9 +70,16 @@ class ArduinoMotionModule():
         else:
             print "Unkown movement command ", direction
 
+    def stop(self):
+        """Stop moving."""
+        self.send(self.STOP)
+
     def send(self, message):
         """Send a packet over the wire."""
         print "Sending message:", message
+        if self.writer:
+            self.writer.submit(message)
+            return
         try:
             self.conn.write(message)
         except serial.SerialException as se:
@@ -54,7 +92,28 @@ class ArduinoMotionModule():
 
     def close(self):
         """Close the module and perform any clean up necessary."""
-        pass
+        if self.telemetry:
+            self.telemetry.stop(1.0)
+        if self.writer:
+            self.writer.stop(1.0)
+
+    def pose(self):
+        """Get our (x, y, theta) by dead reckoning, or None if unknown."""
+        if self.telemetry:
+            return self.telemetry.pose()
+        return None
+
+    def velocity(self, window=0.5):
+        """Get our (linear, angular) velocity, or None if unknown."""
+        if self.telemetry:
+            return self.telemetry.velocity(window)
+        return None
+
+    def stats(self):
+        """Get the background writer's counters, if there is one."""
+        if self.writer:
+            return self.writer.stats()
+        return None
 
     def _connect(self):
         self.conn = serial.Serial(self.port, self.baud, timeout=1)
@@ -0,0 +1,147 @@
+"""Synchronized capture from several cameras at once.
+
+Reading one camera after another with cv.QueryFrame means each frame is
+taken only once the camera before it has been read and decoded, so with a
+front and rear camera, or a stereo pair, the frames can be tens of
+milliseconds apart. A MultiCapture instead does it in two steps, as
+cv.GrabFrame and cv.RetrieveFrame allow:
+
+  1. Every camera grabs at once, each on its own thread. Grabbing only
+     latches the frame, so it's quick, and since the grabs run side by side
+     the frames are taken about as close together as the cameras allow.
+  2. Only then is every frame retrieved (decoded), also side by side.
+
+Every grab is timestamped as it completes, and the spread between the
+earliest and latest of a set, the skew, is reported with the frames.
+
+Only the cameras whose frames are wanted need to be retrieved; the rest are
+still grabbed, which costs little and keeps every camera in step."""
+
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from capture import Frame
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class MultiCaptureError(Exception):
+    pass
+
+class FrameSet:
+    """Frames taken together, one from each camera, in camera order.
+
+    The frames share a sequence number; each has the time its own camera
+    grabbed it. Cameras that weren't retrieved have None for a frame, so
+    their grab times are given separately in timestamps. skew is the time
+    between the first and last grab."""
+
+    def __init__(self, seq, frames, timestamps=None):
+        self.seq = seq
+        self.frames = frames
+        if timestamps is None:
+            timestamps = [frame.timestamp for frame in frames]
+        self.timestamp = min(timestamps)
+        self.skew = max(timestamps) - self.timestamp
+
+class MultiCapture:
+    """Captures synchronized frames from a list of sources.
+
+    Sources with grab() and retrieve() are grabbed and retrieved separately,
+    as described above. Any without them are simply read, and their frames
+    are timestamped when the read finishes, which makes for more skew."""
+
+    def __init__(self, sources):
+        if not sources:
+            raise ValueError("A multi-camera capture needs at least one "
+                             "source.")
+        self.sources = sources
+        self.pool = ThreadPool(len(sources))
+        self.lock = threading.Lock()
+        self.last_seq = 0
+        # Images from sources that can only read, between grab and retrieve.
+        self.read_images = {}
+
+        self.captured = 0
+        self.failures = 0
+        self.total_skew = 0.0
+        self.max_skew = 0.0
+        self.last_skew = 0.0
+
+    def capture(self, cameras=None):
+        """Take a frame from every source.
+
+        cameras is a list of the indices of the sources to retrieve frames
+        from, or None for all of them; the others are only grabbed.
+
+        Returns a FrameSet. The images belong to their sources and are only
+        good until the next capture, just as with cv.QueryFrame. Raises a
+        MultiCaptureError if any camera fails to give a frame."""
+        if cameras is None:
+            cameras = range(len(self.sources))
+        with self.lock:
+            timestamps = self.pool.map(self._grab, self.sources)
+            if None in timestamps:
+                self.failures += 1
+                raise MultiCaptureError(
+                    "Camera %d failed to grab a frame." % (
+                        timestamps.index(None),))
+            wanted = [self.sources[i] for i in cameras]
+            images = [None] * len(self.sources)
+            for i, image in zip(cameras, self.pool.map(self._retrieve,
+                                                       wanted)):
+                if image is None:
+                    self.failures += 1
+                    raise MultiCaptureError(
+                        "Camera %d failed to retrieve a frame." % (i,))
+                images[i] = image
+
+            self.last_seq += 1
+            frames = [None] * len(self.sources)
+            for i in cameras:
+                frames[i] = Frame(self.last_seq, timestamps[i], images[i])
+            frame_set = FrameSet(self.last_seq, frames, timestamps)
+            self.captured += 1
+            self.last_skew = frame_set.skew
+            self.total_skew += frame_set.skew
+            self.max_skew = max(self.max_skew, frame_set.skew)
+            return frame_set
+
+    def stats(self):
+        """Get a snapshot of the capture's counters as a dictionary.
+
+        Skews are in seconds."""
+        with self.lock:
+            mean_skew = 0.0
+            if self.captured:
+                mean_skew = self.total_skew / self.captured
+            return {"cameras": len(self.sources),
+                    "captured": self.captured,
+                    "failures": self.failures,
+                    "last_skew": self.last_skew,
+                    "mean_skew": mean_skew,
+                    "max_skew": self.max_skew}
+
+    def close(self):
+        """Stop the capture threads. The sources are left open."""
+        self.pool.close()
+        self.pool.join()
+
+    def _grab(self, source):
+        """Grab a frame, returning when it was grabbed or None on failure.
+
+        Sources that can't grab are read instead, and keep the image for
+        _retrieve to hand back."""
+        if hasattr(source, "grab"):
+            if not source.grab():
+                return None
+        else:
+            image = source.read()
+            if not image:
+                return None
+            self.read_images[source] = image
+        return time.time()
+
+    def _retrieve(self, source):
+        if hasattr(source, "retrieve"):
+            return source.retrieve()
+        return self.read_images.pop(source)
@@ -1,5 +1,6 @@
 from doordetectpipe import ScanningDoorDetectPipe
 from doordetectpipe import HaarDoorDetectPipe
+from doordetectpipe import TrackingHaarDoorDetectPipe
 
 from edgedetectpipe import EdgeDetectPipe
 
@@ -11,3 +12,6 @@ from resizepipe import ResizePipe
 
 from segmentationpipe import ShotgunSegmentationPipe
 
+from trackingpipe import TrackingDoorDetectPipe
+
+from bufferpool import BufferPool, default_pool
@@ -0,0 +1,86 @@
+"""Array-based barscan engine used by the scanning door detector.
+
+A barscan projects an edge image onto its rows and columns and looks for the
+bars with the most edge pixels in them. Doing that one pixel at a time from
+Python is painfully slow, so this module does the work with whole-array
+reductions instead:
+
+  1. Row and column projections come from a single sum over each axis.
+  2. The sum over a bar several pixels wide is taken from a cumulative sum, so
+     every bar costs two lookups no matter how wide it is.
+  3. The two strongest bars are picked with argmax over views of the sums,
+     which never copies the projection."""
+
+import cv
+import numpy
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def as_array(image, channel=0):
+    """Get a two dimensional numpy view of one channel of a CV image.
+
+    No pixel data is copied; the returned array shares memory with the
+    image."""
+    if type(image) == cv.iplimage:
+        image = cv.GetMat(image)
+    pixels = numpy.asarray(image)
+    if pixels.ndim == 3:
+        pixels = pixels[:, :, channel]
+    return pixels
+
+def projections(pixels):
+    """Sum a 2D array along each axis.
+
+    Returns a tuple of (row_sums, col_sums)."""
+    # Accumulate in a wide integer type; 8 bit pixels overflow almost
+    # immediately otherwise.
+    row_sums = pixels.sum(axis=1, dtype=numpy.int64)
+    col_sums = pixels.sum(axis=0, dtype=numpy.int64)
+    return row_sums, col_sums
+
+def bar_sums(sums, bar_size=1):
+    """Sum each element of a projection with its neighbours.
+
+    The bar for element i covers [i - bar_size, i + bar_size), clipped to the
+    edges of the array, which matches the original pure Python scan."""
+    length = len(sums)
+    cumulative = numpy.zeros(length + 1, dtype=numpy.int64)
+    numpy.cumsum(sums, out=cumulative[1:])
+    index = numpy.arange(length)
+    upper = numpy.minimum(index + bar_size, length)
+    lower = numpy.maximum(index - bar_size, 0)
+    return cumulative[upper] - cumulative[lower]
+
+def top_two(sums):
+    """Find the indices of the two largest elements of a 1D array.
+
+    Ties go to the lowest index, just as they do with max(). If the array has
+    only one element its index is returned twice."""
+    first = int(numpy.argmax(sums))
+
+    # Rather than zeroing out the maximum in a copy and searching again, look
+    # at the slices on either side of it. Slicing makes views, not copies.
+    left = sums[:first]
+    right = sums[first + 1:]
+    if len(left) == 0 and len(right) == 0:
+        return first, first
+    if len(right) == 0:
+        return first, int(numpy.argmax(left))
+    if len(left) == 0:
+        return first, first + 1 + int(numpy.argmax(right))
+
+    left_max = int(numpy.argmax(left))
+    right_max = first + 1 + int(numpy.argmax(right))
+    if sums[left_max] >= sums[right_max]:
+        return first, left_max
+    return first, right_max
+
+def scan(image, bar_size=1, channel=0):
+    """Run a barscan over an image.
+
+    Returns the two strongest rows and the two strongest columns as a tuple
+    of ((row_1, row_2), (col_1, col_2))."""
+    row_sums, col_sums = projections(as_array(image, channel))
+    rows = top_two(bar_sums(row_sums, bar_size))
+    cols = top_two(bar_sums(col_sums, bar_size))
+    return rows, cols
@@ -0,0 +1,146 @@
+"""A pool of reusable image buffers for pipeline stages.
+
+Allocating fresh images for every frame is expensive on the robot's small
+boards, and it shows up as jitter in frame latency. Pipeline stages can instead
+lease their scratch and output images from a pool, and hand them back once the
+next stage is done with them. Buffers are keyed on (size, depth, channels), so
+a stage asking for the same shape of image every frame gets the same memory
+back every frame.
+
+Idle buffers count against a configurable byte cap; when returning a buffer
+would put the pool over the cap, the least recently used idle buffers are
+evicted and left for the garbage collector."""
+
+import cv
+import threading
+import driver.settings as settings
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+def image_bytes(size, depth, channels):
+    """Estimate the number of bytes used by an image's pixel data."""
+    width, height = size
+    # The low bits of an IPL depth give the bits per channel; the high bit only
+    # marks the type as signed.
+    row_bytes = width * channels * ((depth & 0xFFFF) // 8)
+    # IPL images pad their rows out to four byte boundaries.
+    row_bytes = (row_bytes + 3) & ~3
+    return row_bytes * height
+
+class BufferPool:
+    """A thread safe pool of IPL images keyed on (size, depth, channels)."""
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = settings.BUFFER_POOL_MAX_BYTES
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Idle buffers, by key. Each list is used as a stack so the most
+        # recently returned (and most likely cached) buffer goes out first.
+        self.free = {}
+        # Keys of idle buffers, oldest first, for eviction. A key shows up once
+        # per idle buffer.
+        self.free_order = []
+        # Leased buffers, by id(), so stray images are never pooled.
+        self.leased = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_held = 0
+        self.bytes_leased = 0
+
+    def lease(self, size, depth, channels):
+        """Get an image with the given size, depth and number of channels.
+
+        The contents of the image are undefined. Hand it back with release()
+        when it is no longer needed."""
+        key = (tuple(size), depth, channels)
+        nbytes = image_bytes(size, depth, channels)
+        with self.lock:
+            stack = self.free.get(key)
+            if stack:
+                image = stack.pop()
+                self.free_order.remove(key)
+                self.bytes_held -= nbytes
+                self.hits += 1
+            else:
+                image = None
+                self.misses += 1
+            self.bytes_leased += nbytes
+
+        # Allocating can take a while; there's no need to hold up other stages
+        # while it happens.
+        if image is None:
+            image = cv.CreateImage(key[0], depth, channels)
+
+        with self.lock:
+            self.leased[id(image)] = (image, key, nbytes)
+        return image
+
+    def release(self, image):
+        """Return a leased image to the pool.
+
+        Images which didn't come from this pool are ignored, so it is always
+        safe to release whatever a stage got back from the rest of the
+        pipeline."""
+        if image is None:
+            return
+        with self.lock:
+            entry = self.leased.pop(id(image), None)
+            if entry is None:
+                return
+            image, key, nbytes = entry
+            self.bytes_leased -= nbytes
+
+            if nbytes > self.max_bytes:
+                self.evictions += 1
+                return
+            self.free.setdefault(key, []).append(image)
+            self.free_order.append(key)
+            self.bytes_held += nbytes
+            self._evict()
+
+    def detach(self, image):
+        """Stop tracking a leased image without returning it to the pool.
+
+        Use this when an image is handed to code which will never release it;
+        the image is left for the garbage collector and no longer counts as
+        leased."""
+        with self.lock:
+            entry = self.leased.pop(id(image), None)
+            if entry is not None:
+                self.bytes_leased -= entry[2]
+
+    def clear(self):
+        """Drop every idle buffer held by the pool."""
+        with self.lock:
+            self.evictions += len(self.free_order)
+            self.free = {}
+            self.free_order = []
+            self.bytes_held = 0
+
+    def stats(self):
+        """Get a snapshot of the pool's counters as a dictionary."""
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "bytes_held": self.bytes_held,
+                    "bytes_leased": self.bytes_leased,
+                    "buffers_held": len(self.free_order),
+                    "buffers_leased": len(self.leased)}
+
+    def _evict(self):
+        # Must be called with the lock held.
+        while self.bytes_held > self.max_bytes and self.free_order:
+            key = self.free_order.pop(0)
+            # The oldest buffer for a key is at the bottom of its stack.
+            self.free[key].pop(0)
+            if not self.free[key]:
+                del self.free[key]
+            self.bytes_held -= image_bytes(*key)
+            self.evictions += 1
+
+# Pool shared by every pipeline stage unless they're given their own.
+default_pool = BufferPool()
@@ -1,6 +1,10 @@
 """An image processing pipeline stage which detects doors in the scene."""
 
 import cv
+import os
+import threading
+import barscan
+from bufferpool import default_pool
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
@@ -12,51 +16,47 @@ class ScanningDoorDetectPipe:
 
     This detector expects to be called on an edge-detected image."""
 
-    def __init__(self, next_pipe):
+    # Tracking pipes need to edge detect frames before handing them to us.
+    needs_edges = True
+
+    def __init__(self, next_pipe, bar_size=1, pool=None):
         self.next_pipe = next_pipe
+        self.pool = pool or default_pool
+        # Bars extend bar_size pixels to either side of the row or column being
+        # scanned. Wider bars are more forgiving of doors whose edges aren't
+        # perfectly straight.
+        self.bar_size = bar_size
+
+    def detect(self, image, bar_size=None):
+        """Find the door in an edge image, returning a list of (x, y, w, h).
+
+        The barscan always finds something, so the list has exactly one
+        rectangle in it, unless that rectangle is empty."""
+        (top, left), (bottom, right) = self.corners(image, bar_size)
+        if right <= left or bottom <= top:
+            return []
+        return [(left, top, right - left, bottom - top)]
+
+    def corners(self, image, bar_size=None):
+        """Get the top left and bottom right corners of the door, as
+        (row, column) pairs with the top left having the smaller numbers."""
+        if bar_size is None:
+            bar_size = self.bar_size
 
-    def process(self, image, bar_size=1):
-        # First thing's first: we need to get sums for each row and column in
-        # the image.
-        # TODO Implement parameterization of the bar width
-        row_sums = []
-        col_sums = []
-
-        # Vertical scan: look at each row and sum it.
-        # OpenCV matrices are a pain because they're not iterable; I wrote a
-        # method to sum them up to make life a little easier.
-        for row in range(image.height):
-            neighbors = [self.sum_cvmat(image[row + i])
-                         for i in range(-bar_size, bar_size)
-                         if row + i >= 0 and row + i < image.height]
-            row_sums.append(sum(neighbors))
-
-        # Horizontal scan. As the image is stored in rows, we need to take the
-        # nth element from each row in order to form a column. Just a little
-        # more work than the vertical scan.
-        for col in range(image.width):
-            neighbors = [self.sum_cvmat(image[:, col + i])
-                         for i in range(-bar_size, bar_size)
-                         if col + i >= 0 and col + i < image.width]
-            col_sums.append(sum(neighbors))
-
-        # We want the index of the largest 2 elements of our sum list.
-        # I don't feel like writing a max function, so...
-        max_col_1 = max(enumerate(col_sums), key=lambda elem: elem[1])[0]
-
-        # Ok, now remove the maximum and go get the second-largest.
-        col_sums[max_col_1] = 0
-        max_col_2 = max(enumerate(col_sums), key=lambda elem: elem[1])[0]
-
-        # Rinse, repeat for rows.
-        max_row_1 = max(enumerate(row_sums), key=lambda elem: elem[1])[0]
-        row_sums[max_row_1] = 0
-        max_row_2 = max(enumerate(row_sums), key=lambda elem: elem[1])[0]
+        # Get the two rows and the two columns with the strongest edges in
+        # them. See the barscan module for the gory details.
+        (max_row_1, max_row_2), (max_col_1, max_col_2) = barscan.scan(
+            image, bar_size)
+        return ((min(max_row_1, max_row_2), min(max_col_1, max_col_2)),
+                (max(max_row_1, max_row_2), max(max_col_1, max_col_2)))
+
+    def process(self, image, bar_size=None):
+        (top, left), (bottom, right) = self.corners(image, bar_size)
 
         # We'll build a couple of tuples specifying the corners for our
         # convenience here. Keep in mind these are the row/column numbers.
-        top_left = (min(max_col_1, max_col_2), max(max_row_1, max_row_2))
-        bottom_right = (max(max_col_1, max_col_2), min(max_row_1, max_row_2))
+        top_left = (left, bottom)
+        bottom_right = (right, top)
 
         image = self.grayscale_to_color(image)
         
@@ -66,6 +66,8 @@ class ScanningDoorDetectPipe:
 
         if self.next_pipe:
             processed_image = self.next_pipe.process(image)
+            if processed_image is not image:
+                self.pool.release(image)
             return processed_image
         else:
             return image
@@ -93,24 +95,82 @@ class ScanningDoorDetectPipe:
                 return sum([cvmat[0, i] for i in range(cvmat.cols)])
 
     def grayscale_to_color(self, image):
-        color = cv.CreateMat(image.height, image.width, cv.CV_8UC3)
+        color = self.pool.lease((image.width, image.height),
+                                cv.IPL_DEPTH_8U, 3)
         cv.CvtColor(image, color, cv.CV_GRAY2RGB)
         return color
 
+class SharedCascade:
+    """A Haar cascade which several pipes can detect with.
+
+    OpenCV keeps per-scale working data inside the cascade while detecting,
+    so only one detection can run on it at a time."""
+
+    def __init__(self, path):
+        self.cascade = cv.Load(path)
+        self.lock = threading.Lock()
+
+    def detect(self, image, storage, *args):
+        """Run cv.HaarDetectObjects with this cascade."""
+        with self.lock:
+            return cv.HaarDetectObjects(image, self.cascade, storage, *args)
+
+# SharedCascades by absolute path. Loading one means parsing tens of kilobytes
+# of XML, so every pipe using the same file shares a single copy.
+_cascades = {}
+_cascades_lock = threading.Lock()
+
+def load_cascade(path):
+    """Load a Haar cascade, or get the copy we've already loaded.
+
+    Relative paths are tried from the current directory first, then from the
+    directory this module lives in, which is where the door cascade is."""
+    if not os.path.isabs(path) and not os.path.exists(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    path = os.path.abspath(path)
+    with _cascades_lock:
+        cascade = _cascades.get(path)
+        if cascade is None:
+            cascade = _cascades[path] = SharedCascade(path)
+        return cascade
+
+def pad_rect(rect, padding, size):
+    """Grow an (x, y, w, h) rectangle by padding times its size on each side,
+    clipped to an image of the given size."""
+    x, y, w, h = rect
+    width, height = size
+    left = max(0, int(x - w * padding))
+    top = max(0, int(y - h * padding))
+    right = min(width, int(x + w * (1 + padding)))
+    bottom = min(height, int(y + h * (1 + padding)))
+    return left, top, right - left, bottom - top
+
 class HaarDoorDetectPipe:
     """An implementation of a door detector which uses a CV cascade classifier.
 
     This detector should be called on the same type of image used in training
-    the classifier."""
+    the classifier. It scans the whole of every frame, which is thorough but
+    slow; see TrackingHaarDoorDetectPipe for a faster one."""
 
     def __init__(self, next_pipe, path="haarcascade-door.xml"):
         self.next_pipe = next_pipe
-        self.hc = cv.Load(path)
+        self.cascade = load_cascade(path)
+        # Detection results are copied out of the storage, so one will do for
+        # every frame.
+        self.storage = cv.CreateMemStorage()
+        # The doors found in the last frame, as (x, y, w, h) rectangles.
+        self.doors = []
+
+    def detect(self, image):
+        """Find doors in an image, returning a list of (x, y, w, h)."""
+        cv.ClearMemStorage(self.storage)
+        return [rect for rect, neighbors in
+                self.cascade.detect(image, self.storage)]
 
     def process(self, image):
-        doors = cv.HaarDetectObjects(image, self.hc, cv.CreateMemStorage())
+        self.doors = self.detect(image)
 
-        for (x, y, w, h), n in doors:
+        for (x, y, w, h) in self.doors:
             cv.Rectangle(image, (x, y), (x+w, y+h), 255)
         
         if self.next_pipe:
@@ -118,3 +178,90 @@ class HaarDoorDetectPipe:
             return processed_image
         else:
             return image
+
+class TrackingHaarDoorDetectPipe(HaarDoorDetectPipe):
+    """A faster Haar door detector, which tracks the door it last found.
+
+    Every scan_interval frames, or whenever it has lost track of the door, the
+    whole frame is scanned, but shrunk by scan_scale first. In between, only
+    the area around the last door found is searched, padded by padding times
+    the door's size on each side, at full resolution. Doors don't move far
+    from one frame to the next, so that's nearly always where they are."""
+
+    def __init__(self, next_pipe, path="haarcascade-door.xml",
+                 scan_scale=0.5, scan_interval=10, padding=0.5,
+                 scale_factor=1.2, min_neighbors=3, pool=None):
+        HaarDoorDetectPipe.__init__(self, next_pipe, path)
+        self.pool = pool or default_pool
+        self.scan_scale = scan_scale
+        self.scan_interval = scan_interval
+        self.padding = padding
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+        # Frames since the last full scan, and the door we're tracking.
+        self.frames_since_scan = None
+        self.tracked = None
+
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.lost = 0
+
+    def detect(self, image):
+        doors = []
+        if self.tracked and self.frames_since_scan < self.scan_interval:
+            doors = self.search_around(image, self.tracked)
+            self.roi_scans += 1
+            self.frames_since_scan += 1
+            if not doors:
+                # The door has gone, or moved further than we looked.
+                self.lost += 1
+        if not doors:
+            doors = self.full_scan(image)
+            self.full_scans += 1
+            self.frames_since_scan = 0
+
+        if doors:
+            # Follow the biggest door; it's probably the nearest.
+            self.tracked = max(doors, key=lambda rect: rect[2] * rect[3])
+        else:
+            self.tracked = None
+        return doors
+
+    def full_scan(self, image):
+        """Scan a shrunken copy of the whole image."""
+        width = max(1, int(image.width * self.scan_scale))
+        height = max(1, int(image.height * self.scan_scale))
+        small = self.pool.lease((width, height), image.depth,
+                                image.nChannels)
+        cv.Resize(image, small, cv.CV_INTER_AREA)
+        cv.ClearMemStorage(self.storage)
+        found = self.cascade.detect(small, self.storage, self.scale_factor,
+                                    self.min_neighbors,
+                                    cv.CV_HAAR_DO_CANNY_PRUNING)
+        self.pool.release(small)
+        scale = 1.0 / self.scan_scale
+        return [(int(x * scale), int(y * scale), int(w * scale),
+                 int(h * scale)) for (x, y, w, h), neighbors in found]
+
+    def search_around(self, image, rect):
+        """Search the area around rect at full resolution."""
+        left, top, width, height = pad_rect(rect, self.padding,
+                                            (image.width, image.height))
+        if width <= 0 or height <= 0:
+            return []
+        region = cv.GetSubRect(image, (left, top, width, height))
+        # The door won't have changed size much, so there's no need to look
+        # for ones much smaller than it was.
+        min_size = (int(rect[2] * 0.6), int(rect[3] * 0.6))
+        cv.ClearMemStorage(self.storage)
+        found = self.cascade.detect(region, self.storage, self.scale_factor,
+                                    self.min_neighbors,
+                                    cv.CV_HAAR_DO_CANNY_PRUNING, min_size)
+        return [(x + left, y + top, w, h)
+                for (x, y, w, h), neighbors in found]
+
+    def stats(self):
+        return {"full_scans": self.full_scans,
+                "roi_scans": self.roi_scans,
+                "lost": self.lost}
@@ -1,23 +1,30 @@
 """An image processing pipeline stage which performs edge detection."""
 
 import cv
+from bufferpool import default_pool
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
 class EdgeDetectPipe:
 
-    def __init__(self, next_pipe):
+    def __init__(self, next_pipe, pool=None):
         self.next_pipe = next_pipe
+        self.pool = pool or default_pool
 
     def process(self, image):
-        grayscale = cv.CreateImage((image.width, image.height),
+        grayscale = self.pool.lease((image.width, image.height),
+                                    image.depth, 1)
+        features = self.pool.lease((image.width, image.height),
                                    image.depth, 1)
-        features = cv.CreateImage((image.width, image.height),
-                                  image.depth, 1)
         cv.CvtColor(image, grayscale, cv.CV_RGB2GRAY)
         cv.Canny(grayscale, features, 70.0, 140.0)
+        self.pool.release(grayscale)
         if self.next_pipe:
             processed_image = self.next_pipe.process(features)
+            # Once the rest of the pipeline is done with our output we can
+            # have it back, unless it was passed straight through.
+            if processed_image is not features:
+                self.pool.release(features)
             return processed_image
         else:
             return features
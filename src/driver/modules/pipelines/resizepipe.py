@@ -6,43 +6,95 @@ problem with "Inappropriate IOCTL for device", you might consider using the
 default camera resolution and resizing images as needed afterwards."""
 
 import cv
+from bufferpool import default_pool
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
 class ResizePipe:
+    """Resizes images to x_res by y_res.
 
-    def __init__(self, next_pipe, x_res=640, y_res=480):
+    When shrinking an image to half its size or less, and pyramid is set, it
+    is first halved with cv.PyrDown as many times as it can be, which is
+    cheaper than one big resize and smooths the image as it goes. Whatever is
+    left is done with an ordinary resize."""
+
+    def __init__(self, next_pipe, x_res=640, y_res=480, pool=None,
+                 pyramid=True):
         self.next_pipe = next_pipe
+        self.pool = pool or default_pool
         self.x_res = x_res
         self.y_res = y_res
+        self.pyramid = pyramid
+        # (original size, target size) pairs we've warned about already.
+        self.warned = set()
 
     def process(self, image):
         if image.width == self.x_res and image.height == self.y_res:
+            # Nothing to do, but the rest of the pipeline still needs to run.
+            if self.next_pipe:
+                return self.next_pipe.process(image)
             return image
 
-        # Resizing tries to fit the original image into the new destination
-        # image exactly, so if they don't scale well to each other there may be
-        # distortion.
-        if ((image.width % self.x_res != 0 and self.x_res % image.width != 0) or
-            (image.height % self.y_res != 0 and self.y_res % image.height != 0)):
-                print ("WARNING: Resize target size does not fit cleanly into "
-                       " original. Distortion of the image may occur.")
-                print "\tOriginal size: %sx%s" % (image.width, image.height)
-                print "\tTarget size: %sx%s" % (self.x_res, self.y_res)
-
-        # We first create a destination image of the proper size,
-        # and then call resize() with it to resize the image.
-        # cv.CreateMat is kind of weird since it takes rows then columns as
-        # arguments rather than the usual (x, y) ordering.
         if type(image) == cv.iplimage:
-            resized_image = cv.CreateImage((self.x_res, self.y_res),
-                                           image.depth, image.nChannels)
+            resized_image = self.resize(image)
         else:
+            # We first create a destination image of the proper size,
+            # and then call resize() with it to resize the image.
+            # cv.CreateMat is kind of weird since it takes rows then columns as
+            # arguments rather than the usual (x, y) ordering.
+            self.check_fit(image)
             resized_image = cv.CreateMat(self.y_res, self.x_res, image.type)
-        cv.Resize(image, resized_image)
+            cv.Resize(image, resized_image)
 
         if self.next_pipe:
             processed_image = self.next_pipe.process(resized_image)
+            if processed_image is not resized_image:
+                self.pool.release(resized_image)
             return processed_image
         else:
             return resized_image
+
+    def resize(self, image):
+        """Resize an IPL image into one leased from the pool."""
+        source = image
+        if self.pyramid:
+            while (source.width >= 2 * self.x_res and
+                   source.height >= 2 * self.y_res):
+                half = self.pool.lease(((source.width + 1) // 2,
+                                        (source.height + 1) // 2),
+                                       source.depth, source.nChannels)
+                cv.PyrDown(source, half)
+                if source is not image:
+                    self.pool.release(source)
+                source = half
+            if source.width == self.x_res and source.height == self.y_res:
+                return source
+
+        self.check_fit(source)
+        resized_image = self.pool.lease((self.x_res, self.y_res),
+                                        source.depth, source.nChannels)
+        # Area interpolation is the least prone to aliasing when shrinking.
+        interpolation = cv.CV_INTER_LINEAR
+        if source.width > self.x_res or source.height > self.y_res:
+            interpolation = cv.CV_INTER_AREA
+        cv.Resize(source, resized_image, interpolation)
+        if source is not image:
+            self.pool.release(source)
+        return resized_image
+
+    def check_fit(self, image):
+        """Warn, once for each pair of sizes, if image doesn't scale cleanly
+        to the target size."""
+        # Resizing tries to fit the original image into the new destination
+        # image exactly, so if they don't scale well to each other there may be
+        # distortion.
+        if ((image.width % self.x_res != 0 and self.x_res % image.width != 0) or
+            (image.height % self.y_res != 0 and self.y_res % image.height != 0)):
+            sizes = ((image.width, image.height), (self.x_res, self.y_res))
+            if sizes in self.warned:
+                return
+            self.warned.add(sizes)
+            print ("WARNING: Resize target size does not fit cleanly into "
+                   " original. Distortion of the image may occur.")
+            print "\tOriginal size: %sx%s" % (image.width, image.height)
+            print "\tTarget size: %sx%s" % (self.x_res, self.y_res)
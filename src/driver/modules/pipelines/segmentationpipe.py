@@ -1,7 +1,8 @@
 """An image processing pipeline stage which divides the image into segments."""
 
 import cv
-import itertools
+import segmentation
+from bufferpool import default_pool
 
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
@@ -10,34 +11,49 @@ class ShotgunSegmentationPipe:
 
     This pipe can be used to simplify an image before other processing steps are
     applied; this is useful, for example, to improve the output of a
-    detector. It works by initiating a flood fill at multiple points in the
-    image, and filling those regions with the color of the starting pixel."""
+    detector. It blurs the image, then splits it into regions of neighbouring
+    pixels whose colours differ by no more than max_difference in each
+    channel, just as a flood fill would, and fills each region with its mean
+    colour. See the segmentation module for how.
 
-    def __init__(self, next_pipe):
+    The caller's image is left alone; the segmented image is a new one. The
+    regions found in the last frame are kept in self.segmentation, a
+    Segmentation holding a label map and each region's colour and size.
+
+    With tiles greater than one, regions are found in that many horizontal
+    strips of the image at once, on a pool of threads."""
+
+    def __init__(self, next_pipe, passes=15, max_difference=(1, 3, 3, 0),
+                 tiles=1, pool=None):
         self.next_pipe = next_pipe
+        self.pool = pool or default_pool
+        # The image is blurred as much as passes 3x3 Gaussian smooths would.
+        self.passes = passes
+        self.max_difference = max_difference
+        self.tiles = tiles
+        self.tile_pool = None
+        if tiles > 1:
+            self.tile_pool = segmentation.tile_pool(tiles)
+        self.segmentation = None
+
+    def process(self, image, max_difference=None, passes=None):
+        if max_difference is None:
+            max_difference = self.max_difference
+        if passes is None:
+            passes = self.passes
+
+        segmented = self.pool.lease((image.width, image.height), image.depth,
+                                    image.nChannels)
+        segmentation.blur(image, segmented, passes)
+        self.segmentation = segmentation.segment(
+            segmentation.pixel_array(segmented), max_difference, self.tiles,
+            self.tile_pool)
+        segmentation.paint(self.segmentation, segmented)
 
-    def process(self, image, x_points=8, y_points=6,
-                max_difference=(1, 3, 3, 0), passes=1):
-        # First, select the points we want. We should have x_points*y_points of
-        # them, as they're the cross product of the x and y values.
-        x_vals = [int((i + 0.5) * (image.width/x_points)) for i in range(x_points)]
-        y_vals = [int((i + 0.5) * (image.height/y_points)) for i in range(y_points)]
-        coordinates = list(itertools.product(x_vals, y_vals))
-
-        for i in range(15):
-            cv.Smooth(image, image)
-        
-        for i in range(passes):
-            for coordinate in coordinates:
-                x, y = coordinate
-                # Remember, cv array access is wonky
-                color = image[y, x]
-                b, g, r = color
-                cv.FloodFill(image, coordinate, color,
-                             max_difference, max_difference)
-                
         if self.next_pipe:
-            processed_image = self.next_pipe.process(image)
+            processed_image = self.next_pipe.process(segmented)
+            if processed_image is not segmented:
+                self.pool.release(segmented)
             return processed_image
         else:
-            return image
+            return segmented
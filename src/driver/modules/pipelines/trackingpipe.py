@@ -0,0 +1,294 @@
+"""A pipeline stage which follows doors from frame to frame with optical flow.
+
+Running a door detector on every frame is wasteful: consecutive frames are
+nearly the same, so the door is nearly always a few pixels from where it was.
+This stage runs the detector once, seeds corner features inside the door it
+found with GoodFeaturesToTrack, and then follows those features with pyramidal
+Lucas-Kanade optical flow, moving and scaling the door rectangle with them.
+
+The detector only runs again when tracking confidence, the share of the seeded
+features still being followed, drops below a threshold."""
+
+import cv
+import numpy
+from bufferpool import default_pool
+from edgedetectpipe import EdgeDetectPipe
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# Stop refining each feature's position after this many iterations, or once it
+# moves less than this many pixels.
+LK_CRITERIA = (cv.CV_TERMCRIT_ITER | cv.CV_TERMCRIT_EPS, 20, 0.03)
+
+class FeatureTracker:
+    """Follows a set of corner features across frames of the same size.
+
+    Frames are given as single channel 8 bit images. The tracker keeps its
+    own copy of the previous frame and of its image pyramid, so the pyramid
+    for each frame is only ever built once."""
+
+    def __init__(self, max_features=40, quality=0.01, min_distance=5.0,
+                 window=(15, 15), levels=3, max_error=50.0, pool=None):
+        self.pool = pool or default_pool
+        self.max_features = max_features
+        self.quality = quality
+        self.min_distance = min_distance
+        self.window = window
+        self.levels = levels
+        self.max_error = max_error
+
+        self.previous = None
+        self.previous_pyramid = None
+        # Whether previous_pyramid holds the pyramid for previous yet.
+        self.pyramid_ready = False
+        # Features in the previous frame, and how many there were when they
+        # were seeded.
+        self.points = []
+        self.seeded = 0
+
+    def confidence(self):
+        """Get the share of the seeded features which are still tracked."""
+        if not self.seeded:
+            return 0.0
+        return float(len(self.points)) / self.seeded
+
+    def seed(self, gray, rect):
+        """Find features to follow inside an (x, y, w, h) rectangle of gray.
+
+        Returns the number of features found."""
+        x, y, w, h = rect
+        region = cv.GetSubRect(gray, (x, y, w, h))
+        eig_image = self.pool.lease((w, h), cv.IPL_DEPTH_32F, 1)
+        temp_image = self.pool.lease((w, h), cv.IPL_DEPTH_32F, 1)
+        corners = cv.GoodFeaturesToTrack(region, eig_image, temp_image,
+                                         self.max_features, self.quality,
+                                         self.min_distance)
+        self.pool.release(eig_image)
+        self.pool.release(temp_image)
+
+        self.remember(gray)
+        self.points = [(px + x, py + y) for px, py in corners]
+        self.seeded = len(self.points)
+        return self.seeded
+
+    def track(self, gray):
+        """Follow the features into a new frame.
+
+        Returns a list of (old, new) point pairs for the features which were
+        found again; the rest are dropped."""
+        if (self.previous is None or not self.points or
+            self.previous.width != gray.width or
+            self.previous.height != gray.height):
+            self.reset()
+            return []
+
+        pyramid = self.lease_pyramid(gray)
+        flags = 0
+        if self.pyramid_ready:
+            flags = cv.CV_LKFLOW_PYR_A_READY
+        found, status, errors = cv.CalcOpticalFlowPyrLK(
+            self.previous, gray, self.previous_pyramid, pyramid, self.points,
+            self.window, self.levels, LK_CRITERIA, flags)
+
+        pairs = [(old, new) for old, new, ok, error in
+                 zip(self.points, found, status, errors)
+                 if ok and error <= self.max_error and
+                 0 <= new[0] < gray.width and 0 <= new[1] < gray.height]
+        self.points = [new for old, new in pairs]
+
+        # The new frame's pyramid was just built, so the next call can start
+        # from it.
+        self.remember(gray, pyramid)
+        return pairs
+
+    def lease_pyramid(self, gray):
+        # (width + 8) * height / 3 bytes holds every level of the pyramid.
+        return self.pool.lease((gray.width + 8, gray.height // 3 + 1),
+                               cv.IPL_DEPTH_8U, 1)
+
+    def remember(self, gray, pyramid=None):
+        """Keep a copy of gray, and its pyramid if we have it, for next time."""
+        if (self.previous is None or self.previous.width != gray.width or
+            self.previous.height != gray.height):
+            self.pool.release(self.previous)
+            self.previous = self.pool.lease((gray.width, gray.height),
+                                            cv.IPL_DEPTH_8U, 1)
+        cv.Copy(gray, self.previous)
+        self.pool.release(self.previous_pyramid)
+        if pyramid is None:
+            self.previous_pyramid = self.lease_pyramid(gray)
+            self.pyramid_ready = False
+        else:
+            self.previous_pyramid = pyramid
+            self.pyramid_ready = True
+
+    def reset(self):
+        """Forget the features and frame being tracked."""
+        self.pool.release(self.previous)
+        self.pool.release(self.previous_pyramid)
+        self.previous = None
+        self.previous_pyramid = None
+        self.pyramid_ready = False
+        self.points = []
+        self.seeded = 0
+
+def move_rect(rect, pairs, size):
+    """Move and scale an (x, y, w, h) rectangle the way its features moved.
+
+    The rectangle follows the median feature displacement, and grows or
+    shrinks with the median change in the features' distance from their
+    centre. Medians keep a few badly tracked features from dragging it off.
+    The result is clipped to an image of the given size."""
+    old = numpy.array([pair[0] for pair in pairs], dtype=numpy.float64)
+    new = numpy.array([pair[1] for pair in pairs], dtype=numpy.float64)
+    dx, dy = numpy.median(new - old, axis=0)
+
+    scale = 1.0
+    if len(pairs) > 1:
+        old_spread = numpy.hypot(*(old - old.mean(axis=0)).T)
+        new_spread = numpy.hypot(*(new - new.mean(axis=0)).T)
+        moving = old_spread > 1.0
+        if moving.any():
+            scale = float(numpy.median(new_spread[moving] /
+                                       old_spread[moving]))
+
+    x, y, w, h = rect
+    cx = x + w / 2.0 + dx
+    cy = y + h / 2.0 + dy
+    w *= scale
+    h *= scale
+    width, height = size
+    left = max(0, int(round(cx - w / 2.0)))
+    top = max(0, int(round(cy - h / 2.0)))
+    right = min(width, int(round(cx + w / 2.0)))
+    bottom = min(height, int(round(cy + h / 2.0)))
+    return left, top, right - left, bottom - top
+
+class TrackingDoorDetectPipe:
+    """Finds doors with another detector, then follows them with optical flow.
+
+    The detector can be anything with a detect(image) method returning a list
+    of (x, y, w, h) rectangles, like a HaarDoorDetectPipe. Detectors which
+    want edges rather than a camera image, like ScanningDoorDetectPipe, say so
+    with a true needs_edges attribute and get their image edge detected first.
+
+    The detector runs when the share of features still being tracked falls
+    below min_confidence, when the door has shrunk to fewer than min_features
+    features, or every redetect_interval frames if that is set. While no door
+    is in view it is retried every retry_interval frames rather than on every
+    one. The door is drawn on a copy of the image, which goes down the
+    pipeline."""
+
+    def __init__(self, next_pipe, detector, min_confidence=0.5,
+                 min_features=6, redetect_interval=None, retry_interval=5,
+                 color=cv.Scalar(0, 0, 255), pool=None, **tracker_options):
+        self.next_pipe = next_pipe
+        self.detector = detector
+        self.pool = pool or default_pool
+        self.min_confidence = min_confidence
+        self.min_features = min_features
+        self.redetect_interval = redetect_interval
+        self.retry_interval = retry_interval
+        self.color = color
+        self.tracker = FeatureTracker(pool=self.pool, **tracker_options)
+        if getattr(detector, "needs_edges", False):
+            self.edge_pipe = EdgeDetectPipe(None, self.pool)
+        else:
+            self.edge_pipe = None
+
+        # The door being followed, and frames since the detector last ran.
+        self.door = None
+        self.frames_since_detect = None
+
+        self.detections = 0
+        self.tracked_frames = 0
+        self.lost = 0
+
+    def process(self, image):
+        gray = self.pool.lease((image.width, image.height),
+                               cv.IPL_DEPTH_8U, 1)
+        if image.nChannels == 1:
+            cv.Copy(image, gray)
+        else:
+            cv.CvtColor(image, gray, cv.CV_RGB2GRAY)
+
+        lost = self.door is not None and not self.follow(gray)
+        if lost or self.should_detect():
+            self.detect(image, gray)
+        self.pool.release(gray)
+
+        output = self.pool.lease((image.width, image.height), image.depth,
+                                 image.nChannels)
+        cv.Copy(image, output)
+        if self.door is not None:
+            x, y, w, h = self.door
+            cv.Rectangle(output, (x, y), (x + w, y + h), self.color)
+
+        if self.next_pipe:
+            processed_image = self.next_pipe.process(output)
+            if processed_image is not output:
+                self.pool.release(output)
+            return processed_image
+        else:
+            return output
+
+    def follow(self, gray):
+        """Move the door along with its features into a new frame.
+
+        Returns False if the door was lost."""
+        pairs = self.tracker.track(gray)
+        self.frames_since_detect += 1
+        if (len(pairs) < self.min_features or
+            self.tracker.confidence() < self.min_confidence):
+            self.door = None
+        else:
+            self.door = move_rect(self.door, pairs,
+                                  (gray.width, gray.height))
+            if self.door[2] <= 0 or self.door[3] <= 0:
+                self.door = None
+        if self.door is None:
+            self.lost += 1
+            return False
+        self.tracked_frames += 1
+        return True
+
+    def should_detect(self):
+        """Check whether the detector is due, other than for a lost door."""
+        if self.frames_since_detect is None:
+            return True
+        if self.door is None:
+            # There was no door last time we looked; don't look every frame.
+            self.frames_since_detect += 1
+            return self.frames_since_detect >= self.retry_interval
+        return (self.redetect_interval is not None and
+                self.frames_since_detect >= self.redetect_interval)
+
+    def detect(self, image, gray):
+        """Run the detector, and start following the biggest door it finds."""
+        if self.edge_pipe:
+            edges = self.edge_pipe.process(image)
+            doors = self.detector.detect(edges)
+            self.pool.release(edges)
+        else:
+            doors = self.detector.detect(image)
+        self.detections += 1
+        self.frames_since_detect = 0
+
+        # Follow the biggest door; it's probably the nearest.
+        doors = [door for door in doors if door[2] > 0 and door[3] > 0]
+        if not doors:
+            self.door = None
+            self.tracker.reset()
+            return
+        door = max(doors, key=lambda rect: rect[2] * rect[3])
+        if self.tracker.seed(gray, door) < self.min_features:
+            # Nothing in it to follow, so look again next frame.
+            self.door = None
+            self.frames_since_detect = self.retry_interval - 1
+            return
+        self.door = door
+
+    def stats(self):
+        return {"detections": self.detections,
+                "tracked_frames": self.tracked_frames,
+                "lost": self.lost}
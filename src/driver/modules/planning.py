@@ -0,0 +1,139 @@
+"""Resolution-aware planning of camera pipelines.
+
+Most pipes cost about the same for every pixel they touch, so where the
+resize goes in a pipeline matters: edge detecting a 1280x720 frame and then
+shrinking the result to 320x240 does twelve times the work of shrinking first.
+The planner is given the stages a mode needs, in order, along with the size
+frames come in at and the size wanted out, and puts the ResizePipe wherever
+the pipeline as a whole costs least. Costs are estimated per pixel from
+PIXEL_COSTS.
+
+Stages before the resize see frames at the capture size and stages after it
+at the output size. Detectors only mark what they find by drawing on the
+frame they pass on, so a detector planned before the resize has its
+markings scaled along with everything else, and nothing needs mapping."""
+
+from pipelines import *
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# Rough cost of each pipe for every pixel it processes, relative to resizing.
+# Only the ratios matter; they were eyeballed from the pipeline benchmark
+# (python -m driver.benchmarks.pipelines).
+PIXEL_COSTS = {
+    NopPipe: 0.0,
+    ResizePipe: 1.0,
+    EdgeDetectPipe: 6.0,
+    ScanningDoorDetectPipe: 2.0,
+    TrackingDoorDetectPipe: 3.0,
+    HaarDoorDetectPipe: 40.0,
+    TrackingHaarDoorDetectPipe: 10.0,
+    GoodFeaturesPipe: 10.0,
+    ShotgunSegmentationPipe: 30.0,
+    }
+# Cost of pipes that aren't in PIXEL_COSTS.
+DEFAULT_PIXEL_COST = 1.0
+
+class Stage:
+    """A pipe to be built into a plan: its class, and the arguments to build
+    it with after next_pipe."""
+
+    def __init__(self, pipe_class, *args, **kwargs):
+        self.pipe_class = pipe_class
+        self.args = args
+        self.kwargs = kwargs
+
+    def build(self, next_pipe):
+        return self.pipe_class(next_pipe, *self.args, **self.kwargs)
+
+    def name(self):
+        return self.pipe_class.__name__
+
+    def pixel_cost(self):
+        return PIXEL_COSTS.get(self.pipe_class, DEFAULT_PIXEL_COST)
+
+class Plan:
+    """A pipeline built for frames of one size going out at another.
+
+    pipes holds the pipes in the order frames go through them, resize
+    included, and sizes the size of frame each one is given. first_pipe is
+    where frames go in and resize_pipe is the pipe doing the resizing. costs
+    holds each pipe's estimated cost for a frame, in PIXEL_COSTS units times
+    pixels, and cost their total."""
+
+    def __init__(self, pipes, sizes, costs, input_size, output_size):
+        self.pipes = pipes
+        self.sizes = sizes
+        self.costs = costs
+        self.cost = sum(costs)
+        self.input_size = input_size
+        self.output_size = output_size
+        self.first_pipe = pipes[0]
+        self.resize_pipe = [pipe for pipe in pipes
+                            if isinstance(pipe, ResizePipe)][0]
+
+    def set_output_size(self, size):
+        """Change the output size without moving the resize.
+
+        This is cheap enough to do between frames; replan if the new size is
+        very different from the old one."""
+        self.output_size = tuple(size)
+        self.resize_pipe.x_res, self.resize_pipe.y_res = self.output_size
+        after = False
+        for i, pipe in enumerate(self.pipes):
+            if after:
+                self.sizes[i] = self.output_size
+            after = after or pipe is self.resize_pipe
+
+    def describe(self):
+        """Describe the plan on one line, e.g.
+
+          ResizePipe@1280x720 EdgeDetectPipe@640x480 cost=2764800"""
+        stages = ["%s@%dx%d" % (pipe.__class__.__name__, width, height)
+                  for pipe, (width, height) in zip(self.pipes, self.sizes)]
+        return "%s cost=%d" % (" ".join(stages), self.cost)
+
+def plan_pipeline(stages, input_size, output_size, pool=None):
+    """Build a pipeline from stages with the resize wherever it costs least.
+
+    stages is a list of Stages, in the order frames should go through them.
+    If the input size isn't known the resize goes last, which is always
+    correct if not always cheapest. Returns a Plan."""
+    output_size = tuple(output_size)
+    if input_size is None:
+        input_size = output_size
+        positions = [len(stages)]
+    else:
+        input_size = tuple(input_size)
+        # Latest first, so that ties leave the resize at the end.
+        positions = range(len(stages), -1, -1)
+
+    input_pixels = input_size[0] * input_size[1]
+    output_pixels = output_size[0] * output_size[1]
+    resize_cost = PIXEL_COSTS[ResizePipe] * input_pixels
+
+    best = None
+    for position in positions:
+        costs = [stage.pixel_cost() * input_pixels
+                 for stage in stages[:position]]
+        costs.append(resize_cost)
+        costs.extend(stage.pixel_cost() * output_pixels
+                     for stage in stages[position:])
+        if best is None or sum(costs) < sum(best[1]):
+            best = (position, costs)
+    position, costs = best
+
+    sizes = ([input_size] * (position + 1) +
+             [output_size] * (len(stages) - position))
+    builders = ([stage.build for stage in stages[:position]] +
+                [lambda next_pipe: ResizePipe(next_pipe, output_size[0],
+                                              output_size[1], pool)] +
+                [stage.build for stage in stages[position:]])
+    # Build from the back, since each pipe needs the one after it.
+    pipes = []
+    next_pipe = None
+    for build in reversed(builders):
+        next_pipe = build(next_pipe)
+        pipes.append(next_pipe)
+    pipes.reverse()
+    return Plan(pipes, sizes, costs, input_size, output_size)
@@ -0,0 +1,125 @@
+"""Adaptive image quality control for slow links.
+
+Sending full size, high quality JPEGs over Bluetooth piles seconds of latency
+onto the operator's view. The AdaptiveQualityController watches how long it
+takes to send each image and how big it was, estimates the link's throughput
+from that, and turns the JPEG quality and resolution down (or back up) a step
+at a time so that images fit in the time we have for each one.
+
+The controller only decides on settings; it's up to the caller to apply them
+to the camera."""
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class AdaptiveQualityController:
+    """Picks JPEG quality and resolution to hold a target frame rate or latency.
+
+    Quality is adjusted first, since it's the cheaper knob. Once quality hits
+    its floor, the resolution drops to the next step down and quality goes
+    back to the middle of its range; going up works the other way around.
+    After each change the controller waits a few frames before changing again,
+    so it doesn't oscillate on noisy measurements."""
+
+    # Resolutions to step through, largest first. Each divides evenly into the
+    # ones before it, so resizing doesn't distort the image.
+    RESOLUTIONS = [(640, 480), (320, 240), (160, 120)]
+
+    def __init__(self, target_fps=None, target_latency=None,
+                 quality=95, resolution=(640, 480),
+                 min_quality=20, max_quality=95, quality_step=10,
+                 hold_frames=3, clean_frames=30, smoothing=0.3):
+        if not target_fps and not target_latency:
+            raise ValueError("Need a target frame rate or latency.")
+        # Every image needs to be sent within this many seconds.
+        if target_latency:
+            self.budget = target_latency
+        else:
+            self.budget = 1.0 / target_fps
+
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_step = quality_step
+        self.hold_frames = hold_frames
+        self.clean_frames = clean_frames
+        self.smoothing = smoothing
+
+        self.quality = max(min_quality, min(max_quality, quality))
+        if resolution in self.RESOLUTIONS:
+            self.level = self.RESOLUTIONS.index(resolution)
+        else:
+            self.level = 0
+
+        # Estimated link throughput, in bytes per second.
+        self.throughput = None
+        self.frames_since_change = 0
+        self.clean_run = 0
+
+    def resolution(self):
+        return self.RESOLUTIONS[self.level]
+
+    def observe(self, nbytes, seconds):
+        """Record how long it took to send an image of nbytes bytes.
+
+        Returns True if the quality or resolution should change."""
+        self.frames_since_change += 1
+        # Sends which finish almost instantly only went as far as the socket
+        # buffer, and tell us nothing about the link.
+        if seconds > 0.0001:
+            rate = nbytes / seconds
+            if self.throughput is None:
+                self.throughput = rate
+            else:
+                self.throughput += self.smoothing * (rate - self.throughput)
+
+        if self.frames_since_change < self.hold_frames:
+            return False
+        if seconds > self.budget:
+            return self.step_down()
+        if self.throughput is not None and \
+                nbytes < 0.5 * self.throughput * self.budget:
+            # We could send twice as much as we are in the time we have.
+            return self.step_up()
+        return False
+
+    def observe_stream(self, dropped):
+        """Record whether a pushed stream frame had to be dropped.
+
+        Streamed frames are sent without blocking, so there's no send time to
+        go on. Instead, a drop means the link is falling behind, and a long run
+        without drops means there's room to spare. Returns True if the quality
+        or resolution should change."""
+        self.frames_since_change += 1
+        if dropped:
+            self.clean_run = 0
+            if self.frames_since_change >= self.hold_frames:
+                return self.step_down()
+            return False
+        self.clean_run += 1
+        if self.clean_run >= self.clean_frames:
+            self.clean_run = 0
+            return self.step_up()
+        return False
+
+    def step_down(self):
+        """Lower quality, or resolution once quality is at its floor."""
+        if self.quality - self.quality_step >= self.min_quality:
+            self.quality -= self.quality_step
+        elif self.level + 1 < len(self.RESOLUTIONS):
+            self.level += 1
+            self.quality = (self.min_quality + self.max_quality) // 2
+        else:
+            return False
+        self.frames_since_change = 0
+        return True
+
+    def step_up(self):
+        """Raise quality, or resolution once quality is at its ceiling."""
+        if self.quality + self.quality_step <= self.max_quality:
+            self.quality += self.quality_step
+        elif self.level > 0:
+            self.level -= 1
+            self.quality = (self.min_quality + self.max_quality) // 2
+        else:
+            return False
+        self.frames_since_change = 0
+        return True
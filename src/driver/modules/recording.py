@@ -0,0 +1,422 @@
+"""Recording driver sessions to a file, and playing them back.
+
+A SessionRecorder appends every raw camera frame and every command packet the
+driver sees to a session file, along with when it happened, and which frame
+answered each IMAGE request. A SessionReader opens that file with mmap, so
+any record can be pulled out of even a very long session without reading
+everything before it, and a ReplaySource hands the recorded frames back to a
+CameraModule, either the ones it's told were served or all of them in the
+order they were captured. See driver/replay.py for feeding a whole session
+back through a BotDriver.
+
+The file is laid out as follows, all in network byte order:
+
+  header      "RCSN", version (2 bytes), reserved (2 bytes)
+  chunks      each "RCCK", record count (4 bytes), length of the records in
+              bytes (4 bytes), then the records themselves
+  index       one entry per record: kind (1 byte), timestamp (8 byte double),
+              offset of its payload in the file (8 bytes), payload length
+              (4 bytes)
+  trailer     offset of the index (8 bytes), number of entries (4 bytes),
+              "RCIX"
+
+Each record is a kind (1 byte), timestamp (8 byte double) and payload length
+(4 bytes), then the payload. A frame's payload starts with its sequence
+number (4 bytes), width and height (2 bytes each), IPL depth (4 bytes, signed),
+channel count (1 byte) and row length in bytes (4 bytes), followed by the
+pixels. A command's starts with the id of the connection it came from (2
+bytes), followed by the packet just as it was read. A served record's
+payload is just the sequence number of the frame that was sent (4 bytes).
+Its timestamp is when the frame started to be captured, so it can be earlier
+than those of the records just before it.
+
+Which frames get recorded depends on how the camera was running: in threaded
+mode only the frames that were asked for, in staged mode every frame fed to
+the pipeline. Either way each frame is only recorded once in a row, and
+every frame that was served is there.
+
+Records are written a chunk at a time, and the index only when recording
+stops. If the driver dies before then the index is missing, but the reader
+rebuilds it by walking the chunks, and loses at most the chunk that was being
+written."""
+
+import array
+import mmap
+import os
+import struct
+import threading
+import time
+import cv
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+SESSION_MAGIC = "RCSN"
+SESSION_VERSION = 1
+FILE_HEADER_FORMAT = "!4sHH"
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+
+CHUNK_MAGIC = "RCCK"
+CHUNK_HEADER_FORMAT = "!4sII"
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FORMAT)
+
+RECORD_HEADER_FORMAT = "!BdI"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+FRAME_HEADER_FORMAT = "!IHHiBI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+COMMAND_HEADER_FORMAT = "!H"
+COMMAND_HEADER_SIZE = struct.calcsize(COMMAND_HEADER_FORMAT)
+
+SERVED_FORMAT = "!I"
+
+INDEX_ENTRY_FORMAT = "!BdQI"
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+
+INDEX_MAGIC = "RCIX"
+TRAILER_FORMAT = "!QI4s"
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+
+FRAME = 1
+COMMAND = 2
+SERVED = 3
+
+class SessionError(Exception):
+    pass
+
+class SessionRecorder:
+    """Appends frames and commands to a session file.
+
+    Records are collected in memory until there are chunk_bytes of them, then
+    written out as one chunk. Safe to call from several threads."""
+
+    def __init__(self, path, chunk_bytes=4 * 1024 * 1024):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.file = open(path, "wb")
+        self.file.write(struct.pack(FILE_HEADER_FORMAT, SESSION_MAGIC,
+                                    SESSION_VERSION, 0))
+        self.offset = FILE_HEADER_SIZE
+        self.lock = threading.Lock()
+
+        # Records waiting to be written, and their total size.
+        self.pending = []
+        self.pending_bytes = 0
+        # (kind, timestamp, payload offset, payload length) for every record.
+        self.index = []
+        # Connections are recorded as small numbers, in the order they first
+        # sent anything.
+        self.source_ids = {}
+        self.last_frame_seq = None
+
+        self.frames = 0
+        self.commands = 0
+        self.served = 0
+
+    def record_frame(self, frame):
+        """Record a raw Frame, unless it's the same one as last time."""
+        with self.lock:
+            if frame.seq == self.last_frame_seq:
+                return
+            self.last_frame_seq = frame.seq
+            self.frames += 1
+        image = frame.image
+        pixels = image.tostring()
+        header = struct.pack(FRAME_HEADER_FORMAT, frame.seq, image.width,
+                             image.height, image.depth, image.nChannels,
+                             len(pixels) // image.height)
+        self._append(FRAME, frame.timestamp, header + pixels)
+
+    def record_command(self, packet_data, source=None, timestamp=None):
+        """Record a packet of command data read from source."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            source_id = self.source_ids.get(source)
+            if source_id is None:
+                source_id = self.source_ids[source] = len(self.source_ids)
+            self.commands += 1
+        self._append(COMMAND, timestamp,
+                     struct.pack(COMMAND_HEADER_FORMAT, source_id) +
+                     packet_data)
+
+    def record_served(self, seq, timestamp=None):
+        """Record that the frame numbered seq was sent in answer to a
+        request. The frame itself must have been recorded already."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.served += 1
+        self._append(SERVED, timestamp, struct.pack(SERVED_FORMAT, seq))
+
+    def flush(self):
+        """Write out whatever records are waiting as a chunk."""
+        with self.lock:
+            self._write_chunk()
+
+    def close(self):
+        """Write out the last chunk and the index, and close the file."""
+        with self.lock:
+            if self.file is None:
+                return
+            self._write_chunk()
+            index_offset = self.offset
+            self.file.write("".join(struct.pack(INDEX_ENTRY_FORMAT, *entry)
+                                    for entry in self.index))
+            self.file.write(struct.pack(TRAILER_FORMAT, index_offset,
+                                        len(self.index), INDEX_MAGIC))
+            self.file.close()
+            self.file = None
+
+    def _append(self, kind, timestamp, payload):
+        record = struct.pack(RECORD_HEADER_FORMAT, kind, timestamp,
+                             len(payload)) + payload
+        with self.lock:
+            if self.file is None:
+                return
+            self.pending.append((kind, timestamp, record))
+            self.pending_bytes += len(record)
+            if self.pending_bytes >= self.chunk_bytes:
+                self._write_chunk()
+
+    def _write_chunk(self):
+        # Must be called with the lock held.
+        if not self.pending:
+            return
+        self.file.write(struct.pack(CHUNK_HEADER_FORMAT, CHUNK_MAGIC,
+                                    len(self.pending), self.pending_bytes))
+        offset = self.offset + CHUNK_HEADER_SIZE
+        for kind, timestamp, record in self.pending:
+            self.file.write(record)
+            self.index.append((kind, timestamp, offset + RECORD_HEADER_SIZE,
+                               len(record) - RECORD_HEADER_SIZE))
+            offset += len(record)
+        self.file.flush()
+        self.offset = offset
+        self.pending = []
+        self.pending_bytes = 0
+
+class Record:
+    """A frame or command read back from a session."""
+
+    def __init__(self, kind, timestamp, payload):
+        self.kind = kind
+        self.timestamp = timestamp
+        self.payload = payload
+
+    def command(self):
+        """Get a command record's (source id, packet data)."""
+        source_id, = struct.unpack_from(COMMAND_HEADER_FORMAT, self.payload)
+        return source_id, self.payload[COMMAND_HEADER_SIZE:]
+
+    def frame_seq(self):
+        """Get the sequence number of a frame, or of the frame a served
+        record refers to."""
+        if self.kind == SERVED:
+            return struct.unpack_from(SERVED_FORMAT, self.payload)[0]
+        seq = struct.unpack_from(FRAME_HEADER_FORMAT, self.payload)[0]
+        return seq
+
+    def image(self):
+        """Get a frame record as an image of its own."""
+        seq, width, height, depth, channels, step = struct.unpack_from(
+            FRAME_HEADER_FORMAT, self.payload)
+        image = cv.CreateImage((width, height), depth, channels)
+        cv.SetData(image, self.payload[FRAME_HEADER_SIZE:], step)
+        return image
+
+class SessionReader:
+    """Random access to the records of a session file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < FILE_HEADER_SIZE:
+            raise SessionError("%s is too short to be a session." % (path,))
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved = struct.unpack_from(FILE_HEADER_FORMAT,
+                                                      self.map)
+        if magic != SESSION_MAGIC:
+            raise SessionError("%s isn't a session file." % (path,))
+        if version != SESSION_VERSION:
+            raise SessionError("Unknown session version %d." % (version,))
+
+        self.kinds = array.array('B')
+        self.timestamps = array.array('d')
+        self.offsets = array.array('L')
+        self.lengths = array.array('L')
+        # Whether the index had to be rebuilt, i.e. recording never finished.
+        self.recovered = not self._read_index(size)
+        if self.recovered:
+            self._scan_chunks(size)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def record(self, i):
+        offset = self.offsets[i]
+        return Record(self.kinds[i], self.timestamps[i],
+                      self.map[offset:offset + self.lengths[i]])
+
+    def records(self, kind=None, start=0):
+        """Iterate over records from start on, optionally of one kind or of
+        any of a tuple of kinds."""
+        if kind is not None and not isinstance(kind, tuple):
+            kind = (kind,)
+        for i in xrange(start, len(self)):
+            if kind is None or self.kinds[i] in kind:
+                yield self.record(i)
+
+    def count(self, kind):
+        """Get the number of records of a kind."""
+        return self.kinds.count(kind)
+
+    def find(self, timestamp):
+        """Get the index of the first record at or after timestamp."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[middle] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def duration(self):
+        if not len(self):
+            return 0.0
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _add(self, kind, timestamp, offset, length):
+        self.kinds.append(kind)
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def _read_index(self, size):
+        if size < FILE_HEADER_SIZE + TRAILER_SIZE:
+            return False
+        index_offset, count, magic = struct.unpack_from(
+            TRAILER_FORMAT, self.map, size - TRAILER_SIZE)
+        if (magic != INDEX_MAGIC or
+            index_offset + count * INDEX_ENTRY_SIZE != size - TRAILER_SIZE):
+            return False
+        for i in xrange(count):
+            self._add(*struct.unpack_from(INDEX_ENTRY_FORMAT, self.map,
+                                          index_offset + i * INDEX_ENTRY_SIZE))
+        return True
+
+    def _scan_chunks(self, size):
+        offset = FILE_HEADER_SIZE
+        while offset + CHUNK_HEADER_SIZE <= size:
+            magic, count, length = struct.unpack_from(CHUNK_HEADER_FORMAT,
+                                                      self.map, offset)
+            offset += CHUNK_HEADER_SIZE
+            if magic != CHUNK_MAGIC or offset + length > size:
+                # The chunk that was being written when we stopped.
+                return
+            for i in xrange(count):
+                kind, timestamp, payload_length = struct.unpack_from(
+                    RECORD_HEADER_FORMAT, self.map, offset)
+                offset += RECORD_HEADER_SIZE
+                self._add(kind, timestamp, offset, payload_length)
+                offset += payload_length
+
+class ReplaySource:
+    """A camera source which hands out the frames recorded in a session.
+
+    After serve(seq), the next read returns the frame numbered seq, so a
+    replay can answer each request with the frame that answered it the first
+    time. Otherwise frames come out in the order they were recorded, one per
+    read, which matches what a CameraModule saw only if it read every frame
+    itself, as it does when it isn't threaded or staged.
+
+    In real time mode reads are held back to the pace they were recorded at;
+    otherwise they come as fast as they're asked for. Once the frames run out,
+    read() returns None, unless loop is set."""
+
+    def __init__(self, reader, realtime=False, loop=False):
+        self.reader = reader
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0
+        self.started = None
+        self.frames = 0
+        # The frame the next read should return, if we've been told.
+        self.wanted = None
+        # Frame sequence number -> record index, built when first needed.
+        self.seq_index = None
+
+    def serve(self, seq):
+        """Make the next read return the frame numbered seq."""
+        self.wanted = seq
+
+    def read(self):
+        if self.wanted is not None:
+            seq, self.wanted = self.wanted, None
+            record = self._frame_by_seq(seq)
+            if record is None:
+                print "Frame %d isn't in the session." % (seq,)
+                return None
+            self.frames += 1
+            return record.image()
+        record = self._next_frame()
+        if record is None and self.loop:
+            self.position = 0
+            self.started = None
+            record = self._next_frame()
+        if record is None:
+            return None
+        if self.realtime:
+            if self.started is None:
+                self.started = (time.time(), record.timestamp)
+            wall_start, recorded_start = self.started
+            delay = (record.timestamp - recorded_start) - \
+                (time.time() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        self.frames += 1
+        return record.image()
+
+    def size(self):
+        """Get the size of the recorded frames, or None if there aren't any."""
+        for i, kind in enumerate(self.reader.kinds):
+            if kind == FRAME:
+                record = self.reader.record(i)
+                width, height = struct.unpack_from(FRAME_HEADER_FORMAT,
+                                                   record.payload)[1:3]
+                return width, height
+        return None
+
+    def request_size(self, size):
+        # Recordings are whatever size they were captured at.
+        return self.size()
+
+    def close(self):
+        pass
+
+    def _frame_by_seq(self, seq):
+        if self.seq_index is None:
+            self.seq_index = {}
+            for i, kind in enumerate(self.reader.kinds):
+                if kind == FRAME:
+                    self.seq_index.setdefault(
+                        self.reader.record(i).frame_seq(), i)
+        i = self.seq_index.get(seq)
+        if i is None:
+            return None
+        return self.reader.record(i)
+
+    def _next_frame(self):
+        kinds = self.reader.kinds
+        while self.position < len(kinds):
+            i = self.position
+            self.position += 1
+            if kinds[i] == FRAME:
+                return self.reader.record(i)
+        return None
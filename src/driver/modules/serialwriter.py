@@ -0,0 +1,200 @@
+"""Background writer for the motion controller's serial port.
+
+Writing to the Arduino from the driver loop means a flaky serial link can
+freeze everything else, video included, while we wait to reconnect. A
+SerialWriter takes messages from a bounded queue and writes them from its own
+thread instead, reconnecting with exponential backoff when the port goes away.
+
+Motion commands set the robot's state rather than adding to it, so queued
+ones go stale as soon as a newer one arrives: if ten forward commands are
+waiting behind a slow link and a stop comes in, all we want to send is the
+stop. The writer collapses those as they're queued."""
+
+import collections
+import threading
+import time
+import serial
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class LatencyStats:
+    """Running statistics for how long messages waited to be written."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, latency):
+        self.count += 1
+        self.total += latency
+        self.last = latency
+        if latency > self.max:
+            self.max = latency
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+class SerialWriter:
+    """Writes messages to a serial port from a background thread.
+
+    Messages in `supersedes` replace any of each other that are still queued.
+    Anything else, like a calibration request, is always sent.
+
+    Normally the port is only opened once there's something to write. With
+    keep_open set it's opened straight away and kept open, so that something
+    else, like a TelemetryReader, can read from `conn`."""
+
+    def __init__(self, port, baud, queue_size=16, supersedes="",
+                 initial_backoff=0.25, max_backoff=8.0, keep_open=False):
+        self.port = port
+        self.baud = baud
+        self.queue_size = queue_size
+        self.supersedes = set(supersedes)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.keep_open = keep_open
+
+        self.conn = None
+        # Queued (message, time queued) pairs.
+        self.queue = collections.deque()
+        self.ready = threading.Condition(threading.Lock())
+        self.stopping = threading.Event()
+        self.thread = None
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.connects = 0
+        # Per message latency stats, from being queued to being written.
+        self.latency = {}
+
+    def start(self):
+        """Start the writer thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="SerialWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the writer thread, abandoning anything still queued."""
+        self.stopping.set()
+        with self.ready:
+            self.ready.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def submit(self, message):
+        """Queue a message to be written. Never blocks."""
+        with self.ready:
+            if message in self.supersedes:
+                stale = [item for item in self.queue
+                         if item[0] in self.supersedes]
+                for item in stale:
+                    self.queue.remove(item)
+                self.coalesced += len(stale)
+            if len(self.queue) >= self.queue_size:
+                # Make room by dropping the oldest message.
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append((message, time.time()))
+            self.ready.notify()
+
+    def drop_connection(self, conn):
+        """Report that conn has failed, so the writer should reopen the port.
+
+        Does nothing if the writer has already moved on to a new
+        connection."""
+        with self.ready:
+            if conn is not self.conn:
+                return
+            self.conn = None
+            self.ready.notify()
+        try:
+            conn.close()
+        except serial.SerialException:
+            pass
+
+    def pending(self):
+        """Get the number of messages waiting to be written."""
+        with self.ready:
+            return len(self.queue)
+
+    def stats(self):
+        """Get a snapshot of the writer's counters as a dictionary."""
+        with self.ready:
+            latency = dict((message, (stats.count, stats.mean(), stats.max,
+                                      stats.last))
+                           for message, stats in self.latency.items())
+            return {"sent": self.sent,
+                    "coalesced": self.coalesced,
+                    "dropped": self.dropped,
+                    "connects": self.connects,
+                    "pending": len(self.queue),
+                    "connected": self.conn is not None,
+                    "latency": latency}
+
+    def _run(self):
+        backoff = self.initial_backoff
+        while not self.stopping.is_set():
+            with self.ready:
+                while not self.queue and not self.stopping.is_set() and \
+                        not (self.keep_open and self.conn is None):
+                    self.ready.wait()
+                if self.stopping.is_set():
+                    return
+                if self.queue:
+                    message, queued_at = self.queue[0]
+                else:
+                    message = None
+
+            if self.conn is None:
+                try:
+                    conn = serial.Serial(self.port, self.baud, timeout=1)
+                    with self.ready:
+                        self.conn = conn
+                    self.connects += 1
+                    backoff = self.initial_backoff
+                except serial.SerialException as se:
+                    print "Couldn't open %s, retrying in %.2fs: %s" % (
+                        self.port, backoff, se)
+                    # Waiting on the event rather than sleeping lets stop()
+                    # cut the wait short.
+                    self.stopping.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+            if message is None:
+                # We only woke up to open the port.
+                continue
+
+            # A reader sharing the port may drop the connection at any time.
+            conn = self.conn
+            if conn is None:
+                continue
+            try:
+                conn.write(message)
+            except serial.SerialException as se:
+                print "Caught SerialException, reconnecting:", se
+                self.drop_connection(conn)
+                # The message is still at the head of the queue (unless it has
+                # been superseded meanwhile), so it'll be retried.
+                continue
+
+            with self.ready:
+                # Only take the message off the queue if it wasn't superseded
+                # while we were writing it.
+                if self.queue and self.queue[0][1] == queued_at and \
+                        self.queue[0][0] == message:
+                    self.queue.popleft()
+                self.sent += 1
+                stats = self.latency.get(message)
+                if stats is None:
+                    stats = self.latency[message] = LatencyStats()
+                stats.record(time.time() - queued_at)
@@ -0,0 +1,173 @@
+"""Where the camera module gets its frames from.
+
+A source has a read() method that works like cv.QueryFrame: it returns the
+next frame, or None if there isn't one, and the frame it returns belongs to
+the source and is only good until the next read. Its size() method gives the
+size of the frames it reads, and request_size() asks it to read frames of
+another size, if it can.
+
+Sources may also split read() in two, like cv.GrabFrame and cv.RetrieveFrame:
+grab() latches the next frame as quickly as possible and retrieve() decodes
+it. Several cameras grabbed one after the other and only then retrieved take
+their frames much closer together in time than several reads would (see
+driver.modules.multicapture).
+
+DeviceSource reads a real camera. FileSource reads a directory of images or a
+video file instead, which lets the whole driver run, and be benchmarked,
+without a webcam attached."""
+
+import cv
+import os
+import time
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# Files in a frame directory with these extensions are read, in name order.
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".pgm", ".ppm")
+
+class SourceError(Exception):
+    pass
+
+class DeviceSource:
+    """Reads frames from a camera device."""
+
+    def __init__(self, index=-1):
+        self.capture = cv.CaptureFromCAM(index)
+
+    def read(self):
+        return cv.QueryFrame(self.capture)
+
+    def grab(self):
+        return cv.GrabFrame(self.capture)
+
+    def retrieve(self):
+        return cv.RetrieveFrame(self.capture)
+
+    def size(self):
+        return (int(cv.GetCaptureProperty(self.capture,
+                                          cv.CV_CAP_PROP_FRAME_WIDTH)),
+                int(cv.GetCaptureProperty(self.capture,
+                                          cv.CV_CAP_PROP_FRAME_HEIGHT)))
+
+    def request_size(self, size):
+        """Ask the camera to capture frames of the given size.
+
+        Cameras only support a few sizes, and some drivers ignore the request
+        altogether, so this returns the size the camera settled on."""
+        width, height = size
+        cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_WIDTH, width)
+        cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT,
+                              height)
+        return self.size()
+
+    def close(self):
+        pass
+
+class FileSource:
+    """Reads frames from a directory of images or from a video file.
+
+    With loop set, the frames start over from the beginning once they run out,
+    so the source never runs dry. A directory's images are all loaded up front
+    so that reading them doesn't touch the disk; a video file is decoded as
+    it's read.
+
+    latency, in seconds, is added to every grab to stand in for the time a
+    real camera takes to expose and read out a frame, so that several file
+    sources can play the part of several cameras."""
+
+    def __init__(self, path, loop=True, latency=0):
+        self.path = path
+        self.loop = loop
+        self.latency = latency
+        self.frames = None
+        self.capture = None
+        self.position = 0
+        # The directory image grab() last latched, for retrieve() to copy.
+        self.grabbed = None
+        # Frames from a directory are copied into this before being handed
+        # out, so a pipe that works in place can't spoil the loaded images.
+        self.buffer = None
+
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path)
+                           if name.lower().endswith(IMAGE_EXTENSIONS))
+            self.frames = [cv.LoadImage(os.path.join(path, name))
+                           for name in names]
+            if not self.frames:
+                raise SourceError("No images found in %s." % (path,))
+        else:
+            self.capture = self._open_video()
+
+    def read(self):
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def grab(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.frames is not None:
+            self.grabbed = self._next_image()
+            return self.grabbed is not None
+        if cv.GrabFrame(self.capture):
+            return True
+        if not self.loop:
+            return False
+        # There's no reliable way to rewind a capture, so start afresh.
+        self.capture = self._open_video()
+        return bool(cv.GrabFrame(self.capture))
+
+    def retrieve(self):
+        if self.frames is not None:
+            return self._copy_image(self.grabbed)
+        return cv.RetrieveFrame(self.capture)
+
+    def size(self):
+        if self.frames is not None:
+            return cv.GetSize(self.frames[0])
+        return (int(cv.GetCaptureProperty(self.capture,
+                                          cv.CV_CAP_PROP_FRAME_WIDTH)),
+                int(cv.GetCaptureProperty(self.capture,
+                                          cv.CV_CAP_PROP_FRAME_HEIGHT)))
+
+    def request_size(self, size):
+        # Files are whatever size they were saved at.
+        return self.size()
+
+    def close(self):
+        self.frames = None
+        self.capture = None
+
+    def _next_image(self):
+        if self.position >= len(self.frames):
+            if not self.loop:
+                return None
+            self.position = 0
+        image = self.frames[self.position]
+        self.position += 1
+        return image
+
+    def _copy_image(self, image):
+        if image is None:
+            return None
+        if (self.buffer is None or
+            cv.GetSize(self.buffer) != cv.GetSize(image) or
+            self.buffer.nChannels != image.nChannels):
+            self.buffer = cv.CloneImage(image)
+        else:
+            cv.Copy(image, self.buffer)
+        return self.buffer
+
+    def _open_video(self):
+        capture = cv.CaptureFromFile(self.path)
+        if not capture:
+            raise SourceError("Couldn't open video %s." % (self.path,))
+        return capture
+
+def open_source(spec, latency=0):
+    """Open a source given a camera index or a path to frames.
+
+    latency is passed on to a FileSource; see there."""
+    if isinstance(spec, int) or str(spec).lstrip("-").isdigit():
+        return DeviceSource(int(spec))
+    return FileSource(spec, latency=latency)
@@ -0,0 +1,212 @@
+"""Staged, multi-core execution of image pipelines.
+
+Normally a pipeline runs as a chain of calls on whichever thread asked for an
+image, so only one core is ever busy. A StagedPipeline pulls the chain apart and
+gives each pipe its own worker, with a bounded queue feeding each one. While
+the last stage works on frame N, the one before it can start on frame N+1 and
+the camera can be read for frame N+2, so throughput approaches that of the
+slowest stage rather than the sum of all of them.
+
+Every stage has exactly one worker and the queues are first in, first out, so
+frames always come out in the order they went in."""
+
+import cv
+import multiprocessing
+import Queue
+import threading
+import time
+from capture import Frame
+from pipelines import default_pool
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# Workers are told to shut down by passing this down the pipeline.
+STOP = None
+
+def run_stage(stage, inbox, outbox, pool, detach_output, timings=None,
+              name=None):
+    """Process frames from inbox with stage and pass the results to outbox.
+
+    If timings is given, how long the stage takes on each frame is recorded
+    in it under name."""
+    while True:
+        frame = inbox.get()
+        if frame is STOP:
+            outbox.put(STOP)
+            return
+        if timings:
+            image = timings.time(name, stage.process, frame.image)
+        else:
+            image = stage.process(frame.image)
+        # The stage's input is ours to give back now, unless the stage passed
+        # it straight through.
+        if image is not frame.image:
+            pool.release(frame.image)
+        if detach_output:
+            # The output is about to be pickled off to another process, so it
+            # will never come back to this process's pool.
+            pool.detach(image)
+        outbox.put(Frame(frame.seq, frame.timestamp, image))
+
+class StagedPipeline:
+    """Runs each pipe of a pipeline on its own worker.
+
+    The pipeline is given as its first pipe, just as CameraModule builds it.
+    The pipes are unlinked from each other, so the pipeline belongs to the
+    StagedPipeline from then on.
+
+    Frames come from source, a callable which returns a Frame whose image the
+    pipeline is free to keep. Workers can be threads or processes; processes
+    get around the interpreter lock, but every frame has to be copied between
+    them.
+
+    With thread workers, each stage's time can be recorded in a Timings (see
+    driver.util.timing). Process workers can't record into ours, so they
+    aren't timed."""
+
+    THREAD_WORKERS = "thread"
+    PROCESS_WORKERS = "process"
+
+    def __init__(self, first_pipe, source, queue_depth=2,
+                 workers=THREAD_WORKERS, pool=None, timings=None):
+        if workers not in (self.THREAD_WORKERS, self.PROCESS_WORKERS):
+            raise ValueError("Unknown worker type %s." % (workers,))
+        self.source = source
+        self.queue_depth = queue_depth
+        self.workers = workers
+        self.pool = pool or default_pool
+        self.timings = None
+        if workers == self.THREAD_WORKERS:
+            self.timings = timings
+
+        self.stages = []
+        pipe = first_pipe
+        while pipe:
+            next_pipe = pipe.next_pipe
+            pipe.next_pipe = None
+            self.stages.append(pipe)
+            pipe = next_pipe
+
+        if workers == self.PROCESS_WORKERS:
+            make_queue = multiprocessing.Queue
+        else:
+            make_queue = Queue.Queue
+        # One inbox for each stage, plus one for finished frames.
+        self.queues = [make_queue(queue_depth)
+                       for i in range(len(self.stages) + 1)]
+
+        self.running = False
+        self.threads = []
+        self.processes = []
+
+        self.lock = threading.Condition(threading.Lock())
+        self.latest_frame = None
+        self.submitted = 0
+        self.completed = 0
+        self.source_errors = 0
+
+    def start(self):
+        """Start the feeder, the stage workers, and the collector."""
+        self.running = True
+        for i, stage in enumerate(self.stages):
+            args = (stage, self.queues[i], self.queues[i + 1], self.pool,
+                    self.workers == self.PROCESS_WORKERS, self.timings,
+                    "pipe." + stage.__class__.__name__)
+            if self.workers == self.PROCESS_WORKERS:
+                worker = multiprocessing.Process(
+                    target=run_stage, args=args,
+                    name=stage.__class__.__name__)
+                worker.daemon = True
+                self.processes.append(worker)
+            else:
+                worker = threading.Thread(
+                    target=run_stage, args=args,
+                    name=stage.__class__.__name__)
+                worker.daemon = True
+                self.threads.append(worker)
+            worker.start()
+
+        for target in (self._feed, self._collect):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop every worker once the frames already in flight are done."""
+        self.running = False
+        for worker in self.threads + self.processes:
+            worker.join()
+        self.threads = []
+        self.processes = []
+
+    def latest(self, timeout=None):
+        """Get the newest frame to make it through the whole pipeline.
+
+        This only blocks while waiting for the first frame, for up to timeout
+        seconds. Returns None if no frame has come through by then."""
+        with self.lock:
+            if self.latest_frame is None and timeout:
+                self.lock.wait(timeout)
+            return self.latest_frame
+
+    def depths(self):
+        """Get the depth of each stage's queue.
+
+        Returns a list of (stage name, frames queued, queue size) tuples, one
+        for each stage followed by one for finished frames waiting to be
+        collected."""
+        names = [stage.__class__.__name__ for stage in self.stages]
+        names.append("output")
+        return [(name, queue.qsize(), self.queue_depth)
+                for name, queue in zip(names, self.queues)]
+
+    def stats(self):
+        """Get a snapshot of the pipeline's counters as a dictionary."""
+        with self.lock:
+            return {"submitted": self.submitted,
+                    "completed": self.completed,
+                    "in_flight": self.submitted - self.completed,
+                    "source_errors": self.source_errors}
+
+    def _feed(self):
+        while self.running:
+            try:
+                frame = self.source()
+            except Exception as e:
+                # A bad read shouldn't take the whole pipeline down; try again
+                # shortly.
+                print "Pipeline source failed:", e
+                self.source_errors += 1
+                time.sleep(0.01)
+                continue
+            if self.workers == self.PROCESS_WORKERS:
+                # The frame is pickled off to the first stage's process, and
+                # its release there is on a copy our pool never leased.
+                self.pool.detach(frame.image)
+            # This blocks when the first stage is backed up, which is exactly
+            # what we want: the camera shouldn't get ahead of the pipeline.
+            self.queues[0].put(frame)
+            with self.lock:
+                self.submitted += 1
+        self.queues[0].put(STOP)
+
+    def _collect(self):
+        last_seq = 0
+        while True:
+            frame = self.queues[-1].get()
+            if frame is STOP:
+                return
+            if frame.seq <= last_seq:
+                # Can't happen with one worker per stage, but if it ever does
+                # we'd rather drop a frame than show them out of order.
+                print "Dropping out of order frame", frame.seq
+                continue
+            last_seq = frame.seq
+            # Whoever asks for this frame may keep it for as long as they like,
+            # so it can't go back to the pool.
+            self.pool.detach(frame.image)
+            with self.lock:
+                self.latest_frame = frame
+                self.completed += 1
+                self.lock.notify_all()
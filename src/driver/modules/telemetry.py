@@ -0,0 +1,296 @@
+"""Encoder telemetry from the motion controller.
+
+The Arduino sends a line "E <millis> <left> <right>" about a hundred times a
+second, giving each wheel's signed encoder position in ticks (see
+motion_control.pde). A TelemetryReader reads these on a background thread,
+works out where the robot is from them by dead reckoning, and records every
+sample in an OdometryRing.
+
+The ring is a handful of preallocated arrays rather than a list of objects, so
+it takes the same few dozen bytes per sample whether it's been running for a
+minute or a day, and once full it simply overwrites the oldest samples."""
+
+import array
+import math
+import select
+import threading
+import time
+import serial
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class Sample:
+    """One encoder reading and the pose worked out from it."""
+
+    def __init__(self, timestamp, left, right, x, y, theta):
+        self.timestamp = timestamp
+        self.left = left
+        self.right = right
+        self.x = x
+        self.y = y
+        self.theta = theta
+
+class EncoderParser:
+    """Picks encoder reports out of the Arduino's serial output.
+
+    Data can be fed in however it arrives; partial lines are kept until the
+    rest shows up. Lines that aren't encoder reports, like the status messages
+    the Arduino prints, are skipped."""
+
+    # Longest partial line we'll hold on to. Anything longer is line noise.
+    MAX_LINE = 128
+
+    def __init__(self):
+        self.partial = ""
+        self.skipped = 0
+
+    def reset(self):
+        """Forget any partial line, e.g. because the port was reopened."""
+        self.partial = ""
+
+    def feed(self, data):
+        """Parse a chunk of data, returning a list of (millis, left, right)."""
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        if len(self.partial) > self.MAX_LINE:
+            self.partial = ""
+            self.skipped += 1
+        reports = []
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 4 or fields[0] != "E":
+                self.skipped += 1
+                continue
+            try:
+                reports.append((int(fields[1]), int(fields[2]),
+                                int(fields[3])))
+            except ValueError:
+                self.skipped += 1
+        return reports
+
+class OdometryRing:
+    """A fixed size ring of odometry samples, oldest overwritten first.
+
+    Timestamps must be added in increasing order, which lets us find samples
+    by time with a binary search. Safe to share between threads."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # One array per field. Poses are kept in single precision, which is
+        # plenty for a robot measured in inches.
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.lefts = array.array('i', [0]) * capacity
+        self.rights = array.array('i', [0]) * capacity
+        self.xs = array.array('f', [0.0]) * capacity
+        self.ys = array.array('f', [0.0]) * capacity
+        self.thetas = array.array('f', [0.0]) * capacity
+        # Index the next sample will be written at, and how many we hold.
+        self.head = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        """Get the memory taken by the sample arrays."""
+        return sum(a.itemsize * len(a) for a in (
+                self.timestamps, self.lefts, self.rights, self.xs, self.ys,
+                self.thetas))
+
+    def append(self, timestamp, left, right, x, y, theta):
+        with self.lock:
+            i = self.head
+            self.timestamps[i] = timestamp
+            self.lefts[i] = left
+            self.rights[i] = right
+            self.xs[i] = x
+            self.ys[i] = y
+            self.thetas[i] = theta
+            self.head = (i + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.count = 0
+
+    def latest(self):
+        """Get the newest sample, or None if there aren't any."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            return self._sample(self.count - 1)
+
+    def at(self, timestamp):
+        """Get the newest sample taken at or before timestamp.
+
+        If every sample is newer than that, the oldest one is returned. Returns
+        None if there are no samples at all."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            # Binary search over samples in age order, 0 being the oldest.
+            low, high = 0, self.count - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.timestamps[self._index(middle)] <= timestamp:
+                    low = middle
+                else:
+                    high = middle - 1
+            return self._sample(low)
+
+    def _index(self, n):
+        # Array index of the nth oldest sample. Must hold the lock.
+        return (self.head - self.count + n) % self.capacity
+
+    def _sample(self, n):
+        i = self._index(n)
+        return Sample(self.timestamps[i], self.lefts[i], self.rights[i],
+                      self.xs[i], self.ys[i], self.thetas[i])
+
+class TelemetryReader:
+    """Reads encoder reports from a serial connection on a background thread.
+
+    `connection` is called to get the serial connection to read from, which
+    may change as the port is reopened, or be None while it's closed. If a read
+    fails, `on_error` is called with the connection that failed, so whoever
+    owns it can reopen it.
+
+    Poses are in the same units as the robot's geometry, with x pointing
+    forward from where the robot started and theta counterclockwise in
+    radians."""
+
+    def __init__(self, connection, ring, body_width, wheel_circumference,
+                 ticks_per_rev, on_error=None):
+        self.connection = connection
+        self.ring = ring
+        self.body_width = body_width
+        self.distance_per_tick = float(wheel_circumference) / ticks_per_rev
+        self.on_error = on_error
+
+        self.parser = EncoderParser()
+        self.x = 0.0
+        self.y = 0.0
+        self.theta = 0.0
+        self.last_ticks = None
+        self.last_millis = None
+        # Host time at which the Arduino's clock read zero, as best we know.
+        self.clock_offset = None
+
+        self.samples = 0
+        self.errors = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run,
+                                       name="TelemetryReader")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def pose(self):
+        """Get the latest (x, y, theta), or None before the first report."""
+        sample = self.ring.latest()
+        if sample is None:
+            return None
+        return sample.x, sample.y, sample.theta
+
+    def velocity(self, window=0.5):
+        """Get the (linear, angular) velocity over the last window seconds.
+
+        Linear velocity is in distance units per second, angular in radians
+        per second. Returns None until there are two samples to go on."""
+        latest = self.ring.latest()
+        if latest is None:
+            return None
+        earlier = self.ring.at(latest.timestamp - window)
+        elapsed = latest.timestamp - earlier.timestamp
+        if elapsed <= 0:
+            return None
+        left = (latest.left - earlier.left) * self.distance_per_tick
+        right = (latest.right - earlier.right) * self.distance_per_tick
+        return ((left + right) / 2 / elapsed,
+                (right - left) / self.body_width / elapsed)
+
+    def stats(self):
+        return {"samples": self.samples,
+                "skipped_lines": self.parser.skipped,
+                "errors": self.errors,
+                "history": len(self.ring)}
+
+    def feed(self, data, received_at):
+        """Parse and record a chunk of serial data received at received_at."""
+        for millis, left, right in self.parser.feed(data):
+            self.record(millis, left, right, received_at)
+
+    def record(self, millis, left, right, received_at):
+        """Integrate one encoder report into the pose and record it."""
+        if self.last_millis is not None and millis < self.last_millis:
+            # The Arduino's clock went backwards, so it must have been reset,
+            # and its tick counts with it. Carry on from where we are.
+            self.last_ticks = None
+            self.clock_offset = None
+        self.last_millis = millis
+
+        # Each report is timestamped with the Arduino's clock, which is much
+        # steadier than when we happened to read it. We line that up with ours
+        # using the report that arrived soonest after being sent.
+        offset = received_at - millis / 1000.0
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        timestamp = self.clock_offset + millis / 1000.0
+
+        if self.last_ticks is not None:
+            last_left, last_right = self.last_ticks
+            left_distance = (left - last_left) * self.distance_per_tick
+            right_distance = (right - last_right) * self.distance_per_tick
+            distance = (left_distance + right_distance) / 2
+            turn = (right_distance - left_distance) / self.body_width
+            # Assume we moved along the average heading over the interval.
+            heading = self.theta + turn / 2
+            self.x += distance * math.cos(heading)
+            self.y += distance * math.sin(heading)
+            self.theta += turn
+        self.last_ticks = (left, right)
+
+        self.ring.append(timestamp, left, right, self.x, self.y, self.theta)
+        self.samples += 1
+
+    def _run(self):
+        last_conn = None
+        while not self.stopping.is_set():
+            conn = self.connection()
+            if conn is None:
+                self.stopping.wait(0.1)
+                continue
+            if conn is not last_conn:
+                # Whatever was left of a line on the old connection is gone.
+                self.parser.reset()
+                last_conn = conn
+            try:
+                # Wait for data without holding up stop() for long, then take
+                # everything that's arrived in one go.
+                readable, _, _ = select.select([conn], [], [], 0.1)
+                if not readable:
+                    continue
+                data = conn.read(conn.inWaiting() or 1)
+            except (serial.SerialException, select.error, OSError,
+                    ValueError) as e:
+                # ValueError is what select gives us if the port was closed
+                # out from under us.
+                print "Telemetry read failed:", e
+                self.errors += 1
+                if self.on_error:
+                    self.on_error(conn)
+                self.stopping.wait(0.1)
+                continue
+            self.feed(data, time.time())
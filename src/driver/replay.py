@@ -0,0 +1,188 @@
+#! /usr/bin/env python
+"""Play a recorded session back through the driver.
+
+Sessions are recorded by running botdriver with -r <file>. Playing one back
+runs its commands through a BotDriver in the order they arrived, with the
+camera reading the recorded frames instead of a webcam. Each IMAGE request
+is answered where the recording says it was, with the frame that answered it
+the first time, even if the live driver was threaded or staged or answered
+several requests with one frame. Only the first camera is recorded, so
+requests for images from any other aren't answered. Nothing is sent
+anywhere and the motors aren't touched; instead, a checksum of everything
+the driver would have sent is printed at the end, which makes a replay handy
+as a regression test: if a change alters the output for a session, the
+checksum changes. The live driver keeps no checksum, so this only compares
+replays with each other.
+
+Usage, from the src/ directory:
+
+  python -m driver.replay [--realtime] [--timing] session.rcs
+
+Streaming (STREAM) is paced by the driver's own clock rather than by
+commands, so only images sent in answer to IMAGE requests are replayed."""
+
+import argparse
+import time
+import zlib
+import driver.settings as settings
+from driver.botdriver import BotDriver
+from driver.modules.camera import CameraModule
+from driver.modules.recording import COMMAND, SERVED, ReplaySource, \
+    SessionReader
+from driver.util.timing import Timings
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class ReplayCommunicationsModule:
+    """Stands in for the comms module, keeping a checksum of the output."""
+
+    def __init__(self):
+        self.checksum = 0
+        self.commands_sent = 0
+        self.media_sent = 0
+        self.bytes_sent = 0
+
+    def _sent(self, data):
+        self.checksum = zlib.crc32(data, self.checksum)
+        self.bytes_sent += len(data)
+
+    def wait_for_connections(self):
+        pass
+
+    def read_packets(self, timeout=None):
+        return []
+
+    def send_command(self, command):
+        self.commands_sent += 1
+        self._sent(command)
+
+    def send_media(self, media):
+        self.media_sent += 1
+        self._sent(media)
+
+    def media_ready(self):
+        return True
+
+    def send_stream_frame(self, seq, timestamp, media):
+        self.send_media(media)
+        return True
+
+    def stream_ready(self):
+        return True
+
+    def close(self):
+        pass
+
+class ReplayMotionModule:
+    """Stands in for the motion module, remembering what it was told."""
+
+    def __init__(self):
+        self.moves = []
+
+    def move(self, direction):
+        self.moves.append(("MOVE", direction))
+
+    def rotate(self, direction):
+        self.moves.append(("ROTATE", direction))
+
+    def stop(self):
+        self.moves.append(("STOP",))
+
+    def close(self):
+        pass
+
+def serve_recorded(driver, source, seq):
+    """Answer an IMAGE request with the recorded frame numbered seq."""
+    source.serve(seq)
+    driver.image_requests.add(0)
+    driver.serve_image_requests()
+    driver.scheduler.run_pending()
+    driver.send_outbox()
+
+def replay(reader, realtime=False, timings=None):
+    """Run a session's commands through a fresh BotDriver.
+
+    Returns the driver, whose comms and motion modules hold the results."""
+    # The replay shouldn't record itself, and frames have to be read in step
+    # with the commands that asked for them, so nothing runs on a worker.
+    settings.RECORD_SESSION = None
+    settings.MEDIA_WORKER = False
+    source = ReplaySource(reader)
+    camera = CameraModule(threaded=False, staged=False, timings=timings,
+                          source=source)
+    driver = BotDriver(ReplayCommunicationsModule(), camera,
+                       ReplayMotionModule())
+    driver.timings = timings
+
+    # Sessions recorded before served records were kept answer every IMAGE
+    # with the next recorded frame, which is only right for a driver that
+    # wasn't threaded or staged.
+    by_served = reader.count(SERVED) > 0
+    kinds = COMMAND
+    if by_served:
+        kinds = (COMMAND, SERVED)
+    # Stable, so records with the same timestamp keep their order.
+    records = sorted(reader.records(kinds),
+                     key=lambda record: record.timestamp)
+
+    started = None
+    for record in records:
+        if realtime:
+            if started is None:
+                started = (time.time(), record.timestamp)
+            delay = (record.timestamp - started[1]) - \
+                (time.time() - started[0])
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            if record.kind == SERVED:
+                serve_recorded(driver, source, record.frame_seq())
+            elif by_served:
+                connection, packet = record.command()
+                driver.decode_and_execute(packet, connection)
+                # Requests are answered by the served records instead.
+                driver.image_requests.clear()
+                driver.scheduler.run_pending()
+                driver.send_outbox()
+            else:
+                connection, packet = record.command()
+                driver.parse_and_execute(packet, connection)
+        except SystemExit:
+            # The session ended with a QUIT.
+            break
+    return driver
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("session", help="session file recorded with -r")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay at the pace the session was recorded")
+    parser.add_argument("--timing", action="store_true",
+                        help="time each step and print the results")
+    args = parser.parse_args()
+
+    reader = SessionReader(args.session)
+    if reader.recovered:
+        print "Session wasn't closed cleanly; recovered %d records." % (
+            len(reader),)
+    timings = None
+    if args.timing:
+        timings = Timings()
+
+    start = time.time()
+    driver = replay(reader, args.realtime, timings)
+    elapsed = time.time() - start
+
+    comms = driver.comms
+    print "Replayed %.1fs of session in %.2fs." % (reader.duration(), elapsed)
+    print "Frames read: %d" % (driver.camera.source.frames,)
+    print "Moves: %d" % (len(driver.motion.moves),)
+    print "Sent %d commands and %d images, %d bytes." % (
+        comms.commands_sent, comms.media_sent, comms.bytes_sent)
+    print "Output checksum: %08x" % (comms.checksum & 0xffffffff,)
+    if timings:
+        print "Timings:", timings.compact()
+    reader.close()
+
+if __name__ == "__main__":
+    main()
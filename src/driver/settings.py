@@ -2,16 +2,141 @@
 # Each module should have a section here for their settings.
 
 # BotDriver main module settings:
+# Time each step of getting an image out (reading the camera, each pipe,
+# encoding and sending), for the STATS command to report. When this is off
+# nothing is timed at all.
+TIMING = False
+# Number of recent runs of each step that the reported percentiles cover.
+TIMING_WINDOW = 512
+# Open the camera and the Arduino side by side in the background as soon as
+# the driver starts, instead of waiting until a command first needs them.
+# Either way the driver is listening before they're open.
+STARTUP_PREOPEN = True
+# Capture, process and encode images on a worker thread, so that motion
+# commands are run as soon as they arrive rather than after the frame in
+# progress. Mode changes also run on the worker, ahead of any images.
+MEDIA_WORKER = True
+# Seconds between checks for finished work while the worker is busy.
+MEDIA_POLL_INTERVAL = 0.005
+# File to record every command and raw camera frame to, for playing back with
+# driver/replay.py. Raw frames take up a lot of room: about 27MB a second at
+# 640x480 and 30 frames per second.
+RECORD_SESSION = None
 
 
 # Communications
 USE_BLUETOOTH = False
+# Address to listen on for Pilot. "" listens on every interface, which needs no
+# lookup of which one faces the network, so the driver starts offline too.
+BIND_ADDRESS = ""
+# Serve any number of Pilots at once over TCP.
+MULTI_VIEWER = False
+# Number of images that can wait to be sent to each viewer before the oldest
+# is dropped.
+VIEWER_QUEUE_DEPTH = 2
+# Send images as self-framed frames on the video channel, header and image in
+# one write, instead of their length on the control channel and the image on
+# the video channel. Pilot doesn't understand this yet.
+MEDIA_FRAMED = False
+# Send small writes right away rather than batching them (Nagle's algorithm).
+TCP_NODELAY = True
+# Kernel send buffer for each connection in bytes, or None for the default.
+SEND_BUFFER_BYTES = None
 
 # Motion
 ARDUINO_PORT = "/dev/ftdi"
 ARDUINO_BAUD = 115200
+# Write motion commands from a background thread, so a flaky serial link
+# doesn't stall the driver loop.
+MOTION_ASYNC = True
+# Number of commands that can wait to be written before the oldest is dropped.
+MOTION_QUEUE_SIZE = 16
+# Longest wait in seconds between attempts to reopen the serial port.
+MOTION_MAX_BACKOFF = 8.0
+# Read the encoder reports the Arduino sends and keep track of where we are.
+TELEMETRY = True
+# Seconds of encoder history to keep, and how many reports come in a second.
+# Each second of history takes about 2.8KB.
+TELEMETRY_HISTORY = 2 * 60 * 60
+TELEMETRY_RATE = 100
+# Robot geometry, which must match motion_control.pde. The units don't
+# matter as long as they're the same; poses come out in them too.
+BODY_WIDTH = 6.5
+WHEEL_CIRCUMFERENCE = 2.9
+TICKS_PER_REV = 20
 
 # Camera
 # Index of the default camera device.
 DEFAULT_CAMERA = -1
+# A directory of images or a video file to read frames from instead of the
+# camera, e.g. for testing without a webcam. Frames loop when they run out.
+CAMERA_FILE = None
+# Cameras to capture from together, e.g. [0, 1] for a stereo pair, as camera
+# indices or paths like CAMERA_FILE. Every camera's frames are taken at as
+# close to the same moment as they allow, and each has its own pipeline.
+# Multi-camera capture can't be threaded or staged. None uses just the one
+# camera above.
+CAMERA_DEVICES = None
+# Seconds each read from a file in CAMERA_DEVICES takes, to act like a real
+# camera when testing multi-camera capture without the cameras.
+CAMERA_FILE_LATENCY = 0
+# Whether to read the camera continuously on a background thread.
+CAMERA_THREADED = False
+# Number of frames kept in the background capture ring.
+CAMERA_RING_DEPTH = 4
+# What to do with new frames when readers fall behind: "oldest" overwrites the
+# oldest frame in the ring, "newest" throws the new frame away.
+CAMERA_DROP_POLICY = "oldest"
+# Seconds to wait for the first frame from the capture thread.
+CAMERA_FIRST_FRAME_TIMEOUT = 2.0
+# File to publish every raw frame to, for other processes on the board to read
+# with driver.modules.framebus.FrameBusReader, e.g. "/dev/shm/robotcamera".
+# It should be on a RAM-backed filesystem. None turns the bus off.
+FRAME_BUS = None
+# Number of frames the bus holds. Readers have until this many more frames
+# come in to finish with one.
+FRAME_BUS_SLOTS = 4
+# Size of the images sent to Pilot.
+CAMERA_RESOLUTION = (640, 480)
+# Ask the camera to capture at CAMERA_RESOLUTION, so frames needn't be resized.
+# Some cameras fail with "Inappropriate IOCTL for device" when asked; turn
+# this off for those.
+CAMERA_REQUEST_RESOLUTION = True
+# JPEG quality for images sent to Pilot, from 0 to 100.
+JPEG_QUALITY = 95
+# Largest number of bytes of encoded images kept around for repeat requests.
+JPEG_CACHE_MAX_BYTES = 4 * 1024 * 1024
+# Adjust JPEG quality and resolution to hold this frame rate, or this latency
+# in seconds for each image. Leave both as None to only adapt when a client
+# asks for it with the ADAPT command. Pilot doesn't understand the QUALITY
+# reports this sends on the control channel, so don't set these with it.
+ADAPTIVE_TARGET_FPS = None
+ADAPTIVE_TARGET_LATENCY = None
+# Delta mode: edge length of the tiles frames are split into, how different
+# (mean absolute difference per pixel) a tile has to be to get sent again, and
+# the most frames between keyframes.
+DELTA_TILE_SIZE = 32
+DELTA_THRESHOLD = 4.0
+DELTA_KEYFRAME_INTERVAL = 60
 
+# Door detection mode: find the door once, then follow it from frame to frame
+# with optical flow instead of detecting it again in every frame. The detector
+# only runs again when the share of tracked features left falls below
+# DOOR_TRACKING_MIN_CONFIDENCE, or after DOOR_REDETECT_INTERVAL frames if that
+# isn't None. Tracking mode shows the camera image rather than its edges, so
+# it changes what Pilot's DOOR button shows; it's off until it's been measured
+# on the robot (see driver.benchmarks.tracking).
+DOOR_TRACKING = False
+DOOR_TRACKING_MIN_CONFIDENCE = 0.5
+DOOR_REDETECT_INTERVAL = None
+
+# Pipelines
+# Largest number of bytes of idle image buffers the shared buffer pool keeps
+# around for reuse.
+BUFFER_POOL_MAX_BYTES = 16 * 1024 * 1024
+# Whether to run each pipeline stage on its own worker.
+PIPELINE_STAGED = False
+# Kind of worker for staged pipelines: "thread" or "process".
+PIPELINE_WORKERS = "thread"
+# Number of frames that can wait in front of each pipeline stage.
+PIPELINE_QUEUE_DEPTH = 2
@@ -0,0 +1,130 @@
+"""Incremental decoding of commands from Pilot.
+
+TCP is a streaming protocol, so there's no telling how the commands a client
+sends will be split up between reads: one read may hold half a command, or a
+dozen of them. A CommandDecoder keeps whatever is left over from each read and
+only hands back whole commands.
+
+Two command formats are understood, and may be mixed freely on a connection:
+
+  Text: The command name and its arguments separated by spaces and terminated
+    by a semicolon, e.g. "MOVE FORWARD;". This is what Pilot sends.
+  Binary: A single opcode byte with its high bit set, followed by a fixed
+    number of argument bytes for that opcode. Text commands never contain
+    bytes with the high bit set, so the two can't be confused.
+
+Either way, commands come out as (name, args) tuples, with args a list of
+strings exactly as they would have been written in the text format."""
+
+import struct
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+# Longest text command we'll wait for a terminator on before deciding the
+# client is sending us garbage.
+MAX_TEXT_COMMAND = 256
+
+# Argument values for binary commands, indexed by the argument byte.
+DIRECTIONS = ["FORWARD", "BACKWARD"]
+ROTATIONS = ["CLOCKWISE", "COUNTERCLOCKWISE"]
+
+def _no_args(data):
+    return []
+
+def _direction(data):
+    return [DIRECTIONS[ord(data[0])]]
+
+def _rotation(data):
+    return [ROTATIONS[ord(data[0])]]
+
+def _frame_rate(data):
+    # Frame rates are sent in tenths of a frame per second.
+    tenths, = struct.unpack("!H", data)
+    return [str(tenths / 10.0)]
+
+# Opcode -> (command name, number of argument bytes, argument decoder)
+OPCODES = {
+    0x80: ("QUIT", 0, _no_args),
+    0x81: ("IMAGE", 0, _no_args),
+    0x82: ("EDGE", 0, _no_args),
+    0x83: ("RAW", 0, _no_args),
+    0x84: ("DOOR", 0, _no_args),
+    0x85: ("MOVE", 1, _direction),
+    0x86: ("ROTATE", 1, _rotation),
+    0x87: ("STREAM", 2, _frame_rate),
+    0x88: ("STOP_STREAM", 0, _no_args),
+    0x89: ("STATS", 0, _no_args),
+    0x8a: ("STOP", 0, _no_args),
+    }
+
+OPCODE_NAMES = dict((name, opcode)
+                    for opcode, (name, size, decode) in OPCODES.items())
+
+class CommandError(Exception):
+    pass
+
+def encode_binary(name, *args):
+    """Encode a command in the binary format."""
+    if name not in OPCODE_NAMES:
+        raise CommandError("No binary opcode for %s." % (name,))
+    opcode = OPCODE_NAMES[name]
+    if name == "MOVE":
+        return chr(opcode) + chr(DIRECTIONS.index(args[0]))
+    elif name == "ROTATE":
+        return chr(opcode) + chr(ROTATIONS.index(args[0]))
+    elif name == "STREAM":
+        return chr(opcode) + struct.pack("!H", int(float(args[0]) * 10))
+    return chr(opcode)
+
+def encode_text(name, *args):
+    """Encode a command in the text format."""
+    return " ".join((name,) + args) + ";"
+
+class CommandDecoder:
+    """Turns a stream of bytes from one connection into whole commands."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.errors = 0
+
+    def feed(self, data):
+        """Add data from the connection, and return any complete commands."""
+        if self.buffer:
+            data = self.buffer + data
+        commands = []
+        position = 0
+        length = len(data)
+
+        while position < length:
+            opcode = ord(data[position])
+            if opcode & 0x80:
+                if opcode not in OPCODES:
+                    # We can't know how long an unknown command is, so the best
+                    # we can do is skip the byte and hope to resynchronize.
+                    self.errors += 1
+                    position += 1
+                    continue
+                name, size, decode = OPCODES[opcode]
+                if position + 1 + size > length:
+                    break
+                try:
+                    args = decode(data[position + 1:position + 1 + size])
+                except IndexError:
+                    self.errors += 1
+                else:
+                    commands.append((name, args))
+                position += 1 + size
+            else:
+                end = data.find(";", position)
+                if end < 0:
+                    if length - position > MAX_TEXT_COMMAND:
+                        self.errors += 1
+                        position = length
+                    break
+                parts = data[position:end].split()
+                if parts:
+                    commands.append((parts[0], parts[1:]))
+                position = end + 1
+
+        self.buffer = data[position:]
+        return commands
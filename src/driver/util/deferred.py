@@ -0,0 +1,81 @@
+"""Values which are built only when they're first needed.
+
+Opening the camera or the serial port can take a second or more, and
+neither is needed until Pilot asks for an image or a move, so the driver
+wraps them in Deferreds rather than opening them before it starts listening.
+A Deferred can also be started in the background, so that several of them
+open side by side while the driver waits for its first connection; get()
+then only waits for whatever hasn't finished yet."""
+
+import sys
+import threading
+import time
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class Deferred:
+    """Builds a value by calling factory, once, when it's first asked for.
+
+    If building fails, the error is raised from get() and the next get()
+    tries again, so a camera that wasn't plugged in at startup can still be
+    opened later."""
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "deferred")
+        self.value = None
+        self.done = False
+        # sys.exc_info() of a failed background build, for get() to raise.
+        self.error = None
+        # Seconds the last build took.
+        self.elapsed = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """Start building the value on a background thread."""
+        if self.done or self.thread:
+            return
+        self.thread = threading.Thread(target=self._run,
+                                       name="deferred-%s" % (self.name,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get(self):
+        """Get the value, building it or waiting for it if need be."""
+        with self.lock:
+            if not self.done:
+                if self.error is None:
+                    self._build()
+                if self.error is not None:
+                    error, self.error = self.error, None
+                    raise error[0], error[1], error[2]
+            return self.value
+
+    def loaded(self):
+        """Whether the value has been built."""
+        return self.done
+
+    def settle(self, timeout=None):
+        """Wait for a background build to finish, if one is running, without
+        starting one. Returns whether the value has been built; a failed build
+        is left for get() to raise."""
+        thread = self.thread
+        if thread:
+            thread.join(timeout)
+        return self.done
+
+    def _run(self):
+        with self.lock:
+            if not self.done:
+                self._build()
+        self.thread = None
+
+    def _build(self):
+        start = time.time()
+        try:
+            self.value = self.factory()
+            self.done = True
+        except Exception:
+            self.error = sys.exc_info()
+        self.elapsed = time.time() - start
@@ -0,0 +1,86 @@
+"""A stand-in for the motion controller, for testing without a robot.
+
+FakeArduino opens a pseudo terminal and reads from its master end, so anything
+that opens `path` as a serial port ends up talking to it instead of an Arduino.
+Every byte it receives is recorded along with the time it arrived."""
+
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class FakeArduino:
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        # Raw mode, so the terminal driver doesn't echo or buffer up lines.
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        # (time received, byte) pairs.
+        self.log = []
+        self.arrived = threading.Condition(threading.Lock())
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="FakeArduino")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+
+    def write(self, data):
+        """Send data back to whoever has the port open."""
+        os.write(self.master, data)
+
+    def received(self):
+        """Get everything received so far as a string."""
+        with self.arrived:
+            return "".join(byte for _, byte in self.log)
+
+    def arrivals(self):
+        """Get a list of (time received, byte) pairs."""
+        with self.arrived:
+            return list(self.log)
+
+    def wait_for(self, count, timeout=None):
+        """Wait until at least count bytes have arrived.
+
+        Returns True if they did, or False if we timed out first."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.arrived:
+            while len(self.log) < count:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self.arrived.wait(remaining)
+            return True
+
+    def _run(self):
+        while not self.stopping.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            now = time.time()
+            with self.arrived:
+                self.log.extend((now, byte) for byte in data)
+                self.arrived.notify_all()
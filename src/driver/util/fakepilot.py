@@ -0,0 +1,212 @@
+"""A stand-in for the Pilot GUI, for load testing the driver.
+
+FakePilot connects to the driver's video and control ports the way Pilot
+does, video first, and sends it the same text commands: IMAGE requests,
+MOVE and ROTATE commands and mode switches, each at a rate of its own. Like
+Pilot it only has one IMAGE request outstanding at a time, and it reads the
+replies the same way: an image's length followed by a semicolon on the
+control channel, then the image itself on the video channel.
+
+Everything sent is logged with the time it went out, and every image with
+how long it took to arrive after it was asked for, so a load test can work
+out the driver's latencies from the client's point of view.
+
+A FakePilot can also stand in for one on a slow link: given a link_rate, it
+reads images no faster than that many bytes a second, so the driver finds
+its video channel backed up just as it would over a weak radio link."""
+
+import collections
+import itertools
+import select
+import socket
+import time
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+MOTION_COMMANDS = [("MOVE", "FORWARD"), ("ROTATE", "CLOCKWISE"),
+                   ("MOVE", "BACKWARD"), ("ROTATE", "COUNTERCLOCKWISE")]
+MODE_COMMANDS = ["EDGE", "DOOR", "RAW"]
+
+# Receive buffer for the video channel of a slow link, in bytes. A small one
+# makes the driver feel the link's rate right away, instead of after the
+# kernel has buffered a few images' worth.
+SLOW_LINK_BUFFER = 16384
+
+class FakePilot:
+
+    def __init__(self, host="127.0.0.1", video_port=9494, control_port=9495,
+                 source_address=None, link_rate=None):
+        self.host = host
+        self.video_port = video_port
+        self.control_port = control_port
+        # Connecting from an address of our own, e.g. another 127.x.x.x,
+        # keeps several FakePilots apart to a multi-viewer driver, which pairs
+        # connections up by the host they come from.
+        self.source_address = source_address
+        # Bytes a second to read the video channel at, or None for as fast as
+        # it comes.
+        self.link_rate = link_rate
+        # When the video channel may next be read, to hold link_rate.
+        self.video_next = 0
+        self.video_conn = None
+        self.control_conn = None
+
+        # (time sent, command) pairs, where command is the text sent.
+        self.sent = []
+        # Seconds from each IMAGE request to the whole image arriving.
+        self.round_trips = []
+        self.images = 0
+        self.image_bytes = 0
+        # IMAGE requests that came due while one was still outstanding, and
+        # ones that were never answered.
+        self.skipped = 0
+        self.lost = 0
+        # Anything else the driver said on the control channel.
+        self.replies = []
+
+        self.control_data = ""
+        # Lengths of images announced on the control channel that haven't
+        # finished arriving on the video channel.
+        self.lengths = collections.deque()
+        self.video_received = 0
+        self.requested_at = None
+
+    def connect(self, timeout=10.0):
+        """Connect to the driver, waiting up to timeout seconds for it to
+        start listening."""
+        deadline = time.time() + timeout
+        receive_buffer = None
+        if self.link_rate:
+            receive_buffer = SLOW_LINK_BUFFER
+        self.video_conn = self._connect(self.video_port, deadline,
+                                        receive_buffer)
+        self.control_conn = self._connect(self.control_port, deadline)
+
+    def send(self, command):
+        """Send a command, e.g. "MOVE FORWARD", and log it."""
+        now = time.time()
+        self.control_conn.sendall(command + ";")
+        self.sent.append((now, command))
+        return now
+
+    def run(self, duration, image_rate=0, command_rate=0, mode_interval=None,
+            request_timeout=2.0):
+        """Talk to the driver for duration seconds.
+
+        Asks for images image_rate times a second, sends motion commands
+        command_rate times a second, cycling through MOTION_COMMANDS, and
+        switches modes every mode_interval seconds. Rates of zero send
+        nothing. An IMAGE request that isn't answered within request_timeout
+        seconds is given up on.
+
+        A multi-viewer driver sends every image to every viewer, so the
+        round trip of a request is the time until the next image arrives,
+        whoever asked for it."""
+        motions = itertools.cycle(MOTION_COMMANDS)
+        modes = itertools.cycle(MODE_COMMANDS)
+        start = time.time()
+        deadline = start + duration
+        next_image = start if image_rate else None
+        next_command = start if command_rate else None
+        next_mode = start + mode_interval if mode_interval else None
+
+        while True:
+            now = time.time()
+            if now >= deadline:
+                break
+            if (self.requested_at is not None and
+                now - self.requested_at > request_timeout):
+                self.lost += 1
+                self.requested_at = None
+            if next_image is not None and now >= next_image:
+                if self.requested_at is None:
+                    self.requested_at = self.send("IMAGE")
+                else:
+                    self.skipped += 1
+                next_image += 1.0 / image_rate
+            if next_command is not None and now >= next_command:
+                self.send("%s %s" % motions.next())
+                next_command += 1.0 / command_rate
+            if next_mode is not None and now >= next_mode:
+                self.send(modes.next())
+                next_mode += mode_interval
+
+            due = [when for when in (next_image, next_command, next_mode)
+                   if when is not None]
+            conns = [self.control_conn]
+            if self.video_next <= time.time():
+                conns.append(self.video_conn)
+            else:
+                due.append(self.video_next)
+            wait = max(0, min(due + [deadline]) - time.time())
+            readable, _, _ = select.select(conns, [], [], wait)
+            for conn in readable:
+                self._read(conn)
+
+    def stats(self):
+        """Get a summary of what happened as a dictionary."""
+        return {"sent": len(self.sent),
+                "images": self.images,
+                "image_bytes": self.image_bytes,
+                "skipped": self.skipped,
+                "lost": self.lost,
+                "outstanding": self.requested_at is not None}
+
+    def close(self):
+        for conn in (self.video_conn, self.control_conn):
+            if conn:
+                conn.close()
+        self.video_conn = None
+        self.control_conn = None
+
+    def _connect(self, port, deadline, receive_buffer=None):
+        while True:
+            try:
+                conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                if receive_buffer:
+                    # Has to be set before connecting to cut the window down.
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                    receive_buffer)
+                if self.source_address:
+                    conn.bind((self.source_address, 0))
+                conn.connect((self.host, port))
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return conn
+            except socket.error:
+                conn.close()
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.01)
+
+    def _read(self, conn):
+        size = 65536
+        if conn is self.video_conn and self.link_rate:
+            # Small reads, so the rate holds over a fraction of an image.
+            size = max(1, min(size, int(self.link_rate / 50)))
+        data = conn.recv(size)
+        if not data:
+            raise socket.error("The driver closed the connection.")
+        if conn is self.control_conn:
+            self.control_data += data
+            replies = self.control_data.split(";")
+            self.control_data = replies.pop()
+            for reply in replies:
+                if reply.isdigit():
+                    self.lengths.append(int(reply))
+                else:
+                    self.replies.append(reply)
+        else:
+            self.video_received += len(data)
+            if self.link_rate:
+                self.video_next = (max(self.video_next, time.time()) +
+                                   len(data) / float(self.link_rate))
+        # An image is complete once its length has arrived and so have all
+        # of its bytes.
+        while self.lengths and self.video_received >= self.lengths[0]:
+            length = self.lengths.popleft()
+            self.video_received -= length
+            self.images += 1
+            self.image_bytes += length
+            if self.requested_at is not None:
+                self.round_trips.append(time.time() - self.requested_at)
+                self.requested_at = None
@@ -0,0 +1,171 @@
+"""Self-framed media messages for the video channel.
+
+In streaming mode the driver pushes frames to the client without being asked,
+so each one has to describe itself: a fixed size header carrying a magic
+string, the frame's sequence number, its capture timestamp and the length of
+the payload, followed by the payload itself. All fields are in network byte
+order.
+
+FrameWriter sends these frames without ever blocking the driver. If the socket
+can't take a whole frame, the rest is held back and finished on a later call;
+any frame offered while one is still in flight is dropped rather than queued,
+so a slow link only ever loses frames and never falls behind.
+
+Headers and payloads are never joined into one string; see send_parts()."""
+
+import errno
+import socket
+import struct
+import sys
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+FRAME_MAGIC = "RCFR"
+HEADER_FORMAT = "!4sIdI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Tells the kernel more data is coming right after this, so it holds a short
+# header back to go out in the same segment as the payload. Linux has it, but
+# Python 2 doesn't export it.
+MSG_MORE = getattr(socket, "MSG_MORE",
+                   0x8000 if sys.platform.startswith("linux") else 0)
+
+class FramingError(Exception):
+    pass
+
+def pack_header(seq, timestamp, length):
+    """Build the header for a frame."""
+    return struct.pack(HEADER_FORMAT, FRAME_MAGIC, seq & 0xFFFFFFFF,
+                       timestamp, length)
+
+def unpack_header(data):
+    """Parse a frame header into a (seq, timestamp, length) tuple."""
+    magic, seq, timestamp, length = struct.unpack(HEADER_FORMAT,
+                                                  data[:HEADER_SIZE])
+    if magic != FRAME_MAGIC:
+        raise FramingError("Bad frame magic %r." % (magic,))
+    return seq, timestamp, length
+
+def pack_frame(seq, timestamp, payload):
+    """Build a complete frame, header and payload."""
+    return pack_header(seq, timestamp, len(payload)) + payload
+
+def send_parts(conn, parts, flags=0):
+    """Send as much of a list of buffers as one call will take.
+
+    Where the socket has sendmsg, every part goes to the kernel in a single
+    scatter-gather call. Otherwise the first part goes on its own, flagged
+    MSG_MORE if there's more to follow so that it isn't sent as a segment of
+    its own. Nothing is copied either way. Returns the number of bytes
+    sent."""
+    if hasattr(conn, "sendmsg"):
+        return conn.sendmsg(parts, [], flags)
+    if len(parts) > 1:
+        flags |= MSG_MORE
+    return conn.send(parts[0], flags)
+
+def skip_bytes(parts, count):
+    """Drop the first count bytes from a list of memoryviews.
+
+    Returns a new list, without any parts that are used up."""
+    remaining = []
+    for part in parts:
+        if count >= len(part):
+            count -= len(part)
+        else:
+            remaining.append(part[count:])
+            count = 0
+    return remaining
+
+def frame_parts(seq, timestamp, payload):
+    """Get a frame as a list of memoryviews: its header, then its payload."""
+    parts = [memoryview(pack_header(seq, timestamp, len(payload)))]
+    if len(payload):
+        parts.append(memoryview(payload))
+    return parts
+
+def send_frame(conn, seq, timestamp, payload):
+    """Send a whole frame on a blocking socket, straight from payload."""
+    parts = frame_parts(seq, timestamp, payload)
+    while parts:
+        parts = skip_bytes(parts, send_parts(conn, parts))
+
+def recv_exactly(conn, length):
+    """Read exactly length bytes from a blocking socket."""
+    chunks = []
+    remaining = length
+    while remaining > 0:
+        chunk = conn.recv(remaining)
+        if not chunk:
+            raise FramingError("Connection closed mid-frame.")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return "".join(chunks)
+
+def recv_frame(conn):
+    """Read one frame from a blocking socket.
+
+    Returns a (seq, timestamp, payload) tuple."""
+    seq, timestamp, length = unpack_header(recv_exactly(conn, HEADER_SIZE))
+    return seq, timestamp, recv_exactly(conn, length)
+
+class FrameWriter:
+    """Writes frames to a socket without blocking, dropping what won't fit."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        # What's left of the frame being sent, as a list of memoryviews.
+        self.pending = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+
+    def busy(self):
+        """Whether part of a frame is still waiting to be sent."""
+        return self.pending is not None
+
+    def offer(self, seq, timestamp, payload):
+        """Try to send a frame.
+
+        Returns True if the frame was accepted. It may not have been sent in
+        full yet, but the rest will go out on later calls. Returns False if the
+        frame was dropped because an earlier one is still in flight."""
+        return self.offer_parts(frame_parts(seq, timestamp, payload))
+
+    def offer_parts(self, parts):
+        """Like offer(), but for data already split into memoryviews, such as
+        an image sent without a header."""
+        self.flush()
+        if self.busy():
+            self.dropped += 1
+            return False
+        self.pending = parts
+        self.flush()
+        return True
+
+    def flush(self):
+        """Send as much of the pending frame as the socket will take."""
+        while self.pending is not None:
+            try:
+                sent = send_parts(self.conn, self.pending, socket.MSG_DONTWAIT)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self._sent(sent)
+
+    def finish(self):
+        """Block until the pending frame, if any, has been sent in full.
+
+        Anything else written to the socket has to wait for this, or it would
+        end up in the middle of a frame."""
+        while self.pending is not None:
+            self._sent(send_parts(self.conn, self.pending))
+
+    def _sent(self, count):
+        self.bytes_sent += count
+        self.pending = skip_bytes(self.pending, count)
+        if not self.pending:
+            self.pending = None
+            self.sent += 1
@@ -0,0 +1,100 @@
+"""A least recently used cache of strings, capped by total size.
+
+Values are charged against the cap by their length, so this is meant for byte
+strings such as encoded images. It is safe to share between threads, and if
+several threads ask for the same missing key at once only one of them computes
+it; the others wait and get the same result."""
+
+import collections
+import threading
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class ByteLRUCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Keys being computed right now, and an event set when each is done.
+        self.in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_held = 0
+
+    def get(self, key):
+        """Get the value for key, or None if it isn't cached."""
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            # Put it back at the most recently used end.
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache a value. Values bigger than the whole cache aren't kept."""
+        with self.lock:
+            self._put(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Get the value for key, calling compute() to make it on a miss."""
+        while True:
+            with self.lock:
+                value = self.entries.pop(key, None)
+                if value is not None:
+                    self.entries[key] = value
+                    self.hits += 1
+                    return value
+                done = self.in_flight.get(key)
+                if done is None:
+                    # Nobody else is working on this; it's up to us.
+                    self.misses += 1
+                    done = self.in_flight[key] = threading.Event()
+                    break
+            # Someone else is computing this key. Once they're done it should
+            # be in the cache, unless it was too big to keep or they failed,
+            # in which case we go round again and compute it ourselves.
+            done.wait()
+
+        try:
+            value = compute()
+            with self.lock:
+                self._put(key, value)
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            done.set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes_held = 0
+
+    def stats(self):
+        """Get a snapshot of the cache's counters as a dictionary."""
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries),
+                    "bytes_held": self.bytes_held}
+
+    def _put(self, key, value):
+        # Must be called with the lock held.
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes_held -= len(old)
+        if len(value) > self.max_bytes:
+            return
+        self.entries[key] = value
+        self.bytes_held += len(value)
+        while self.bytes_held > self.max_bytes:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.bytes_held -= len(evicted)
+            self.evictions += 1
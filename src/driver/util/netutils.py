@@ -5,7 +5,36 @@ import socket
 __author__ = "Nick Pascucci (npascut1@gmail.com)"
 
 def get_ip_addr():
-    """Resolve the network-facing IP address."""
+    """Resolve the network-facing IP address.
+
+    Connecting a UDP socket sends nothing; it only makes the kernel pick the
+    interface it would route through. The address connected to is a literal,
+    so there's no DNS lookup to stall on, and with no route at all this falls
+    back to the loopback address."""
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(("gmail.com", 80))
-    return s.getsockname()[0]
+    try:
+        s.connect(("10.255.255.255", 1))
+        return s.getsockname()[0]
+    except socket.error:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+def describe_addr(addr):
+    """Describe an address sockets are bound to, for printing."""
+    if addr in ("", "0.0.0.0"):
+        return "all interfaces (%s)" % (get_ip_addr(),)
+    return addr
+
+def tune_socket(sock, nodelay=True, send_buffer=None):
+    """Set up a connected TCP socket for sending media.
+
+    With nodelay, small writes like commands and frame headers go out right
+    away instead of waiting on Nagle's algorithm for an acknowledgement.
+    send_buffer sets the kernel's send buffer size in bytes; bigger buffers
+    let a whole image be handed over at once on fast links, smaller ones keep
+    less stale data queued on slow ones. None leaves the system default."""
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
@@ -0,0 +1,164 @@
+"""Priority scheduling of the driver's work.
+
+Commands fall into three classes, most urgent first:
+
+  MOTION   MOVE, ROTATE, STOP and QUIT. These are run the moment they're
+           decoded, on the thread reading commands, and never wait behind
+           anything else. Sending one to the Arduino only queues a byte.
+  CONTROL  Mode changes and everything else that adjusts the camera or the
+           encoder, like ADAPT and DELTA.
+  MEDIA    Capturing, processing and encoding images.
+
+CONTROL and MEDIA work is queued and run by a single worker thread, control
+first and in order within each class. Capturing a frame in DOOR mode can
+take a few hundred milliseconds; with the worker doing it, the driver keeps
+reading commands the whole time, so a MOVE or STOP goes out right away
+instead of after the frame. Having one worker also means everything that
+touches the camera happens on the same thread, as it always has. Finished
+images are sent by the thread reading commands, which only writes as much
+at a time as the link will take, so a slow link doesn't hold up a MOVE
+either.
+
+Without a thread, queued work waits for run_pending(), which runs it all
+on the caller's thread in the same order; replays use this so that they
+come out the same every time."""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from timing import RollingHistogram
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+MOTION = 0
+CONTROL = 1
+MEDIA = 2
+
+CLASS_NAMES = {MOTION: "motion", CONTROL: "control", MEDIA: "media"}
+
+# Commands not listed here are CONTROL. IMAGE only notes that an image is
+# wanted; the capture it leads to is MEDIA work.
+COMMAND_CLASSES = {"MOVE": MOTION,
+                   "ROTATE": MOTION,
+                   "STOP": MOTION,
+                   "QUIT": MOTION,
+                   "IMAGE": MEDIA,
+                   }
+
+def command_class(name):
+    """Get the priority class of a command."""
+    return COMMAND_CLASSES.get(name, CONTROL)
+
+class CommandScheduler:
+    """Runs work by priority class, as described above.
+
+    submit() runs MOTION work straight away and queues the rest. The time
+    each piece of work spent waiting to start is kept for each class, and can
+    be read with stats()."""
+
+    def __init__(self, threaded=True, window=512):
+        self.threaded = threaded
+        # (priority, order, submitted, func, args) tuples.
+        self.queue = []
+        self.order = itertools.count()
+        self.condition = threading.Condition(threading.Lock())
+        self.running = False
+        self.thread = None
+        # Whether the worker is in the middle of something.
+        self.working = False
+
+        self.waits = dict((priority, RollingHistogram(window))
+                          for priority in CLASS_NAMES)
+        self.counts = dict((priority, 0) for priority in CLASS_NAMES)
+        self.failures = 0
+
+    def start(self):
+        """Start the worker thread, if we have one."""
+        if not self.threaded or self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name="CommandScheduler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker once it's finished what it's doing. Anything
+        still queued is thrown away."""
+        with self.condition:
+            self.running = False
+            del self.queue[:]
+            self.condition.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+    def submit(self, priority, func, *args):
+        """Run func(*args) at the given priority."""
+        if priority == MOTION:
+            with self.condition:
+                self.counts[MOTION] += 1
+                self.waits[MOTION].record(0.0)
+            func(*args)
+            return
+        with self.condition:
+            heapq.heappush(self.queue, (priority, self.order.next(),
+                                        time.time(), func, args))
+            self.condition.notify()
+
+    def run_pending(self):
+        """Run everything queued, on this thread. Does nothing when there's a
+        worker thread to do it."""
+        if self.threaded:
+            return
+        while True:
+            with self.condition:
+                if not self.queue:
+                    return
+                func, args = self._pop()
+            func(*args)
+
+    def idle(self):
+        """Whether there's nothing queued or being worked on."""
+        with self.condition:
+            return not self.queue and not self.working
+
+    def on_worker(self):
+        """Whether the caller is the worker thread."""
+        return self.thread is threading.current_thread()
+
+    def stats(self):
+        """Get each class's count and queue wait percentiles in seconds, as a
+        dictionary keyed by class name."""
+        with self.condition:
+            stats = {"queued": len(self.queue), "failures": self.failures}
+            for priority, name in CLASS_NAMES.items():
+                stats[name] = {"count": self.counts[priority],
+                               "wait": self.waits[priority].percentiles()}
+            return stats
+
+    def _pop(self):
+        """Take the most urgent work off the queue. Call with the lock held."""
+        priority, order, submitted, func, args = heapq.heappop(self.queue)
+        self.counts[priority] += 1
+        self.waits[priority].record(time.time() - submitted)
+        return func, args
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.working = False
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                func, args = self._pop()
+                self.working = True
+            try:
+                func(*args)
+            except Exception:
+                # One bad command mustn't take the worker down with it.
+                self.failures += 1
+                traceback.print_exc()
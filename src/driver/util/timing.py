@@ -0,0 +1,149 @@
+"""Lightweight timing of the work done for each image.
+
+A Timings object keeps a RollingHistogram for each named step, such as reading
+the camera, each pipe in the pipeline, JPEG encoding and sending. Each
+histogram holds the durations of the last few hundred runs, so its percentiles
+follow what the robot is doing now rather than averaging over its whole
+uptime.
+
+Recording a duration is just a couple of array writes; sorting only happens
+when somebody asks for percentiles. When timing is turned off, callers skip
+all of this entirely (see CameraModule and BotDriver) rather than recording
+into a Timings that throws the numbers away."""
+
+import array
+import threading
+import time
+
+__author__ = "Nick Pascucci (npascut1@gmail.com)"
+
+class RollingHistogram:
+    """The distribution of the last `size` durations recorded, in seconds."""
+
+    def __init__(self, size=512):
+        self.size = size
+        self.samples = array.array('d', [0.0]) * size
+        self.next = 0
+        # Total number of samples ever recorded.
+        self.count = 0
+
+    def record(self, seconds):
+        self.samples[self.next] = seconds
+        self.next = (self.next + 1) % self.size
+        self.count += 1
+
+    def percentiles(self, points=(50, 95, 99)):
+        """Get the given percentiles of the window, then its maximum.
+
+        Returns None if nothing has been recorded."""
+        held = min(self.count, self.size)
+        if held == 0:
+            return None
+        ordered = sorted(self.samples[:held])
+        values = [ordered[min(held - 1, int(held * point / 100.0))]
+                  for point in points]
+        values.append(ordered[-1])
+        return values
+
+class Timings:
+    """Named RollingHistograms, safe to record into from any thread."""
+
+    def __init__(self, window=512):
+        self.window = window
+        self.histograms = {}
+        # Names in the order they were first seen, which is roughly the order
+        # the steps run in.
+        self.names = []
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = \
+                    RollingHistogram(self.window)
+                self.names.append(name)
+            histogram.record(seconds)
+
+    def time(self, name, func, *args):
+        """Call func(*args), record how long it took and return its result."""
+        start = time.time()
+        result = func(*args)
+        self.record(name, time.time() - start)
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            del self.names[:]
+
+    def summary(self):
+        """Get (name, count, p50, p95, p99, max) for each step, in seconds."""
+        with self.lock:
+            rows = []
+            for name in self.names:
+                histogram = self.histograms[name]
+                rows.append(tuple([name, histogram.count] +
+                                  histogram.percentiles()))
+            return rows
+
+    def compact(self):
+        """Get the summary as a single line, with times in microseconds.
+
+        Each step comes out as name:count,p50,p95,p99,max, with steps
+        separated by spaces, e.g.
+          camera.read:120,15020,16113,16900,17250 jpeg.encode:120,3110,..."""
+        parts = []
+        for row in self.summary():
+            micros = tuple(int(value * 1e6) for value in row[2:])
+            parts.append("%s:%d,%d,%d,%d,%d" % (row[:2] + micros))
+        return " ".join(parts)
+
+class TimedPipe:
+    """Wraps a pipe and records how long it takes.
+
+    The time recorded is the pipe's own, not counting the pipes after it in
+    the chain, as long as those are wrapped too (see instrument())."""
+
+    # Time spent in wrapped pipes further down the chain, per thread.
+    downstream = threading.local()
+
+    def __init__(self, pipe, name, timings):
+        self.pipe = pipe
+        self.name = name
+        self.timings = timings
+
+    def process(self, image):
+        outer = getattr(self.downstream, "seconds", 0.0)
+        self.downstream.seconds = 0.0
+        start = time.time()
+        result = self.pipe.process(image)
+        elapsed = time.time() - start
+        self.timings.record(self.name, elapsed - self.downstream.seconds)
+        # Whoever called us counts all of our time as downstream of them.
+        self.downstream.seconds = outer + elapsed
+        return result
+
+def instrument(first_pipe, timings, prefix="pipe."):
+    """Wrap every pipe in a pipeline in a TimedPipe.
+
+    Each pipe is named for its class, e.g. "pipe.EdgeDetectPipe". Returns the
+    new first pipe; the pipes themselves are rewired to call through the
+    wrappers, so this should only be done to a pipeline once."""
+    first = None
+    previous = None
+    seen = {}
+    pipe = first_pipe
+    while pipe:
+        name = prefix + pipe.__class__.__name__
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name += ".%d" % (seen[name],)
+        timed = TimedPipe(pipe, name, timings)
+        if previous is None:
+            first = timed
+        else:
+            previous.next_pipe = timed
+        previous = pipe
+        pipe = pipe.next_pipe
+    return first
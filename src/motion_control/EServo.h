@@ -10,6 +10,11 @@ struct EncodedServo {
   int backward_point;
   int speed;
   int ticks;
+  // Which way the wheel was last driven: 1 forward, -1 backward. Ticks are counted into position
+  // with this sign, since the encoders can't tell which way the wheel is turning.
+  int direction;
+  // Signed count of ticks since startup, for odometry.
+  long position;
   long int last_tick;
   // Could also store the ISR here. Maybe later.
 };
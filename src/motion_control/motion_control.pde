@@ -7,6 +7,11 @@
   'f': Forward move for 1 second.
   'r': Right (clockwise) rotation of ~30 degrees.
   'l': Left (counter-clockwise) rotation of ~30 degrees.
+
+  Telemetry:
+  Every report_interval milliseconds the sketch sends a line "E <millis> <left> <right>", where
+  left and right are each wheel's signed encoder position in ticks since startup. Anything else it
+  sends is human-readable status.
 */
 
 #include <Servo.h>
@@ -32,17 +37,21 @@ const float body_width = 6.5;
 // Wheel circumference.
 const float wheel_circumference = 2.9;
 
+// Milliseconds between encoder reports.
+const int report_interval = 10;
+
 // ## Movement
 
 void move(bool forward){
   if(forward){
     Serial << "Moving forward." << endl;
     reset_ticks();
+    set_directions(1, 1);
     right_servo.servo.write(right_servo.forward_point);
     left_servo.servo.write(left_servo.forward_point);
 
     // Wait for the move to complete
-    delay(mseconds_per_move);
+    wait_reporting(mseconds_per_move);
 
     stop();
     // At some point it will be desirable to reconcile both sides and make sure they've moved the
@@ -52,11 +61,12 @@ void move(bool forward){
     Serial << "Moving backward." << endl;
     left_servo.ticks = 0;
     right_servo.ticks = 0;
+    set_directions(-1, -1);
     right_servo.servo.write(right_servo.backward_point);
     left_servo.servo.write(left_servo.backward_point);
 
     // Wait for the move to complete
-    delay(mseconds_per_move);
+    wait_reporting(mseconds_per_move);
 
     stop();
   }
@@ -99,12 +109,14 @@ void rotate(bool clockwise){
     Serial << "Rotating clockwise." << endl;
 
     // To rotate clockwise, we need to move the right servo backward and the left servo forward.
+    set_directions(1, -1);
     left_servo.servo.write(left_servo.forward_point);
     right_servo.servo.write(right_servo.backward_point);
 
     // We need to keep an eye on both servos at the same time, so while one of them is short, 
     // keep updating.
     while(left_servo.ticks < required_ticks || right_servo.ticks < required_ticks){
+      report_encoders();
       // Once we've reached our goal, stop the servo.
       if(left_servo.ticks >= required_ticks){
         left_servo.servo.write(left_servo.zero_point);
@@ -116,12 +128,14 @@ void rotate(bool clockwise){
   } else {
     Serial << "Rotating counter-clockwise." << endl;
     // Clockwise is the opposite.
+    set_directions(-1, 1);
     left_servo.servo.write(left_servo.backward_point);
     right_servo.servo.write(right_servo.forward_point);
 
     // We need to keep an eye on both servos at the same time, so while one of them is short, 
     // keep updating.
     while(left_servo.ticks < required_ticks || right_servo.ticks < required_ticks){
+      report_encoders();
       // Once we've reached our goal, stop the servo.
       if(left_servo.ticks >= required_ticks){
         left_servo.servo.write(left_servo.zero_point);
@@ -185,6 +199,7 @@ void attach_encoder_interrupts(){
 */
 void right_encoder_tick(){
   right_servo.ticks++;
+  right_servo.position += right_servo.direction;
   toggle(13);
 }
 
@@ -193,9 +208,51 @@ void right_encoder_tick(){
 */
 void left_encoder_tick(){
   left_servo.ticks++;
+  left_servo.position += left_servo.direction;
   toggle(13);
 }
 
+/**
+   Set the sign encoder ticks are counted with. We leave this alone when stopping, so that ticks
+   from the wheels coasting to a halt still count in the direction they were going.
+*/
+void set_directions(int left, int right){
+  noInterrupts();
+  left_servo.direction = left;
+  right_servo.direction = right;
+  interrupts();
+}
+
+// ## Telemetry
+unsigned long last_report = 0;
+
+/**
+   Send an encoder report, if one is due.
+*/
+void report_encoders(){
+  unsigned long now = millis();
+  if(now - last_report < report_interval){
+    return;
+  }
+  last_report = now;
+  // The positions are updated from interrupts, and are too big to read in one go.
+  noInterrupts();
+  long left = left_servo.position;
+  long right = right_servo.position;
+  interrupts();
+  Serial << "E " << now << " " << left << " " << right << endl;
+}
+
+/**
+   Like delay(), but keeps sending encoder reports while we wait.
+*/
+void wait_reporting(unsigned long mseconds){
+  unsigned long start = millis();
+  while(millis() - start < mseconds){
+    report_encoders();
+  }
+}
+
 // ## Calibration
 // These two variables will be modified in interrupt contexts, so they need to be declared volatile.
 volatile int speed_calibration = 0;
@@ -335,6 +392,11 @@ void setup(){
   right_servo.forward_point = 107;
   right_servo.backward_point = 82;
 
+  left_servo.direction = 1;
+  left_servo.position = 0;
+  right_servo.direction = 1;
+  right_servo.position = 0;
+
   attach_encoder_interrupts();
 
   blink(3);
@@ -342,6 +404,7 @@ void setup(){
 }
 
 void loop(){
+  report_encoders();
   // Read a char from serial buffer,
   if(Serial.available() > 0){
     char cmd = Serial.read();